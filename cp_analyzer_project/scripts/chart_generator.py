@@ -12,6 +12,17 @@ import pandas as pd
 import os
 import json
 
+from data_analyzer import CPDataAnalyzer, BOX_MAX_POINTS, SCATTER_MAX_POINTS
+
+# 单个参数的芯片数超过该值时，points模式自动改用WebGL散点图并抽样显示
+WEBGL_DIE_THRESHOLD = 100000
+
+# 抽样散点图的全部芯片数据（下钻数据）所在的子目录
+DIE_DATA_DIR = 'dies'
+
+# 需要根据上限中的参考单位从A换算的参数
+DYNAMIC_UNIT_PARAMS = ["IDSS1", "IDSS2", "IDSS3"]
+
 class CPChartGenerator:
     """
     CP测试数据图表生成类
@@ -29,6 +40,81 @@ class CPChartGenerator:
         self.analyzer = analyzer
         self.charts = {}
         self.output_dir = "./output"
+        # 箱型图模式：'points' 嵌入全部数据点由浏览器计算统计量；
+        # 'summary' 在服务端计算四分位数、须和均值，只嵌入须外的异常点（最多 max_box_points 个）；
+        # 'webgl' 使用服务端统计量，芯片数据点抽样后用WebGL散点图（Scattergl）显示（最多 max_scatter_points 个）
+        self.box_mode = 'points'
+        self.max_box_points = BOX_MAX_POINTS
+        self.max_scatter_points = SCATTER_MAX_POINTS
+        # 抽样显示的参数 -> {'file': 全部芯片数据CSV的相对路径, 'shown': 显示的点数, 'total': 芯片数}
+        self.drilldown_files = {}
+        # (参数, 目标单位) -> (数据版本号, 换算视图分析器)
+        self._data_views = {}
+    
+    def data_view(self, param):
+        """
+        获取绘制参数图表使用的数据分析器
+        
+        BV2-BV1 由 BV2、BV1 两列计算；IDSS1/2/3 按上限中的参考单位（uA/nA）从A换算。
+        这两类参数返回一个只读的视图分析器：数据为 df_clean 的浅拷贝加上计算或换算后的参数列，
+        按 (参数, 目标单位) 缓存，df_clean 变化（数据版本号改变）时重新生成，不修改 self.analyzer 的数据。
+        其他参数直接返回 self.analyzer
+        
+        Args:
+            param (str): 参数名称
+            
+        Returns:
+            CPDataAnalyzer: 数据分析器，BV2或BV1不在数据中时返回None
+        """
+        df = self.analyzer.df_clean
+        if param == "BV2-BV1":
+            if "BV2" not in df.columns or "BV1" not in df.columns:
+                print(f"错误: BV2或BV1参数不在数据中")
+                return None
+            conversion_factor, target_unit = 1.0, ""
+        else:
+            conversion_factor, target_unit = self._unit_conversion(param)
+            if conversion_factor == 1.0 or param not in df.columns:
+                return self.analyzer
+        
+        key = (param, target_unit)
+        cached = self._data_views.get(key)
+        if cached is not None and cached[0] == self.analyzer.data_version:
+            return cached[1]
+        
+        if param == "BV2-BV1":
+            values = df["BV2"] - df["BV1"]
+        else:
+            print(f"应用单位换算: {param} 从 A 转换为 {target_unit} (乘以 {conversion_factor})")
+            values = df[param] * conversion_factor
+        
+        # 写时复制下 assign 只新建参数列，其余列与原数据共享
+        view = CPDataAnalyzer(None, [param], self.analyzer.limits)
+        view.df_clean = df.assign(**{param: values})
+        self._data_views[key] = (self.analyzer.data_version, view)
+        return view
+    
+    def _unit_conversion(self, param):
+        """
+        根据上限中的参考单位确定参数的换算因子和目标单位
+        
+        Returns:
+            tuple: (换算因子, 目标单位)，不需要换算时为 (1.0, "")
+        """
+        if param not in DYNAMIC_UNIT_PARAMS:
+            return 1.0, ""
+        
+        param_info = self.analyzer.get_parameter_info(param)
+        if not param_info or 'limits' not in param_info or 'upper' not in param_info['limits']:
+            return 1.0, ""
+        
+        # 提取参考单位
+        limit_upper = str(param_info['limits']['upper'])
+        if "uA" in limit_upper:
+            return 1e6, "uA"
+        if "nA" in limit_upper:
+            return 1e9, "nA"
+        return 1.0, ""
     
     def generate_boxplot_with_scatter(self, param):
         """
@@ -50,53 +136,18 @@ class CPChartGenerator:
             print(f"错误: 分析器的df_clean字段为空或未设置")
             return None
             
-        # 特殊处理BV2-BV1参数
-        if param == "BV2-BV1":
-            if "BV2" not in self.analyzer.df_clean.columns or "BV1" not in self.analyzer.df_clean.columns:
-                print(f"错误: BV2或BV1参数不在数据中")
-                return None
-            # 计算BV2-BV1的差值
-            self.analyzer.df_clean[param] = self.analyzer.df_clean["BV2"] - self.analyzer.df_clean["BV1"]
-            
-        # 特殊处理需要根据参考单位进行动态单位换算的参数
-        dynamic_unit_params = ["IDSS1", "IDSS2", "IDSS3"]
-        
-        if param in dynamic_unit_params:
-            # 获取参数信息以查找参考单位
-            param_info = self.analyzer.get_parameter_info(param)
-            if param_info and 'limits' in param_info and 'upper' in param_info['limits']:
-                # 提取参考单位
-                limit_upper = str(param_info['limits']['upper'])
-                # 初始化转换因子和目标单位
-                conversion_factor = 1.0
-                target_unit = ""
-                
-                # 根据参考单位确定转换因子
-                if "uA" in limit_upper:
-                    conversion_factor = 1e6
-                    target_unit = "uA"
-                elif "nA" in limit_upper:
-                    conversion_factor = 1e9
-                    target_unit = "nA"
-                
-                # 如果有有效的转换因子，应用单位换算
-                if conversion_factor != 1.0:
-                    print(f"应用单位换算: {param} 从 A 转换为 {target_unit} (乘以 {conversion_factor})")
-                    # 创建临时列进行单位换算
-                    temp_col = f"{param}_converted"
-                    self.analyzer.df_clean[temp_col] = self.analyzer.df_clean[param] * conversion_factor
-                    # 替换原始列
-                    self.analyzer.df_clean[param] = self.analyzer.df_clean[temp_col]
-                    # 删除临时列
-                    self.analyzer.df_clean.drop(columns=[temp_col], inplace=True)
+        # 派生参数和需要单位换算的参数从只读的换算视图中读取，不修改分析器的数据
+        analyzer = self.data_view(param)
+        if analyzer is None:
+            return None
             
         # 确保参数在数据中存在
-        if param not in self.analyzer.df_clean.columns:
+        if param not in analyzer.df_clean.columns:
             print(f"错误: 参数 {param} 不在清洗后的数据中")
             return None
             
         # 获取统计信息
-        stats = self.analyzer.calculate_statistics(param)
+        stats = analyzer.calculate_statistics(param)
         if not stats:
             print(f"错误: 无法计算参数 {param} 的统计信息")
             return None
@@ -114,22 +165,16 @@ class CPChartGenerator:
         )
         
         # 获取参数信息
-        param_info = self.analyzer.get_parameter_info(param)
+        param_info = analyzer.get_parameter_info(param)
         
-        # 获取箱型图数据
-        boxplot_data = self.analyzer.get_data_for_boxplot(param)
-        if boxplot_data is None or len(boxplot_data['y']) == 0:
+        # 获取按晶圆片分段的箱型图数据（散点图使用同一份数据）
+        boxplot_data = analyzer.get_boxplot_arrays(param)
+        if boxplot_data is None or len(boxplot_data['values']) == 0:
             print(f"错误: 无法获取参数 {param} 的箱型图数据或数据为空")
             return None
         
-        # 获取散点图数据
-        scatter_data = self.analyzer.get_data_for_scatter(param)
-        if scatter_data is None or len(scatter_data['y']) == 0:
-            print(f"错误: 无法获取参数 {param} 的散点图数据或数据为空")
-            return None
-            
         # 获取统计信息
-        stats = self.analyzer.calculate_statistics(param)
+        stats = analyzer.calculate_statistics(param)
         if stats is None:
             print(f"错误: 无法获取参数 {param} 的统计信息")
             return None
@@ -137,8 +182,10 @@ class CPChartGenerator:
         # 获取参数限制
         limits = param_info['limits']
         
-        # 获取晶圆片列表并排序
-        wafers = sorted(set(boxplot_data['x']))
+        # 获取有数据的晶圆片列表（已排序）
+        wafers = boxplot_data['wafers']
+        values = boxplot_data['values']
+        wafer_counts = np.diff(boxplot_data['offsets'])
         
         # 定义单位转换参数映射
         unit_conversions = {
@@ -158,8 +205,10 @@ class CPChartGenerator:
         }
         
         # 设置Y轴范围
-        y_min = min(boxplot_data['y']) * 0.95 if boxplot_data['y'] else 0
-        y_max = max(boxplot_data['y']) * 1.05 if boxplot_data['y'] else 1000
+        data_max = float(values.max())
+        data_min = float(values.min())
+        y_min = data_min * 0.95
+        y_max = data_max * 1.05
         
         # 如果有上下限，则考虑上下限 - 修改Y轴范围的设置逻辑
         if limits.get('upper') is not None:
@@ -171,8 +220,6 @@ class CPChartGenerator:
                 y_min = limits['lower'] * 0.95  # 设置为下限值减5%
         
         # 确保Y轴范围包含所有数据点
-        data_max = max(boxplot_data['y']) if boxplot_data['y'] else 0
-        data_min = min(boxplot_data['y']) if boxplot_data['y'] else 0
         y_max = max(y_max, data_max * 1.05)  # 确保Y轴上限高于最高数据点
         
         if y_min > 0:  # 如果当前下限大于0
@@ -182,27 +229,89 @@ class CPChartGenerator:
         y_min = min(y_min, 550)  # 确保Y轴下限低于最低标签位置
         
         # 添加箱型图
-        fig.add_trace(go.Box(
-            x=[float(wafers.index(x)) + 0.5 for x in boxplot_data['x']],  # 将x坐标转换为数值并向右平移0.5格
-            y=boxplot_data['y'],
+        box_style = dict(
             name='VALUE',
-            boxpoints='all',  # 显示所有点
-            jitter=0.3,  # 点的抖动程度
-            pointpos=0,  # 点的位置
-            marker=dict(
-                color='#1f77b4',  # D3 Category10 蓝色
-                size=1,  # 进一步减小散点大小
-                opacity=0.7  # 提高不透明度以增加可见性
-            ),
             line=dict(
                 color='#1f77b4',  # D3 Category10 蓝色
                 width=0.75  # 进一步减小线条宽度
             ),
             fillcolor='rgba(31, 119, 180, 0.1)',  # D3 蓝色半透明
             whiskerwidth=0.3,  # 胡须宽度进一步变细
-            boxmean=True,  # 显示均值
             showlegend=False
-        ))
+        )
+        point_marker = dict(
+            color='#1f77b4',  # D3 Category10 蓝色
+            size=1,  # 进一步减小散点大小
+            opacity=0.7  # 提高不透明度以增加可见性
+        )
+        
+        box_mode = self.box_mode
+        if box_mode == 'points' and len(values) > WEBGL_DIE_THRESHOLD:
+            print(f"参数 {param} 共有 {len(values)} 个数据点，改用WebGL散点图并抽样显示")
+            box_mode = 'webgl'
+        self.drilldown_files.pop(param, None)
+        
+        if box_mode == 'points':
+            fig.add_trace(go.Box(
+                x=np.repeat(np.arange(len(wafers)) + 0.5, wafer_counts),  # 将x坐标转换为数值并向右平移0.5格
+                y=values,
+                boxpoints='all',  # 显示所有点
+                jitter=0.3,  # 点的抖动程度
+                pointpos=0,  # 点的位置
+                marker=point_marker,
+                boxmean=True,  # 显示均值
+                **box_style
+            ))
+        else:
+            # 使用服务端预计算的统计量，不嵌入全部数据点
+            summary = analyzer.get_boxplot_summary(param, max_points=self.max_box_points)
+            fig.add_trace(go.Box(
+                x=np.arange(len(wafers)) + 0.5,
+                q1=summary['q1'],
+                median=summary['median'],
+                q3=summary['q3'],
+                lowerfence=summary['lowerfence'],
+                upperfence=summary['upperfence'],
+                mean=summary['mean'],
+                boxpoints=False,
+                **box_style
+            ))
+        
+        if box_mode == 'summary':
+            # 须外的异常点（或其分层抽样），使用固定的抖动使输出可复现
+            point_wafers = summary['point_wafers']
+            jitter = np.random.default_rng(0).uniform(-0.15, 0.15, len(point_wafers))
+            fig.add_trace(go.Scatter(
+                x=point_wafers + 0.5 + jitter,
+                y=summary['point_values'],
+                mode='markers',
+                name='Outlier',
+                marker=dict(point_marker, size=3),
+                hoverinfo='y',
+                showlegend=False
+            ))
+            if len(point_wafers) < summary['outlier_count']:
+                print(f"参数 {param} 共有 {summary['outlier_count']} 个异常点，图中显示抽样的 {len(point_wafers)} 个")
+        elif box_mode == 'webgl':
+            # 分层抽样的芯片数据点用WebGL渲染，全部数据导出为CSV供下钻查看
+            points = analyzer.get_decimated_points(param, max_points=self.max_scatter_points)
+            point_wafers = points['point_wafers']
+            jitter = np.random.default_rng(0).uniform(-0.15, 0.15, len(point_wafers))
+            fig.add_trace(go.Scattergl(
+                x=point_wafers + 0.5 + jitter,
+                y=points['point_values'],
+                mode='markers',
+                name='Die',
+                marker=point_marker,
+                hoverinfo='y',
+                showlegend=False
+            ))
+            if len(point_wafers) < points['total']:
+                self.drilldown_files[param] = {
+                    'file': self.export_die_data(param),
+                    'shown': len(point_wafers),
+                    'total': points['total']
+                }
         
         # 计算每个晶圆片的平均值，用于添加平均值标记
         wafer_means = {}
@@ -238,38 +347,40 @@ class CPChartGenerator:
             showlegend=False
         ))
         
-        # 添加交替的背景色带，使数据更容易阅读
+        # 所有形状和标注先构造为字典列表，最后在一次 update_layout 中设置，
+        # 避免每次 add_shape/add_annotation 都触发属性校验和布局更新
+        grid_line = dict(
+            color="rgba(180, 180, 180, 0.5)",  # 调整颜色为更柔和的灰色，增加不透明度
+            width=1,
+            dash="dash"  # 使用虚线样式
+        )
+        shapes = []
         for i in range(len(wafers)):
             x_pos = i + 0.5  # 将垂直网格线向右平移0.5格
-            fig.add_shape(
-                type="line",
-                x0=x_pos,
-                y0=y_min,
-                x1=x_pos,
-                y1=y_max,
-                line=dict(
-                    color="rgba(180, 180, 180, 0.5)",  # 调整颜色为更柔和的灰色，增加不透明度
-                    width=1,
-                    dash="dash"  # 使用虚线样式
-                ),
-                row=1,  # 指定添加到第一行（图表）
-                col=1
-            )
+            shapes.append(dict(type="line", xref="x", yref="y",
+                               x0=x_pos, y0=y_min, x1=x_pos, y1=y_max, line=grid_line))
             
             # 添加交替的背景色带，使数据更容易阅读
             if i % 2 == 0:  # 偶数列添加浅色背景
-                fig.add_shape(
-                    type="rect",
-                    x0=i,
-                    y0=y_min,
-                    x1=i+1,
-                    y1=y_max,
-                    fillcolor="rgba(240, 240, 240, 0.3)",  # 非常浅的灰色
-                    line=dict(width=0),
-                    layer="below",
-                    row=1,
-                    col=1
-                )
+                shapes.append(dict(type="rect", xref="x", yref="y",
+                                   x0=i, y0=y_min, x1=i + 1, y1=y_max,
+                                   fillcolor="rgba(240, 240, 240, 0.3)",  # 非常浅的灰色
+                                   line=dict(width=0), layer="below"))
+        
+        # 如果有上下限，则添加水平红色虚线和标签
+        annotations = []
+        for name, key in (("USL", 'upper'), ("LSL", 'lower')):
+            if limits.get(key) is None:
+                continue
+            shapes.append(dict(type="line", xref="x", yref="y", name=name,
+                               x0=0, y0=limits[key], x1=len(wafers), y1=limits[key],  # 横跨所有晶圆片
+                               line=dict(color="red", width=2, dash="dash")))
+            annotations.append(dict(x=0, y=limits[key], xref="x", yref="y",
+                                    text=f"{name}:{limits[key]}", showarrow=False,
+                                    font=dict(color="red", size=12), xanchor="left"))
+        
+        # 添加数据表格，显示每个Wafer的平均值和标准差
+        annotations.extend(self._add_wafer_stats_table(fig, param, stats))
         
         # 设置图表布局
         fig.update_layout(
@@ -323,71 +434,14 @@ class CPChartGenerator:
             width=1200,
             hovermode='closest',
             showlegend=True,
-            plot_bgcolor='rgba(250, 250, 250, 0.5)'  # 使用非常浅的灰色作为图表背景
+            plot_bgcolor='rgba(250, 250, 250, 0.5)',  # 使用非常浅的灰色作为图表背景
+            shapes=shapes,
+            annotations=annotations
         )
         
-        # 如果有上限，则添加水平红色虚线
-        if limits.get('upper') is not None:
-            fig.add_shape(
-                type="line",
-                x0=0,  # 调整起始位置
-                y0=limits['upper'],
-                x1=len(wafers),  # 调整结束位置
-                y1=limits['upper'],
-                line=dict(
-                    color="red",
-                    width=2,
-                    dash="dash",
-                ),
-                name="USL"
-            )
-            # 添加USL标签
-            fig.add_annotation(
-                x=0,  # 调整标签位置
-                y=limits['upper'],
-                text=f"USL:{limits['upper']}",
-                showarrow=False,
-                font=dict(
-                    color="red",
-                    size=12
-                ),
-                xanchor="left"
-            )
-        
-        # 如果有下限，则添加水平红色虚线
-        if limits.get('lower') is not None:
-            fig.add_shape(
-                type="line",
-                x0=0,  # 调整起始位置
-                y0=limits['lower'],
-                x1=len(wafers),  # 调整结束位置
-                y1=limits['lower'],
-                line=dict(
-                    color="red",
-                    width=2,
-                    dash="dash",
-                ),
-                name="LSL"
-            )
-            # 添加LSL标签
-            fig.add_annotation(
-                x=0,  # 调整标签位置
-                y=limits['lower'],
-                text=f"LSL:{limits['lower']}",
-                showarrow=False,
-                font=dict(
-                    color="red",
-                    size=12
-                ),
-                xanchor="left"
-            )
-        
         # 保存图表
         self.charts[param] = fig
         
-        # 添加数据表格，显示每个Wafer的平均值和标准差
-        self._add_wafer_stats_table(fig, param, stats)
-        
         return fig
         
     def _add_wafer_stats_table(self, fig, param, stats):
@@ -398,6 +452,9 @@ class CPChartGenerator:
             fig (Figure): Plotly图表对象
             param (str): 参数名称
             stats (dict): 统计信息字典
+            
+        Returns:
+            list: 表格行标签和批次号的标注（字典），由调用方统一设置到布局中
         """
         # 获取所有晶圆片并排序
         wafers = sorted(stats['by_lot'].keys())
@@ -481,8 +538,9 @@ class CPChartGenerator:
             {"y": 0.042, "label": "StdDev"}      # 第三行
         ]
         
+        annotations = []
         for pos in positions:
-            fig.add_annotation(
+            annotations.append(dict(
                 x=-0.002,  # 放置在Y轴左侧，向左移动0.2个单元格(原来是0.005，移动0.007)
                 y=pos["y"],  # 使用预定义位置
                 text=pos["label"],
@@ -497,10 +555,10 @@ class CPChartGenerator:
                 xanchor="right",  # 右对齐
                 yanchor="middle",
                 align="right"
-            )
+            ))
         
         # 增加下方空间，添加批次信息在表格下方居中
-        fig.add_annotation(
+        annotations.append(dict(
             x=0.5,
             y=-0.15 + (3 * 0.031),  # 向上移动3个单元格距离，每个单元格高度约为0.031
             xref="paper",
@@ -512,8 +570,153 @@ class CPChartGenerator:
                 size=12
             ),
             align="center"
+        ))
+        
+        return annotations
+        
+    def generate_correlation_heatmap(self, method='pearson', params=None):
+        """
+        生成参数相关系数热力图
+        
+        默认显示整体的相关系数矩阵，通过下拉菜单切换到各晶圆片的矩阵
+        
+        Args:
+            method (str): 相关系数类型，'pearson' 或 'spearman'
+            params (list): 参数列表，默认为分析器中的目标参数
+            
+        Returns:
+            Figure: Plotly图表对象
+        """
+        if not self.analyzer:
+            print(f"错误: 分析器对象未设置")
+            return None
+        
+        matrices = self.analyzer.correlation_matrices(params, methods=(method,))
+        if not matrices or method not in matrices:
+            print(f"错误: 无法计算 {method} 相关系数矩阵")
+            return None
+        
+        overall = matrices[method]['overall']
+        if overall.empty:
+            print(f"错误: 没有可计算相关系数的参数")
+            return None
+        
+        labels = list(overall.columns)
+        views = [('Overall', overall)] + [(f"Wafer {wafer}", matrix)
+                                         for wafer, matrix in matrices[method]['by_wafer'].items()]
+        
+        def cell_text(matrix):
+            return [['' if np.isnan(v) else f"{v:.2f}" for v in row] for row in matrix.to_numpy()]
+        
+        fig = go.Figure(go.Heatmap(
+            z=overall.to_numpy(),
+            x=labels,
+            y=labels,
+            text=cell_text(overall),
+            texttemplate='%{text}',
+            zmin=-1,
+            zmax=1,
+            colorscale='RdBu_r',
+            colorbar=dict(title=dict(text='r'))
+        ))
+        
+        buttons = [dict(label=name, method='restyle',
+                        args=[{'z': [matrix.to_numpy()], 'text': [cell_text(matrix)]}])
+                   for name, matrix in views]
+        
+        fig.update_layout(
+            title=dict(text=f"{method.capitalize()} Correlation", x=0.5, xanchor='center'),
+            updatemenus=[dict(buttons=buttons, direction='down', x=0, xanchor='left', y=1.12, yanchor='top')],
+            yaxis=dict(autorange='reversed'),
+            height=700,
+            width=800
+        )
+        
+        self.charts[f"correlation_{method}"] = fig
+        return fig
+    
+    def generate_stacked_wafer_map(self, stat='mean', params=None):
+        """
+        生成叠加晶圆图热力图
+        
+        整批晶圆按芯片坐标叠加后每个位置的统计量，每个参数一条热力图轨迹，通过下拉菜单切换；
+        失效率图中还包括按分箱号计算的失效率（Bin）
+        
+        Args:
+            stat (str): 统计量，'mean'、'median' 或 'fail_rate'
+            params (list): 参数列表，默认为分析器中的目标参数
+            
+        Returns:
+            Figure: Plotly图表对象
+        """
+        if not self.analyzer:
+            print(f"错误: 分析器对象未设置")
+            return None
+        
+        maps = self.analyzer.stacked_wafer_maps(params)
+        if maps is None:
+            print(f"错误: 无法计算叠加晶圆图")
+            return None
+        
+        views = [(param, grids[stat]) for param, grids in maps['params'].items()]
+        if stat == 'fail_rate' and maps['bin'] is not None:
+            views.append(('Bin', maps['bin']['fail_rate']))
+        if not views:
+            print(f"错误: 没有可绘制叠加晶圆图的参数")
+            return None
+        
+        titles = {'mean': 'Mean', 'median': 'Median', 'fail_rate': 'Fail Rate'}
+        scale = dict(colorscale='Reds', zmin=0, zmax=1) if stat == 'fail_rate' else dict(colorscale='Viridis')
+        
+        # 每个参数一条轨迹（数组按float32二进制嵌入），下拉菜单只切换可见性
+        fig = go.Figure([go.Heatmap(
+            z=grid,
+            x=maps['x'],
+            y=maps['y'],
+            name=name,
+            visible=(i == 0),
+            colorbar=dict(title=dict(text=name)),
+            hovertemplate='X=%{x}<br>Y=%{y}<br>%{z:.4g}<extra></extra>',
+            **scale
+        ) for i, (name, grid) in enumerate(views)])
+        
+        buttons = [dict(label=name, method='restyle',
+                        args=[{'visible': [j == i for j in range(len(views))]}])
+                   for i, (name, _) in enumerate(views)]
+        
+        fig.update_layout(
+            title=dict(text=f"Stacked Wafer Map: {titles.get(stat, stat)}", x=0.5, xanchor='center'),
+            updatemenus=[dict(buttons=buttons, direction='down', x=0, xanchor='left', y=1.12, yanchor='top')],
+            xaxis=dict(title=dict(text='X'), constrain='domain'),
+            yaxis=dict(title=dict(text='Y'), autorange='reversed', scaleanchor='x'),
+            height=700,
+            width=800
         )
         
+        self.charts[f"wafer_map_{stat}"] = fig
+        return fig
+    
+    def export_die_data(self, param, output_dir=None):
+        """
+        导出参数的全部芯片数据（CSV），作为抽样散点图的下钻数据
+        
+        Args:
+            param (str): 参数名称
+            output_dir (str): 输出目录
+            
+        Returns:
+            str: 相对于输出目录的CSV文件路径
+        """
+        output_dir = output_dir or self.output_dir
+        df = self.data_view(param).df_clean
+        columns = [col for col in ('Lot', 'Wafer', 'X', 'Y') if col in df.columns] + [param]
+        
+        relative_path = f"{DIE_DATA_DIR}/{param}.csv"
+        os.makedirs(os.path.join(output_dir, DIE_DATA_DIR), exist_ok=True)
+        df.loc[df[param].notna(), columns].to_csv(os.path.join(output_dir, relative_path),
+                                                  index=False, encoding='utf-8-sig')
+        return relative_path
+    
     def save_chart(self, param, output_dir=None):
         """
         保存图表到HTML文件
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+列式存储模块
+
+将数据表按块追加写入一个目录，每列一个二进制文件：
+数值列直接保存原始数组，文本列做字典编码后保存int32编码，
+列信息和各块行数记录在 meta.json 中。读取时数值列通过内存映射加载，不需要一次读入内存
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Any, Iterator
+
+META_FILE = 'meta.json'
+STORE_VERSION = 1
+
+# 文本列的编码类型和缺失值编码
+CODE_DTYPE = np.int32
+MISSING_CODE = -1
+
+
+def _nullable_dtype(dtype: Any) -> np.dtype:
+    """
+    能表示缺失值的数值类型：浮点数保持不变，整数和布尔提升为浮点数（int8/int16 -> float32，int32/int64 -> float64）
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'fc':
+        return dtype
+    return np.promote_types(dtype, np.float32)
+
+
+class ColumnarStore:
+    """
+    按块追加写入、按列内存映射读取的列式存储
+
+    写入:
+        with ColumnarStore(path, mode='w') as store:
+            for chunk in chunks:
+                store.append(chunk)
+
+    读取:
+        df = ColumnarStore(path).read(['Wafer', 'BVDSS1'])
+    """
+
+    def __init__(self, path: str, mode: str = 'r'):
+        """
+        打开列式存储
+
+        Args:
+            path: 存储目录
+            mode: 'r' 只读，'w' 新建（清空已有内容），'a' 追加
+        """
+        self.path = path
+        self.mode = mode
+        self.columns = []
+        self.chunks = []
+
+        if mode == 'w':
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name == META_FILE or name.endswith('.bin'):
+                    os.remove(os.path.join(path, name))
+            self._write_meta()
+        elif mode in ('r', 'a'):
+            meta_path = os.path.join(path, META_FILE)
+            if not os.path.exists(meta_path):
+                raise FileNotFoundError(f"列式存储不存在: {path}")
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.columns = meta['columns']
+            self.chunks = meta['chunks']
+        else:
+            raise ValueError(f"不支持的打开模式: {mode}")
+
+    def __enter__(self) -> 'ColumnarStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def n_rows(self) -> int:
+        """已写入的总行数"""
+        return int(sum(self.chunks))
+
+    @property
+    def column_names(self) -> List[str]:
+        """所有列名"""
+        return [column['name'] for column in self.columns]
+
+    def close(self) -> None:
+        """写入元数据"""
+        if self.mode != 'r':
+            self._write_meta()
+
+    def append(self, df: pd.DataFrame) -> None:
+        """
+        追加一块数据
+
+        新出现的列会为之前的行补缺失值，本块缺少的列同样补缺失值；整数和布尔列需要补缺失值时
+        先整列提升为浮点数再补NaN（不使用0之类同时也是有效值的占位值）。
+        数值类型不一致时整列提升为兼容类型，数值列中出现文本时整列改为字典编码
+
+        Args:
+            df: 数据块
+        """
+        if self.mode == 'r':
+            raise IOError("列式存储以只读方式打开，无法追加数据")
+
+        n = len(df)
+        known = {column['name']: column for column in self.columns}
+
+        for name in df.columns:
+            if name not in known:
+                known[name] = self._add_column(name, df[name])
+
+        for column in self.columns:
+            name = column['name']
+            if name in df.columns:
+                data = self._encode(column, df[name])
+            else:
+                if n:
+                    self._make_nullable(column)
+                data = np.full(n, self._fill_value(column), dtype=column['dtype'])
+
+            with open(self._file(column), 'ab') as f:
+                np.ascontiguousarray(data).tofile(f)
+
+        self.chunks.append(n)
+        self._write_meta()
+
+    def read(self, columns: Optional[List[str]] = None, mmap: bool = True,
+             categorical: bool = False) -> pd.DataFrame:
+        """
+        读取数据
+
+        Args:
+            columns: 要读取的列，默认全部
+            mmap: 数值列是否以写时复制的内存映射方式加载（修改只影响内存中的副本，不会写回文件）
+            categorical: 文本列是否返回分类类型
+
+        Returns:
+            pd.DataFrame: 数据表
+        """
+        return self._read_rows(columns, 0, self.n_rows, mmap, categorical)
+
+    def iter_chunks(self, columns: Optional[List[str]] = None, mmap: bool = True,
+                    categorical: bool = False) -> Iterator[pd.DataFrame]:
+        """
+        按写入时的块逐块读取
+
+        Args:
+            columns: 要读取的列，默认全部
+            mmap: 数值列是否以写时复制的内存映射方式加载（修改只影响内存中的副本，不会写回文件）
+            categorical: 文本列是否返回分类类型
+
+        Yields:
+            pd.DataFrame: 数据块
+        """
+        start = 0
+        for n in self.chunks:
+            yield self._read_rows(columns, start, n, mmap, categorical)
+            start += n
+
+    def read_chunks(self, indices: List[int], columns: Optional[List[str]] = None,
+                    categorical: bool = False) -> pd.DataFrame:
+        """
+        读取指定的若干块并合并为一张表
+
+        Args:
+            indices: 块序号列表
+            columns: 要读取的列，默认全部
+            categorical: 文本列是否返回分类类型
+
+        Returns:
+            pd.DataFrame: 数据表
+        """
+        starts = np.cumsum([0] + self.chunks)
+        frames = [self._read_rows(columns, int(starts[i]), self.chunks[i], False, categorical) for i in indices]
+        if not frames:
+            return self._read_rows(columns, 0, 0, False, categorical)
+        return pd.concat(frames, ignore_index=True)
+
+    def _read_rows(self, columns: Optional[List[str]], start: int, n: int,
+                   mmap: bool, categorical: bool) -> pd.DataFrame:
+        known = {column['name']: column for column in self.columns}
+        names = columns if columns is not None else self.column_names
+        data = {}
+
+        for name in names:
+            if name not in known:
+                raise KeyError(f"列式存储中不存在列: {name}")
+            column = known[name]
+            dtype = np.dtype(column['dtype'])
+
+            if n == 0:
+                values = np.empty(0, dtype=dtype)
+            elif mmap:
+                # 以普通ndarray视图交给pandas，底层仍是映射的文件
+                values = np.asarray(np.memmap(self._file(column), dtype=dtype, mode='c',
+                                              offset=start * dtype.itemsize, shape=(n,)))
+            else:
+                values = np.fromfile(self._file(column), dtype=dtype, count=n,
+                                     offset=start * dtype.itemsize)
+
+            if column['kind'] == 'dict':
+                values = pd.Categorical.from_codes(np.asarray(values), categories=column['categories'])
+                if not categorical:
+                    values = pd.Series(values).astype(column['text_dtype']).array
+            data[name] = values
+
+        return pd.DataFrame(data, columns=names, copy=False)
+
+    def _add_column(self, name: str, series: pd.Series) -> Dict[str, Any]:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            column = {'name': name, 'kind': 'dict', 'dtype': np.dtype(CODE_DTYPE).str,
+                      'categories': [], 'text_dtype': 'object'}
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            column = {'name': name, 'kind': 'numeric', 'dtype': np.dtype(series.dtype).str}
+        else:
+            column = {'name': name, 'kind': 'dict', 'dtype': np.dtype(CODE_DTYPE).str,
+                      'categories': [], 'text_dtype': str(series.dtype)}
+
+        column['file'] = f"c{len(self.columns):04d}.bin"
+        self.columns.append(column)
+
+        # 为之前写入的行补缺失值
+        previous = self.n_rows
+        if previous and column['kind'] == 'numeric':
+            column['dtype'] = _nullable_dtype(column['dtype']).str
+        fill = np.full(previous, self._fill_value(column), dtype=column['dtype'])
+        with open(self._file(column), 'wb') as f:
+            fill.tofile(f)
+        return column
+
+    def _encode(self, column: Dict[str, Any], series: pd.Series) -> np.ndarray:
+        if column['kind'] == 'dict':
+            # 字典编码：新出现的取值追加到类别列表末尾，已有编码保持不变
+            codes, uniques = pd.factorize(series)
+            categories = column['categories']
+            lookup = {value: code for code, value in enumerate(categories)}
+            mapping = np.empty(len(uniques) + 1, dtype=CODE_DTYPE)
+            mapping[-1] = MISSING_CODE
+            for i, value in enumerate(uniques):
+                value = str(value)
+                if value not in lookup:
+                    lookup[value] = len(categories)
+                    categories.append(value)
+                mapping[i] = lookup[value]
+            # 缺失值的factorize编码为-1，正好取到末尾的MISSING_CODE
+            return mapping[codes]
+
+        if not pd.api.types.is_numeric_dtype(series.dtype):
+            # 数值列中出现文本（或分类）数据：整列改为字典编码后再编码本块
+            self._convert_to_dict(column)
+            return self._encode(column, series)
+
+        values = series.to_numpy()
+        dtype = np.dtype(column['dtype'])
+        if values.dtype != dtype and not np.can_cast(values.dtype, dtype, casting='safe'):
+            self._promote(column, np.result_type(values.dtype, dtype))
+            dtype = np.dtype(column['dtype'])
+        return values.astype(dtype, copy=False)
+
+    def _promote(self, column: Dict[str, Any], dtype: np.dtype) -> None:
+        # 例如整数列中出现缺失值时提升为浮点数，需要重写已写入的数据
+        old = np.fromfile(self._file(column), dtype=column['dtype'])
+        self._rewrite(column, old.astype(dtype))
+        column['dtype'] = np.dtype(dtype).str
+
+    def _make_nullable(self, column: Dict[str, Any]) -> None:
+        # 整数和布尔列没有缺失值，补缺失值之前提升为浮点数
+        if column['kind'] == 'numeric':
+            dtype = _nullable_dtype(column['dtype'])
+            if dtype != np.dtype(column['dtype']):
+                self._promote(column, dtype)
+
+    def _convert_to_dict(self, column: Dict[str, Any]) -> None:
+        # 已写入的数值转为文本后做字典编码，缺失值保持缺失
+        old = np.fromfile(self._file(column), dtype=column['dtype'])
+        codes, uniques = pd.factorize(old)
+        self._rewrite(column, codes.astype(CODE_DTYPE))
+        column.update({'kind': 'dict', 'dtype': np.dtype(CODE_DTYPE).str,
+                       'categories': [str(value) for value in uniques], 'text_dtype': 'object'})
+
+    def _rewrite(self, column: Dict[str, Any], values: np.ndarray) -> None:
+        # 先写临时文件再替换，出错时原文件保持不变
+        tmp_path = self._file(column) + '.tmp'
+        values.tofile(tmp_path)
+        os.replace(tmp_path, self._file(column))
+
+    def _fill_value(self, column: Dict[str, Any]) -> Any:
+        if column['kind'] == 'dict':
+            return MISSING_CODE
+        return np.nan
+
+    def _file(self, column: Dict[str, Any]) -> str:
+        return os.path.join(self.path, column['file'])
+
+    def _write_meta(self) -> None:
+        meta = {
+            'version': STORE_VERSION,
+            'n_rows': self.n_rows,
+            'chunks': self.chunks,
+            'columns': self.columns
+        }
+        tmp_path = os.path.join(self.path, META_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
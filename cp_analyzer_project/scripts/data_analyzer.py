@@ -5,8 +5,37 @@
 晶圆厂CP测试数据分析模块
 """
 
+import warnings
 import pandas as pd
 import numpy as np
+from data_cleaner import CleanFlag, set_flags, group_quantiles_by_codes, group_moments, python_values
+from online_stats import StatsAccumulator
+
+# 统计表中的分位点
+STAT_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# 统计表的统计量列
+STAT_COLUMNS = ['count', 'mean', 'median', 'std', 'min', 'max', 'range'] + \
+               [f'q{int(q*100)}' for q in STAT_QUANTILES]
+
+# calculate_statistics 中整体统计和晶圆片统计包含的统计量
+OVERALL_STAT_COLUMNS = STAT_COLUMNS
+WAFER_STAT_COLUMNS = ['mean', 'median', 'std', 'min', 'max', 'count', 'range']
+
+# capability_table 在统计表上追加的列
+CAPABILITY_COLUMNS = ['usl', 'lsl', 'cpu', 'cpl', 'cp', 'cpk', 'fail_high', 'fail_low', 'fail_count', 'yield']
+
+# 相关系数计算时每块的行数
+CORRELATION_BLOCK_ROWS = 65536
+
+# 合格的分箱号
+GOOD_BINS = [1]
+
+# 预计算箱型图中最多嵌入的散点数
+BOX_MAX_POINTS = 2000
+
+# WebGL散点图中最多嵌入的芯片数据点数
+SCATTER_MAX_POINTS = 20000
 
 class CPDataAnalyzer:
     """
@@ -25,10 +54,50 @@ class CPDataAnalyzer:
             limits (dict): 参数限制字典，格式为 {参数名: {'upper': 上限值, 'lower': 下限值}}
         """
         self.df = df
-        self.df_clean = None
+        self._df_clean = None
+        self._data_version = 0
+        self._stats_cache = {}
+        self._table_cache = {}
         self.target_params = target_params or []
         self.limits = limits or {}
     
+    @property
+    def df_clean(self):
+        """
+        清洗后的数据
+        
+        重新赋值时自动使统计缓存失效。分析器自身不会原地修改这张表（需要补充列时重新赋值）；
+        调用方原地修改（例如 df_clean[col] = ...）后必须调用 mark_data_changed()，否则会读到过期的缓存统计量
+        """
+        return self._df_clean
+    
+    @df_clean.setter
+    def df_clean(self, df):
+        self._df_clean = df
+        self.mark_data_changed()
+    
+    @property
+    def data_version(self):
+        """数据版本号，df_clean每次变化时递增"""
+        return self._data_version
+    
+    def _ensure_column(self, column, default):
+        """
+        缺少列时以默认值补充；通过重新赋值 df_clean 添加（写时复制下只新建该列），
+        数据版本号随之递增，不会原地修改调用方的数据表
+        """
+        if column not in self._df_clean.columns:
+            print(f"警告: 数据中缺少{column}列，将使用默认值")
+            self.df_clean = self._df_clean.assign(**{column: default})
+    
+    def mark_data_changed(self):
+        """
+        标记df_clean已变化（例如原地修改了某一列），使统计缓存失效
+        """
+        self._data_version += 1
+        self._stats_cache.clear()
+        self._table_cache.clear()
+    
     def clean_data(self):
         """
         数据清洗
@@ -69,12 +138,12 @@ class CPDataAnalyzer:
                 # 根据上下限过滤异常值
                 if upper is not None:
                     # 标记超出上限的值
-                    df_clean.loc[df_clean[param] > upper * 1.5, f"{param}_outlier_high"] = True
+                    set_flags(df_clean, param, df_clean[param] > upper * 1.5, CleanFlag.OUTLIER_HIGH)
                     # 不移除异常值，只标记
                 
                 if lower is not None:
                     # 标记低于下限的值
-                    df_clean.loc[df_clean[param] < lower * 0.5, f"{param}_outlier_low"] = True
+                    set_flags(df_clean, param, df_clean[param] < lower * 0.5, CleanFlag.OUTLIER_LOW)
                     # 不移除异常值，只标记
         
         # 保存清洗后的数据
@@ -128,30 +197,138 @@ class CPDataAnalyzer:
         Returns:
             dict: 箱型图数据字典
         """
+        arrays = self.get_boxplot_arrays(param)
+        if arrays is None:
+            return None
+        
+        x = np.repeat(np.asarray(arrays['wafers'], dtype=object), np.diff(arrays['offsets']))
+        return {'x': x.tolist(), 'y': python_values(arrays['values'])}
+    
+    def get_boxplot_arrays(self, param):
+        """
+        获取按晶圆片分段的箱型图数据
+        
+        只做一次按晶圆片的稳定排序，同一晶圆片的数据连续存放（保持原有顺序），
+        第i片晶圆的数据为 values[offsets[i]:offsets[i+1]]，切片不复制数据
+        
+        Args:
+            param (str): 参数名称
+            
+        Returns:
+            dict: {'wafers': 有数据的晶圆片列表（已排序）, 'values': 数值数组, 'offsets': 长度为晶圆片数+1的偏移数组}
+        """
         if self.df_clean is None or param not in self.df_clean.columns:
             return None
         
         # 确保Wafer列存在
-        if 'Wafer' not in self.df_clean.columns:
-            print(f"警告: 数据中缺少Wafer列，将使用默认值")
-            self.df_clean['Wafer'] = '01'
+        self._ensure_column('Wafer', '01')
+        
+        codes, wafers = pd.factorize(self.df_clean['Wafer'], sort=True)
+        # 内存优化模式下的float32列保持原类型，图表中按float32嵌入
+        column = pd.to_numeric(self.df_clean[param], errors='coerce')
+        values = column.to_numpy(dtype=np.float32 if column.dtype == np.float32 else float)
+        valid = ~np.isnan(values) & (codes >= 0)
+        values = values[valid]
+        codes = codes[valid]
+        
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(wafers))
+        has_data = counts > 0
+        
+        return {
+            'wafers': list(wafers[has_data]),
+            'values': values[order],
+            'offsets': np.concatenate([[0], np.cumsum(counts[has_data])])
+        }
+
+    def get_boxplot_summary(self, param, max_points=BOX_MAX_POINTS):
+        """
+        计算各晶圆片的箱型图统计量（四分位数、须、均值）和须外的异常点
         
-        # 按晶圆片分组
-        wafers = sorted(self.df_clean['Wafer'].unique())
+        四分位数按线性插值计算（与统计表的q25/q75一致），须为距箱体1.5倍四分位距以内的最远数据点。
+        异常点超过 max_points 个时按晶圆片分层抽样到 max_points 个：名额按各晶圆片的异常点数分配，
+        每片晶圆按数值排序后取等间隔秩的点，名额足够时保留每片的最小值和最大值
         
-        # 创建箱型图数据
-        x = []
-        y = []
+        Args:
+            param (str): 参数名称
+            max_points (int): 最多返回的异常点数，为None时不限制
+            
+        Returns:
+            dict: {'wafers', 'count', 'q1', 'median', 'q3', 'mean', 'lowerfence', 'upperfence'（各晶圆片一个值）,
+                   'outlier_count': 异常点总数, 'point_wafers': 返回的异常点所属晶圆片序号, 'point_values': 异常点数值}
+        """
+        arrays = self.get_boxplot_arrays(param)
+        if arrays is None:
+            return None
         
-        for wafer in wafers:
-            # 获取该晶圆片的数据
-            wafer_data = self.df_clean[self.df_clean['Wafer'] == wafer][param].dropna()
+        values = arrays['values']
+        counts = np.diff(arrays['offsets'])
+        n_wafers = len(arrays['wafers'])
+        codes = np.repeat(np.arange(n_wafers), counts)
+        
+        _, (q1, median, q3) = group_quantiles_by_codes(values, codes, n_wafers, [0.25, 0.5, 0.75])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(codes, weights=values, minlength=n_wafers) / counts
+        
+        iqr = q3 - q1
+        inside = (values >= (q1 - 1.5 * iqr)[codes]) & (values <= (q3 + 1.5 * iqr)[codes])
+        lowerfence = np.full(n_wafers, np.inf)
+        upperfence = np.full(n_wafers, -np.inf)
+        np.minimum.at(lowerfence, codes[inside], values[inside])
+        np.maximum.at(upperfence, codes[inside], values[inside])
+        
+        outliers = np.flatnonzero(~inside)
+        if max_points is not None and len(outliers) > max_points:
+            outliers = outliers[_quantile_sample(values[outliers], codes[outliers], n_wafers, max_points)]
+        
+        return {
+            'wafers': arrays['wafers'],
+            'count': counts,
+            'q1': q1,
+            'median': median,
+            'q3': q3,
+            'mean': mean,
+            'lowerfence': lowerfence,
+            'upperfence': upperfence,
+            'outlier_count': int((~inside).sum()),
+            'point_wafers': codes[outliers],
+            'point_values': values[outliers]
+        }
+
+    def get_decimated_points(self, param, max_points=SCATTER_MAX_POINTS):
+        """
+        获取抽样后的芯片数据点，用于大批次的散点图
+        
+        数据点超过 max_points 个时按晶圆片分层抽样到 max_points 个：名额按各晶圆片的点数分配，
+        每片晶圆按数值排序后取等间隔秩的点，名额足够时保留每片的最小值、最大值和分布形状
+        
+        Args:
+            param (str): 参数名称
+            max_points (int): 最多返回的数据点数，为None时不抽样
             
-            # 添加数据
-            x.extend([wafer] * len(wafer_data))
-            y.extend(wafer_data.tolist())
+        Returns:
+            dict: {'wafers': 晶圆片列表, 'point_wafers': 数据点所属晶圆片序号, 'point_values': 数据点数值,
+                   'total': 抽样前的数据点数}
+        """
+        arrays = self.get_boxplot_arrays(param)
+        if arrays is None:
+            return None
+        
+        values = arrays['values']
+        n_wafers = len(arrays['wafers'])
+        codes = np.repeat(np.arange(n_wafers), np.diff(arrays['offsets']))
+        
+        if max_points is None or len(values) <= max_points:
+            index = np.arange(len(values))
+        else:
+            index = _quantile_sample(values, codes, n_wafers, max_points)
         
-        return {'x': x, 'y': y}
+        return {
+            'wafers': arrays['wafers'],
+            'point_wafers': codes[index],
+            'point_values': values[index],
+            'total': len(values)
+        }
 
     def get_data_for_scatter(self, param):
         """
@@ -167,62 +344,405 @@ class CPDataAnalyzer:
             return None
         
         # 确保必要的列存在
-        if 'Lot' not in self.df_clean.columns:
-            print(f"警告: 数据中缺少Lot列，将使用默认值")
-            self.df_clean['Lot'] = 'LOT01'
-        
-        if 'Wafer' not in self.df_clean.columns:
-            print(f"警告: 数据中缺少Wafer列，将使用默认值")
-            self.df_clean['Wafer'] = '01'
+        self._ensure_column('Lot', 'LOT01')
+        self._ensure_column('Wafer', '01')
         
         # 创建散点图数据
         data = {
             'x': self.df_clean['Wafer'].tolist(),  # 使用晶圆片号作为X轴
-            'y': self.df_clean[param].tolist(),
+            'y': python_values(self.df_clean[param]),
             'lot': self.df_clean['Lot'].tolist()
         }
         
         return data
     
+    def correlation_matrices(self, params=None, methods=('pearson', 'spearman')):
+        """
+        计算参数之间的相关系数矩阵（整体和各晶圆片）
+        
+        数据转换为float32矩阵后按行分块做矩阵乘法，块内乘积累加到float64中；
+        缺失值按参数对剔除（只使用两个参数都有值的芯片）。Spearman相关系数与
+        DataFrame.corr(method='spearman') 一致：每个参数对在两者都有值的芯片上重新求平均秩，
+        缺失位置相同的参数共用一次求秩（见 _pairwise_spearman）。
+        结果按 (参数列表, 方法, 数据版本号) 缓存
+        
+        Args:
+            params (list): 参数列表，默认为目标参数中存在于数据里的参数
+            methods (tuple): 相关系数类型，'pearson' 和/或 'spearman'
+            
+        Returns:
+            dict: {方法: {'overall': 相关系数矩阵DataFrame, 'by_wafer': {晶圆片: 相关系数矩阵DataFrame}}}
+        """
+        if self.df_clean is None or self.df_clean.empty:
+            return None
+        
+        if params is None:
+            params = [p for p in self.target_params if p in self.df_clean.columns]
+        
+        result = {}
+        for method in methods:
+            if method not in ('pearson', 'spearman'):
+                print(f"警告: 不支持的相关系数类型 {method}")
+                continue
+            key = ('correlation', tuple(params), method, self._data_version)
+            if key not in self._table_cache:
+                self._table_cache[key] = self._compute_correlation(params, method)
+            result[method] = self._table_cache[key]
+        return result
+    
+    def _compute_correlation(self, params, method):
+        # 确保Wafer列存在
+        self._ensure_column('Wafer', '01')
+        
+        matrix = np.column_stack([pd.to_numeric(self.df_clean[p], errors='coerce').to_numpy(dtype=np.float32)
+                                  for p in params]) if params else np.empty((len(self.df_clean), 0), np.float32)
+        
+        # 按晶圆片稳定排序一次，各晶圆片的数据为连续的行
+        codes, wafers = pd.factorize(self.df_clean['Wafer'], sort=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(wafers) + 1))
+        matrix = matrix[order]
+        
+        def correlate(block):
+            corr = _pairwise_spearman(block) if method == 'spearman' else _pairwise_pearson(block)
+            return pd.DataFrame(corr, index=params, columns=params)
+        
+        return {
+            'overall': correlate(matrix),
+            'by_wafer': {wafer: correlate(matrix[bounds[i]:bounds[i + 1]]) for i, wafer in enumerate(wafers)}
+        }
+    
+    def accumulate_statistics(self, accumulator=None):
+        """
+        将df_clean加入在线统计累加器
+        
+        新到的一批芯片可以直接 accumulator.update(df_batch)，不需要重新计算整张表；
+        calculate_statistics 格式（不含中位数和分位数）可随时通过 accumulator.statistics(param, limits) 导出
+        
+        Args:
+            accumulator (StatsAccumulator): 已有的累加器，为None时新建一个
+            
+        Returns:
+            StatsAccumulator: 更新后的累加器
+        """
+        accumulator = accumulator or StatsAccumulator(self.target_params)
+        if self.df_clean is not None:
+            accumulator.update(self.df_clean)
+        return accumulator
+    
+    def stacked_wafer_maps(self, params=None):
+        """
+        计算叠加晶圆图：整批所有晶圆按芯片坐标 (X, Y) 叠加后，每个坐标位置上各参数的
+        均值、中位数和失效率，以及分箱的失效率和最常见的分箱号
+        
+        所有参数组成 (芯片, 参数) 矩阵后展平，以 "格子序号 * 参数数 + 参数序号" 为分组编码，
+        数量、和、失效数各一次 bincount，中位数一次分组排序，只遍历一遍芯片表。
+        结果按 (参数列表, 数据版本号) 缓存
+        
+        Args:
+            params (list): 参数列表，默认为目标参数中存在于数据里的参数
+            
+        Returns:
+            dict: {'x': 出现过的X坐标（升序）, 'y': 出现过的Y坐标（升序）, 'die_count': 各位置叠加的芯片数,
+                   'params': {参数: {'count', 'mean', 'median', 'fail_rate'}},
+                   'bin': {'count', 'fail_rate', 'mode'}（没有Bin列时为None）}，
+                  二维数组的形状均为 (len(y), len(x))，没有数据的位置为NaN；没有坐标时返回None
+        """
+        if self.df_clean is None or self.df_clean.empty:
+            return None
+        if 'X' not in self.df_clean.columns or 'Y' not in self.df_clean.columns:
+            print("警告: 数据中缺少X/Y坐标列，无法生成叠加晶圆图")
+            return None
+        
+        if params is None:
+            params = [p for p in self.target_params if p in self.df_clean.columns]
+        
+        key = ('wafer_maps', tuple(params), self._data_version)
+        if key not in self._table_cache:
+            self._table_cache[key] = self._compute_stacked_wafer_maps(params)
+        return self._table_cache[key]
+    
+    def _compute_stacked_wafer_maps(self, params):
+        df = self.df_clean
+        x = pd.to_numeric(df['X'], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(df['Y'], errors='coerce').to_numpy(dtype=float)
+        on_grid = ~np.isnan(x) & ~np.isnan(y)
+        if not on_grid.any():
+            return None
+        
+        # 每颗芯片所在格子的序号（按行优先：Y为行，X为列）；只使用出现过的坐标值，
+        # 芯片坐标有步距时（例如每隔6格一颗）网格不会被空行空列撑大
+        x_values, col = np.unique(x[on_grid].astype(np.int64), return_inverse=True)
+        y_values, row = np.unique(y[on_grid].astype(np.int64), return_inverse=True)
+        width, height = len(x_values), len(y_values)
+        n_cells = width * height
+        cell = np.full(len(df), -1, dtype=np.int64)
+        cell[on_grid] = row.reshape(-1) * width + col.reshape(-1)
+        
+        def to_grid(flat, dtype=np.float32):
+            return flat.reshape(height, width).astype(dtype)
+        
+        maps = {
+            'x': x_values,
+            'y': y_values,
+            'die_count': to_grid(np.bincount(cell[on_grid], minlength=n_cells), np.int32),
+            'params': {},
+            'bin': None
+        }
+        
+        if params:
+            n_params = len(params)
+            matrix = np.column_stack([pd.to_numeric(df[p], errors='coerce').to_numpy(dtype=float) for p in params])
+            upper = np.array([_limit_value(self.limits.get(p, {}).get('upper')) for p in params])
+            lower = np.array([_limit_value(self.limits.get(p, {}).get('lower')) for p in params])
+            with np.errstate(invalid='ignore'):
+                failed = ((matrix > upper) | (matrix < lower)).ravel()
+            
+            keys = (cell[:, None] * n_params + np.arange(n_params)).ravel()
+            keys[np.repeat(cell < 0, n_params)] = -1
+            values = matrix.ravel()
+            valid = (keys >= 0) & ~np.isnan(values)
+            n_groups = n_cells * n_params
+            
+            counts = np.bincount(keys[valid], minlength=n_groups)
+            sums = np.bincount(keys[valid], weights=values[valid], minlength=n_groups)
+            fails = np.bincount(keys[valid], weights=failed[valid], minlength=n_groups)
+            _, medians = group_quantiles_by_codes(values, keys, n_groups, [0.5])
+            
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.where(counts > 0, sums / counts, np.nan)
+                fail_rates = np.where(counts > 0, fails / counts, np.nan)
+            
+            counts = counts.reshape(n_cells, n_params)
+            means = means.reshape(n_cells, n_params)
+            medians = medians[0].reshape(n_cells, n_params)
+            fail_rates = fail_rates.reshape(n_cells, n_params)
+            for j, param in enumerate(params):
+                maps['params'][param] = {
+                    'count': to_grid(counts[:, j], np.int32),
+                    'mean': to_grid(means[:, j]),
+                    'median': to_grid(medians[:, j]),
+                    'fail_rate': to_grid(fail_rates[:, j])
+                }
+        
+        if 'Bin' in df.columns:
+            bins = pd.to_numeric(df['Bin'], errors='coerce').to_numpy(dtype=float)
+            has_bin = on_grid & ~np.isnan(bins)
+            bin_values, bin_codes = np.unique(bins[has_bin].astype(np.int64), return_inverse=True)
+            
+            # 每个格子各分箱号的芯片数
+            table = np.zeros((n_cells, len(bin_values)), dtype=np.int32)
+            np.add.at(table, (cell[has_bin], bin_codes.reshape(-1)), 1)
+            bin_count = table.sum(axis=1)
+            good = table[:, np.isin(bin_values, GOOD_BINS)].sum(axis=1)
+            
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fail_rate = np.where(bin_count > 0, 1.0 - good / bin_count, np.nan)
+            mode = np.full(n_cells, np.nan)
+            if len(bin_values):
+                mode = np.where(bin_count > 0, bin_values[table.argmax(axis=1)], np.nan)
+            
+            maps['bin'] = {
+                'count': to_grid(bin_count, np.int32),
+                'fail_rate': to_grid(fail_rate),
+                'mode': to_grid(mode)
+            }
+        
+        return maps
+    
     def calculate_statistics(self, param):
         """
         计算参数的统计信息
         
+        结果按 (参数, 数据版本号) 缓存，同一份数据上重复调用直接返回缓存的字典（调用方不应修改它）
+        
         Args:
             param (str): 参数名称
             
         Returns:
             dict: 统计信息字典
         """
+        key = (param, self._data_version)
+        if key not in self._stats_cache:
+            self._stats_cache[key] = self._compute_statistics(param)
+        return self._stats_cache[key]
+    
+    def statistics_table(self, params=None):
+        """
+        一次性计算所有参数的整体统计量和各晶圆片的统计量
+        
+        每个参数只做一次按(晶圆片, 数值)的分组排序，均值、标准差、最值和分位数
+        都从同一份分组编码向量化得到。结果按 (参数列表, 数据版本号) 缓存
+        
+        Args:
+            params (list): 参数列表，默认为目标参数中存在于数据里的参数
+            
+        Returns:
+            DataFrame: 整洁格式的统计表，每行一个 (参数, 范围) 组合，列为
+                param, scope（'overall' 整体 / 'wafer' 晶圆片）, Wafer（整体行为None）
+                以及 STAT_COLUMNS 中的各统计量
+        """
+        if self.df_clean is None:
+            return None
+        
+        if params is None:
+            params = [p for p in self.target_params if p in self.df_clean.columns]
+        key = (tuple(params), self._data_version)
+        if key not in self._table_cache:
+            self._table_cache[key] = self._compute_statistics_table(params)
+        return self._table_cache[key]
+    
+    def _compute_statistics_table(self, params):
+        # 确保Wafer列存在
+        self._ensure_column('Wafer', '01')
+        
+        wafer_codes, wafers = pd.factorize(self.df_clean['Wafer'], sort=True)
+        overall_codes = np.zeros(len(self.df_clean), dtype=np.int64)
+        frames = []
+        
+        for param in params:
+            if param not in self.df_clean.columns:
+                continue
+            values = pd.to_numeric(self.df_clean[param], errors='coerce').to_numpy(dtype=float)
+            
+            for scope, codes, groups in (('overall', overall_codes, [None]),
+                                         ('wafer', wafer_codes, list(wafers))):
+                frame = _grouped_stats(values, codes, len(groups))
+                frame.insert(0, 'Wafer', pd.Series(groups, dtype=object))
+                frame.insert(0, 'scope', scope)
+                frame.insert(0, 'param', param)
+                frames.append(frame[frame['count'] > 0])
+        
+        if not frames:
+            return pd.DataFrame(columns=['param', 'scope', 'Wafer'] + STAT_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+    
+    def capability_table(self, params=None):
+        """
+        计算过程能力指数和参数良率
+        
+        在 statistics_table 的每一行（整体和各晶圆片）上追加 Cp、Cpk、Cpu、Cpl、
+        超上限/下限的失效数和良率。能力指数由统计表的均值、标准差和限制值一次向量化算出；
+        失效数按晶圆片编码一次 bincount 得到。
+        
+        只有上限或只有下限时按单侧计算（Cp为NaN，Cpk取有效的一侧）。解析器对漏电流等参数
+        设置的下限0只是物理下界而非工艺规格，不参与能力指数计算，但低于0的数据仍计为失效。
+        
+        Args:
+            params (list): 参数列表，默认为目标参数中存在于数据里的参数
+            
+        Returns:
+            DataFrame: 统计表加上 CAPABILITY_COLUMNS 各列
+        """
+        table = self.statistics_table(params)
+        if table is None:
+            return None
+        
+        key = ('capability', tuple(table['param'].unique()), self._data_version)
+        if key not in self._table_cache:
+            self._table_cache[key] = self._compute_capability_table(table)
+        return self._table_cache[key]
+    
+    def _compute_capability_table(self, table):
+        table = table.copy()
+        usl = table['param'].map(lambda p: _limit_value(self.limits.get(p, {}).get('upper'))).to_numpy(dtype=float)
+        lsl = table['param'].map(lambda p: _limit_value(self.limits.get(p, {}).get('lower'))).to_numpy(dtype=float)
+        capability_lsl = np.where(lsl == 0, np.nan, lsl)
+        
+        mean = table['mean'].to_numpy(dtype=float)
+        sigma = table['std'].to_numpy(dtype=float)
+        sigma = np.where(sigma > 0, sigma, np.nan)
+        
+        table['usl'] = usl
+        table['lsl'] = lsl
+        table['cpu'] = (usl - mean) / (3 * sigma)
+        table['cpl'] = (mean - capability_lsl) / (3 * sigma)
+        table['cp'] = (usl - capability_lsl) / (6 * sigma)
+        with np.errstate(invalid='ignore'):
+            table['cpk'] = np.fmin(table['cpu'].to_numpy(), table['cpl'].to_numpy())
+        
+        # 失效数：每个参数一次比较、按晶圆片编码一次计数
+        wafer_codes, wafers = pd.factorize(self.df_clean['Wafer'], sort=True)
+        wafer_position = {wafer: i for i, wafer in enumerate(wafers)}
+        fail_high = np.zeros(len(table), dtype=np.int64)
+        fail_low = np.zeros(len(table), dtype=np.int64)
+        
+        for param, rows in table.groupby('param', sort=False).indices.items():
+            values = pd.to_numeric(self.df_clean[param], errors='coerce').to_numpy(dtype=float)
+            high, low = _limit_fail_masks(values, usl[rows[0]], lsl[rows[0]])
+            high_by_wafer = np.bincount(wafer_codes[high & (wafer_codes >= 0)], minlength=len(wafers))
+            low_by_wafer = np.bincount(wafer_codes[low & (wafer_codes >= 0)], minlength=len(wafers))
+            
+            for row in rows:
+                if table.at[row, 'scope'] == 'overall':
+                    fail_high[row] = int(high.sum())
+                    fail_low[row] = int(low.sum())
+                else:
+                    position = wafer_position[table.at[row, 'Wafer']]
+                    fail_high[row] = high_by_wafer[position]
+                    fail_low[row] = low_by_wafer[position]
+        
+        table['fail_high'] = fail_high
+        table['fail_low'] = fail_low
+        table['fail_count'] = fail_high + fail_low
+        table['yield'] = 1.0 - table['fail_count'] / table['count']
+        return table
+    
+    def parametric_yield(self, params=None):
+        """
+        计算各晶圆片和整体的参数良率：芯片的所有参数都在限制范围内才算合格
+        
+        没有测量值（NaN）的参数不判为失效
+        
+        Args:
+            params (list): 参数列表，默认为目标参数中存在于数据里的参数
+            
+        Returns:
+            DataFrame: 列为 Wafer（整体行为None）, count, fail_count, yield
+        """
+        if self.df_clean is None or self.df_clean.empty:
+            return None
+        
+        if params is None:
+            params = [p for p in self.target_params if p in self.df_clean.columns]
+        self._ensure_column('Wafer', '01')
+        
+        failed = np.zeros(len(self.df_clean), dtype=bool)
+        for param in params:
+            limit = self.limits.get(param, {})
+            values = pd.to_numeric(self.df_clean[param], errors='coerce').to_numpy(dtype=float)
+            high, low = _limit_fail_masks(values, _limit_value(limit.get('upper')), _limit_value(limit.get('lower')))
+            failed |= high | low
+        
+        codes, wafers = pd.factorize(self.df_clean['Wafer'], sort=True)
+        counts = np.bincount(codes[codes >= 0], minlength=len(wafers))
+        fails = np.bincount(codes[failed & (codes >= 0)], minlength=len(wafers))
+        
+        result = pd.DataFrame({
+            'Wafer': pd.Series([None] + list(wafers), dtype=object),
+            'count': np.concatenate([[len(failed)], counts]),
+            'fail_count': np.concatenate([[int(failed.sum())], fails])
+        })
+        result['yield'] = 1.0 - result['fail_count'] / result['count']
+        return result
+    
+    def _compute_statistics(self, param):
         if self.df_clean is None or param not in self.df_clean.columns:
             return None
         
-        # 获取参数数据
-        data = self.df_clean[param].dropna()
+        params = [p for p in self.target_params if p in self.df_clean.columns]
+        table = self.statistics_table(params if param in params else [param])
+        rows = table[table['param'] == param]
+        overall = rows[rows['scope'] == 'overall']
         
-        if len(data) == 0:
+        if overall.empty:
             return None
         
         # 计算整体统计信息
-        overall_stats = {
-            'mean': float(data.mean()),
-            'median': float(data.median()),
-            'std': float(data.std()),
-            'min': float(data.min()),
-            'max': float(data.max()),
-            'count': int(len(data)),
-            'range': float(data.max() - data.min())
-        }
-        
-        # 创建统计信息字典
         stats = {
-            'overall': overall_stats
+            'overall': _stats_dict(overall.iloc[0], OVERALL_STAT_COLUMNS)
         }
         
-        # 计算分位数
-        for q in [0.1, 0.25, 0.5, 0.75, 0.9]:
-            stats['overall'][f'q{int(q*100)}'] = float(data.quantile(q))
-        
         # 获取参数限制
         if param in self.limits:
             stats['overall']['upper_limit'] = self.limits[param].get('upper')
@@ -231,31 +751,240 @@ class CPDataAnalyzer:
             stats['overall']['upper_limit'] = None
             stats['overall']['lower_limit'] = None
         
-        # 按晶圆片计算统计信息
+        # 按晶圆片的统计信息，只有一个数据点的晶圆片标准差记为0
         stats['by_lot'] = {}
+        for _, row in rows[rows['scope'] == 'wafer'].iterrows():
+            lot_stats = _stats_dict(row, WAFER_STAT_COLUMNS)
+            if lot_stats['count'] <= 1:
+                lot_stats['std'] = 0.0
+            stats['by_lot'][row['Wafer']] = lot_stats
         
-        # 确保Wafer列存在
-        if 'Wafer' not in self.df_clean.columns:
-            print(f"警告: 数据中缺少Wafer列，将使用默认值")
-            self.df_clean['Wafer'] = '01'
+        return stats
+
+
+def _grouped_stats(values, codes, n_groups):
+    """
+    计算每个分组的数量、均值、标准差(ddof=1)、最值、极差和分位数
+    
+    Args:
+        values (ndarray): 数值数组（NaN会被忽略）
+        codes (ndarray): 每行的分组编码（-1表示不属于任何分组）
+        n_groups (int): 分组数
         
-        # 按晶圆片分组计算统计信息
-        for wafer in sorted(self.df_clean['Wafer'].unique()):
-            wafer_data = self.df_clean[self.df_clean['Wafer'] == wafer][param].dropna()
-            
-            if len(wafer_data) == 0:
-                continue
-            
-            lot_stats = {
-                'mean': float(wafer_data.mean()),
-                'median': float(wafer_data.median()),
-                'std': float(wafer_data.std()) if len(wafer_data) > 1 else 0.0,
-                'min': float(wafer_data.min()),
-                'max': float(wafer_data.max()),
-                'count': int(len(wafer_data)),
-                'range': float(wafer_data.max() - wafer_data.min())
-            }
-            
-            stats['by_lot'][wafer] = lot_stats
+    Returns:
+        DataFrame: 每个分组一行，列为 STAT_COLUMNS
+    """
+    # 最小值、最大值与分位数一起从同一次分组排序中取出
+    quantiles = [0.0, 1.0] + STAT_QUANTILES
+    counts, q_values = group_quantiles_by_codes(values, codes, n_groups, quantiles)
+    
+    valid = ~np.isnan(values) & (codes >= 0)
+    _, mean, std, _ = group_moments(values[valid], codes[valid], n_groups)
+    
+    frame = pd.DataFrame({
+        'count': counts.astype(np.int64),
+        'mean': mean,
+        'median': q_values[quantiles.index(0.5)],
+        'std': std,
+        'min': q_values[0],
+        'max': q_values[1],
+        'range': q_values[1] - q_values[0]
+    })
+    for i, q in enumerate(STAT_QUANTILES):
+        frame[f'q{int(q*100)}'] = q_values[i + 2]
+    return frame
+
+
+def _sample_allocation(counts, max_points):
+    """
+    将 max_points 个抽样名额分配给各组（注水法）：先求最大的公共上限c使 Σmin(count, c) 不超过 max_points，
+    剩余名额给点数超过c的组各加一个，分配总数恰好为 min(Σcount, max_points)
+    
+    Args:
+        counts (ndarray): 每组的点数
+        max_points (int): 总名额
+        
+    Returns:
+        ndarray: 每组分到的点数
+    """
+    max_points = max(int(max_points), 0)
+    if counts.sum() <= max_points:
+        return counts.copy()
+    
+    low, high = 0, int(counts.max())
+    while low < high:
+        cap = (low + high + 1) // 2
+        if np.minimum(counts, cap).sum() <= max_points:
+            low = cap
+        else:
+            high = cap - 1
+    
+    take = np.minimum(counts, low)
+    extra = max_points - int(take.sum())
+    if extra > 0:
+        take[np.flatnonzero(counts > take)[:extra]] += 1
+    return take
+
+
+def _quantile_sample(values, codes, n_groups, max_points):
+    """
+    按分组保留分布形状的抽样：总点数不超过 max_points，名额按 _sample_allocation 分给各组，
+    每组按数值排序后取等间隔秩的点。每组分到至少2个名额时保留该组的最小值和最大值，
+    分组数多于 max_points 的一半时部分组只保留最小值或不保留点
+    
+    Args:
+        values (ndarray): 数值数组（不含NaN）
+        codes (ndarray): 每个值的分组编码
+        n_groups (int): 分组数
+        max_points (int): 最多保留的总点数
+        
+    Returns:
+        ndarray: 选中的点在 values 中的下标（升序）
+    """
+    order = np.lexsort((values, codes))
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    
+    take = _sample_allocation(counts, max_points)
+    group = np.repeat(np.arange(n_groups), take)
+    rank = np.arange(int(take.sum())) - np.repeat(np.cumsum(take) - take, take)
+    step = (counts[group] - 1) / np.maximum(take[group] - 1, 1)
+    positions = starts[group] + np.round(rank * step).astype(np.int64)
+    return np.sort(order[positions])
+
+
+def _stats_dict(row, columns):
+    """
+    将统计表的一行转换为 calculate_statistics 格式的字典
+    """
+    return {col: int(row[col]) if col == 'count' else float(row[col]) for col in columns}
+
+
+def _limit_value(value):
+    """
+    将限制值转换为浮点数，缺失或无法转换时返回NaN
+    """
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _limit_fail_masks(values, upper, lower):
+    """
+    计算超出上限和低于下限的掩码，限制值为NaN时该侧不判失效
+    """
+    with np.errstate(invalid='ignore'):
+        high = values > upper if not np.isnan(upper) else np.zeros(len(values), dtype=bool)
+        low = values < lower if not np.isnan(lower) else np.zeros(len(values), dtype=bool)
+    return high, low
+
+
+def _pairwise_pearson(matrix):
+    """
+    按参数对剔除缺失值的Pearson相关系数矩阵
+    
+    各列先减去列均值以减小float32的舍入误差，再按行分块累加
+    参数对的有效数量、一阶和、二阶和以及交叉乘积和
+    
+    Args:
+        matrix (ndarray): float32矩阵，每列一个参数，缺失值为NaN
         
-        return stats
\ No newline at end of file
+    Returns:
+        ndarray: 相关系数矩阵，有效数据不足2个或方差为0的参数对为NaN
+    """
+    n_params = matrix.shape[1]
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        center = np.nan_to_num(np.nanmean(matrix, axis=0, dtype=np.float64)).astype(np.float32)
+    
+    pair_count = np.zeros((n_params, n_params))
+    pair_sum = np.zeros((n_params, n_params))
+    pair_sq_sum = np.zeros((n_params, n_params))
+    cross_sum = np.zeros((n_params, n_params))
+    
+    for start in range(0, len(matrix), CORRELATION_BLOCK_ROWS):
+        block = matrix[start:start + CORRELATION_BLOCK_ROWS]
+        valid = ~np.isnan(block)
+        weights = valid.astype(np.float32)
+        centered = np.where(valid, block - center, np.float32(0))
+        
+        # pair_sum[i, j] 为第j列有值的芯片上第i列之和，其余同理
+        pair_count += weights.T @ weights
+        pair_sum += centered.T @ weights
+        pair_sq_sum += (centered * centered).T @ weights
+        cross_sum += centered.T @ centered
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = cross_sum - pair_sum * pair_sum.T / pair_count
+        var = pair_sq_sum - pair_sum ** 2 / pair_count
+        corr = cov / np.sqrt(var * var.T)
+    
+    corr[(pair_count < 2) | ~(var > 0) | ~(var.T > 0)] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def _pairwise_spearman(matrix):
+    """
+    按参数对剔除缺失值的Spearman相关系数矩阵
+    
+    每个参数对只在两个参数都有值的芯片上求秩（与pandas的逐对求秩一致）。缺失位置相同的参数分为一组，
+    对每两组取共同有值的芯片，组内所有参数一起求秩后计算Pearson相关，
+    没有缺失值时只需一次求秩，分组数为g时共求秩 g(g+1)/2 次
+    
+    Args:
+        matrix (ndarray): float32矩阵，每列一个参数，缺失值为NaN
+        
+    Returns:
+        ndarray: 相关系数矩阵
+    """
+    n_params = matrix.shape[1]
+    corr = np.full((n_params, n_params), np.nan)
+    if n_params == 0:
+        return corr
+    
+    valid = ~np.isnan(matrix)
+    groups = {}
+    for col in range(n_params):
+        groups.setdefault(np.packbits(valid[:, col]).tobytes(), []).append(col)
+    groups = list(groups.values())
+    
+    for a, cols_a in enumerate(groups):
+        for cols_b in groups[a:]:
+            same = cols_b is cols_a
+            cols = cols_a if same else cols_a + cols_b
+            rows = valid[:, cols_a[0]] & valid[:, cols_b[0]]
+            block = _pairwise_pearson(_column_ranks(matrix[rows][:, cols]))
+            if same:
+                corr[np.ix_(cols_a, cols_a)] = block
+            else:
+                cross = block[:len(cols_a), len(cols_a):]
+                corr[np.ix_(cols_a, cols_b)] = cross
+                corr[np.ix_(cols_b, cols_a)] = cross.T
+    return corr
+
+
+def _column_ranks(matrix):
+    """
+    计算各列的平均秩（缺失值保持NaN，与 DataFrame.rank(method='average') 相同），返回float32矩阵
+    
+    每列只对有值的部分做一次argsort（相同值取平均秩，所以不需要稳定排序），相同值的一段取首尾秩的平均
+    """
+    ranks = np.full(matrix.shape, np.nan, dtype=np.float32)
+    for col in range(matrix.shape[1]):
+        values = matrix[:, col]
+        valid = ~np.isnan(values)
+        n_valid = int(np.count_nonzero(valid))
+        if n_valid == 0:
+            continue
+        if n_valid == len(values):
+            order = np.argsort(values)
+        else:
+            # 含NaN时排序较慢，只对有值的部分排序
+            index = np.flatnonzero(valid)
+            order = index[np.argsort(values[index])]
+        ordered = values[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        ends = np.r_[starts[1:], n_valid]
+        ranks[order, col] = np.repeat((starts + ends + 1) / 2.0, ends - starts)
+    return ranks
@@ -10,10 +10,684 @@
 import os
 import re
 import json
+import shutil
+import hashlib
+import inspect
 import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Any, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntFlag
+from typing import Dict, List, Optional, Any, Tuple, Union, Iterator, Callable
+
+from columnar_store import ColumnarStore
+
+# 流式导出JSON时每批处理/写入的记录数
+JSON_STREAM_CHUNK_SIZE = 2000
+
+# 清洗结果缓存的格式版本，缓存内容或清洗逻辑不兼容地变化时递增
+CLEAN_CACHE_VERSION = 1
+
+# 清洗结果缓存目录的默认容量上限（MB），超出时按最近使用时间删除最旧的条目
+CLEAN_CACHE_MAX_MB = 2048
+
+
+class JsonStreamWriter:
+    """
+    JSON数组流式写入器
+
+    逐条接收记录并按批写入文件，输出格式与 json.dump(records, f, indent=2) 完全一致，
+    但内存中最多只缓存 chunk_size 条记录
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = JSON_STREAM_CHUNK_SIZE):
+        """
+        初始化流式写入器
+
+        Args:
+            file_path: 输出文件路径
+            chunk_size: 缓冲区记录数，达到后写入文件
+        """
+        self.file_path = file_path
+        self.chunk_size = max(1, chunk_size)
+        self.count = 0
+        self._buffer = []
+        self._file = None
+
+    def __enter__(self) -> 'JsonStreamWriter':
+        self._file = open(self.file_path, 'w', encoding='utf-8')
+        self._file.write('[')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self._flush()
+                self._file.write('\n]' if self.count else ']')
+        finally:
+            self._file.close()
+            self._file = None
+            self._buffer = []
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """
+        写入一条记录
+
+        Args:
+            record: JSON记录字典
+        """
+        # 与 indent=2 的数组元素缩进保持一致
+        text = json.dumps(record, indent=2).replace('\n', '\n  ')
+        self._buffer.append(('\n  ' if self.count == 0 else ',\n  ') + text)
+        self.count += 1
+
+        if len(self._buffer) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+
+
+def iter_records(df: pd.DataFrame, columns: List[str], mask: Optional[np.ndarray] = None,
+                 chunk_size: int = JSON_STREAM_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    按块遍历DataFrame，逐行生成记录字典
+
+    与iterrows不同，每次只将一个数据块转换为Python对象，且不构造Series
+
+    Args:
+        df: 数据表
+        columns: 需要的列，不存在的列会被忽略
+        mask: 行过滤掩码（布尔数组），为None时输出所有行
+        chunk_size: 每块的行数
+
+    Yields:
+        Dict[str, Any]: 行记录 {列名: 值}
+    """
+    columns = [col for col in columns if col in df.columns]
+
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        if mask is not None:
+            chunk = chunk[mask[start:start + chunk_size]]
+
+        values = [json_values(chunk[col]) for col in columns]
+        for row_values in zip(*values):
+            yield dict(zip(columns, row_values))
+
+
+def python_values(values: Union[pd.Series, np.ndarray]) -> List[Any]:
+    """
+    转换为Python对象列表，float32按原值精确转为Python浮点数
+
+    Args:
+        values: 列或数组
+
+    Returns:
+        List[Any]: 值列表
+    """
+    if values.dtype == np.float32:
+        return np.asarray(values).astype(np.float64).tolist()
+    return values.tolist()
+
+
+def json_values(values: Union[pd.Series, np.ndarray]) -> List[Any]:
+    """
+    转换为写入JSON的Python对象列表
+
+    float32精确转成Python浮点数会在JSON中带出多余的位数（1.3 -> 1.2999999523162842），
+    这里按float32的最短表示转换。经过字符串往返比 python_values 慢得多，只用于JSON导出
+
+    Args:
+        values: 列或数组
+
+    Returns:
+        List[Any]: 值列表
+    """
+    if values.dtype == np.float32:
+        return np.asarray(values).astype(str).astype(float).tolist()
+    return python_values(values)
+
+
+class CleanFlag(IntFlag):
+    """
+    数据清洗标记位
+
+    每个参数的所有清洗标记打包存放在一个整数列 "<参数名>_flags" 中，
+    成员名称的小写形式即旧版标记列的后缀（例如 OUTLIER_HIGH 对应 "_outlier_high"）
+    """
+    OUTLIER_HIGH = 1 << 0        # 超过上限1.5倍的异常值
+    SPEC_HIGH = 1 << 1           # 超出规格上限（非异常值）
+    OUTLIER_LOW = 1 << 2         # 低于下限0.5倍的异常值
+    SPEC_LOW = 1 << 3            # 低于规格下限（非异常值）
+    Z_OUTLIER = 1 << 4           # z分数异常值
+    SMART_OUTLIER_HIGH = 1 << 5  # 智能策略高端异常值
+    SMART_OUTLIER_LOW = 1 << 6   # 智能策略低端异常值
+    SMART_LOG_OUTLIER = 1 << 7   # 智能策略对数域异常值
+    SMART_STAT_OUTLIER = 1 << 8  # 智能策略统计异常值
+    DPAT_HIGH = 1 << 9           # 动态PAT上限之外
+    DPAT_LOW = 1 << 10           # 动态PAT下限之外
+    NNR_OUTLIER = 1 << 11        # 与相邻芯片中位数的残差异常
+
+
+# 标记列后缀和存储类型
+FLAG_SUFFIX = '_flags'
+FLAG_DTYPE = np.uint16
+
+# 非参数的基础列（X/Y为芯片坐标，Bin为分箱号）
+META_COLUMNS = ['Lot', 'Wafer', 'No.U', 'X', 'Y', 'Bin']
+
+
+def flag_column(param: str) -> str:
+    """
+    获取参数对应的标记列名
+
+    Args:
+        param: 参数名称
+
+    Returns:
+        str: 标记列名
+    """
+    return f"{param}{FLAG_SUFFIX}"
+
+
+def is_flag_column(column: str) -> bool:
+    """
+    判断列是否为标记列
+
+    Args:
+        column: 列名
+
+    Returns:
+        bool: 是否为标记列
+    """
+    return isinstance(column, str) and column.endswith(FLAG_SUFFIX)
+
+
+def set_flags(df: pd.DataFrame, param: str, mask: Union[pd.Series, np.ndarray], flag: CleanFlag) -> None:
+    """
+    为满足条件的行设置标记位（原地修改）
+
+    标记列不存在时会创建一个全0的列
+
+    Args:
+        df: 数据表
+        param: 参数名称
+        mask: 行掩码
+        flag: 要设置的标记位
+    """
+    merge_flag_bits(df, param, flag_bits(mask, flag))
+
+
+def flag_bits(mask: Union[pd.Series, np.ndarray], flag: CleanFlag) -> np.ndarray:
+    """
+    将行掩码转换为标记位数组
+
+    Args:
+        mask: 行掩码
+        flag: 标记位
+
+    Returns:
+        np.ndarray: FLAG_DTYPE类型的标记位数组，可用 | 组合
+    """
+    return np.where(np.asarray(mask, dtype=bool), int(flag), 0).astype(FLAG_DTYPE)
+
+
+def merge_flag_bits(df: pd.DataFrame, param: str, bits: np.ndarray) -> None:
+    """
+    将标记位数组合并到参数的标记列（原地修改）
+
+    Args:
+        df: 数据表
+        param: 参数名称
+        bits: 标记位数组
+    """
+    col = flag_column(param)
+    if col in df.columns:
+        df[col] = df[col].to_numpy(dtype=FLAG_DTYPE) | bits
+    else:
+        df[col] = bits.astype(FLAG_DTYPE)
+
+
+def apply_param_flags(df: pd.DataFrame, params: List[str],
+                      evaluate: Callable[[str], Optional[np.ndarray]], workers: int = 1) -> None:
+    """
+    逐参数计算标记位并合并到数据表
+
+    evaluate 只读取数据表并返回该参数的标记位数组（None表示不标记），
+    workers 大于1时各参数在线程池中并发计算（numpy运算会释放GIL），
+    计算结果始终按 params 的顺序串行合并，因此结果与串行执行完全一致
+
+    Args:
+        df: 数据表
+        params: 参数列表
+        evaluate: 计算单个参数标记位的函数
+        workers: 并发线程数
+    """
+    if workers > 1 and len(params) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(params))) as pool:
+            results = list(pool.map(evaluate, params))
+    else:
+        results = [evaluate(param) for param in params]
+
+    for param, bits in zip(params, results):
+        if bits is not None:
+            merge_flag_bits(df, param, bits)
+
+
+def get_flag_mask(df: pd.DataFrame, param: str, flags: Optional[CleanFlag] = None) -> pd.Series:
+    """
+    查询带有指定标记的行
+
+    Args:
+        df: 数据表
+        param: 参数名称
+        flags: 标记位组合，命中任意一位即返回True；为None时匹配所有标记
+
+    Returns:
+        pd.Series: 布尔掩码
+    """
+    col = flag_column(param)
+    if col not in df.columns:
+        return pd.Series(False, index=df.index)
+
+    if flags is None:
+        flags = ~CleanFlag(0)
+    return pd.Series((df[col].to_numpy() & int(flags)) != 0, index=df.index)
+
+
+def count_flags(df: pd.DataFrame, param: str) -> Dict[str, int]:
+    """
+    统计参数各标记位的命中数量
+
+    Args:
+        df: 数据表
+        param: 参数名称
+
+    Returns:
+        Dict[str, int]: {标记名称: 数量}，只包含数量大于0的标记
+    """
+    col = flag_column(param)
+    if col not in df.columns:
+        return {}
+
+    values = df[col].to_numpy()
+    counts = {}
+    for flag in CleanFlag:
+        count = int(np.count_nonzero(values & int(flag)))
+        if count > 0:
+            counts[flag.name.lower()] = count
+    return counts
+
+
+def expand_flags(df: pd.DataFrame, param: str) -> pd.DataFrame:
+    """
+    将打包的标记列展开为旧版的布尔标记列
+
+    Args:
+        df: 数据表
+        param: 参数名称
+
+    Returns:
+        pd.DataFrame: 列名为 "<参数名>_<标记名>" 的可空布尔列
+    """
+    col = flag_column(param)
+    expanded = pd.DataFrame(index=df.index)
+    if col not in df.columns:
+        return expanded
+
+    values = df[col].to_numpy()
+    for flag in CleanFlag:
+        hit = (values & int(flag)) != 0
+        if hit.any():
+            expanded[f"{param}_{flag.name.lower()}"] = pd.array(np.where(hit, True, None), dtype='boolean')
+    return expanded
+
+
+# 内存优化模式下的列类型：参数列默认float32，批次/晶圆列为分类类型，编号/坐标/分箱列为窄整数
+COMPACT_FLOAT_DTYPE = np.float32
+COMPACT_CATEGORY_COLUMNS = ['Lot', 'Wafer']
+COMPACT_INT_COLUMNS = ['No.U', 'X', 'Y', 'Bin']
+COMPACT_INT_DTYPES = [np.int16, np.int32]
+
+
+def memory_usage_mb(df: pd.DataFrame) -> float:
+    """
+    数据表占用的内存（MB，含字符串对象本身）
+
+    Args:
+        df: 数据表
+
+    Returns:
+        float: 内存占用
+    """
+    return float(df.memory_usage(index=True, deep=True).sum()) / (1024 * 1024)
+
+
+def compact_frame(df: pd.DataFrame, params: List[str],
+                  dtype_overrides: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """
+    转换为内存优化的列类型
+
+    参数列转为float32（约7位有效数字，足够报告使用），dtype_overrides 中指定的参数使用指定类型
+    （例如 {'RDSON1': 'float64'}）；Lot/Wafer 转为分类类型；No.U/X/Y/Bin 在没有缺失值时
+    转为能容纳取值范围的最窄整数类型（int16或int32）。统计计算仍按float64进行
+
+    Args:
+        df: 数据表（不修改）
+        params: 参数列表
+        dtype_overrides: 参数 -> 类型 的覆盖设置
+
+    Returns:
+        pd.DataFrame: 转换后的数据表
+    """
+    dtype_overrides = dtype_overrides or {}
+    result = df.copy(deep=False)
+
+    for param in params:
+        if param not in result.columns:
+            continue
+        dtype = np.dtype(dtype_overrides.get(param, COMPACT_FLOAT_DTYPE))
+        values = pd.to_numeric(result[param], errors='coerce')
+        if values.dtype != dtype:
+            result[param] = values.astype(dtype)
+
+    for col in COMPACT_CATEGORY_COLUMNS:
+        if col in result.columns and not isinstance(result[col].dtype, pd.CategoricalDtype):
+            result[col] = result[col].astype('category')
+
+    for col in COMPACT_INT_COLUMNS:
+        if col not in result.columns:
+            continue
+        values = pd.to_numeric(result[col], errors='coerce')
+        if values.empty or values.isna().any() or not np.all(np.mod(values.to_numpy(dtype=float), 1) == 0):
+            continue
+        low, high = values.min(), values.max()
+        for dtype in COMPACT_INT_DTYPES:
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                result[col] = values.astype(dtype)
+                break
+
+    return result
+
+
+# 分组稳健统计量的列
+ROBUST_STAT_COLUMNS = ['count', 'mean', 'std', 'q1', 'median', 'q3', 'mad', 'log_mean', 'log_std']
+
+
+def group_codes(df: pd.DataFrame, group_col: str = 'Wafer') -> Tuple[np.ndarray, pd.Index]:
+    """
+    计算每行所属分组的整数编码
+
+    Args:
+        df: 数据表
+        group_col: 分组列
+
+    Returns:
+        Tuple[np.ndarray, pd.Index]: (每行的分组编码，缺失值为-1；按编码排列的分组值)
+    """
+    codes, groups = pd.factorize(df[group_col], sort=True)
+    return codes, pd.Index(groups, name=group_col)
+
+
+def wafer_codes(df: pd.DataFrame) -> Tuple[np.ndarray, pd.MultiIndex]:
+    """
+    计算每行所属晶圆的整数编码，不同批次中晶圆号相同的晶圆视为不同晶圆
+
+    Args:
+        df: 数据表，缺少Lot/Wafer列时按默认值'LOT01'/'01'处理
+
+    Returns:
+        Tuple[np.ndarray, pd.MultiIndex]: (每行的晶圆编码，缺失值为-1；按编码排列的(批次, 晶圆))
+    """
+    lots = df['Lot'] if 'Lot' in df.columns else pd.Series('LOT01', index=df.index)
+    wafers = df['Wafer'] if 'Wafer' in df.columns else pd.Series('01', index=df.index)
+    lot_codes, lot_values = pd.factorize(lots, sort=True)
+    wafer_code, wafer_values = pd.factorize(wafers, sort=True)
+
+    # 两个编码组合为一个整数后再压缩为连续编码
+    combined = lot_codes.astype(np.int64) * max(len(wafer_values), 1) + wafer_code
+    combined[(lot_codes < 0) | (wafer_code < 0)] = -1
+    pairs, codes = np.unique(combined, return_inverse=True)
+    codes = codes.reshape(-1)
+    if len(pairs) and pairs[0] < 0:
+        pairs = pairs[1:]
+        codes = codes - 1
+
+    groups = pd.MultiIndex.from_arrays([
+        np.asarray(lot_values)[pairs // max(len(wafer_values), 1)],
+        np.asarray(wafer_values)[pairs % max(len(wafer_values), 1)]
+    ], names=['Lot', 'Wafer'])
+    return codes, groups
+
+
+def broadcast_group_stat(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    将每个分组的统计量展开到行
+
+    Args:
+        values: 按分组编码排列的统计量
+        codes: 每行的分组编码
+
+    Returns:
+        np.ndarray: 每行对应的统计量，不属于任何分组的行为NaN
+    """
+    result = np.asarray(values, dtype=float)[codes]
+    result[codes < 0] = np.nan
+    return result
+
+
+def build_grid_index(x: np.ndarray, y: np.ndarray, codes: np.ndarray, n_groups: int,
+                     pad: int = 0) -> Tuple[np.ndarray, int, int]:
+    """
+    建立每片晶圆的稠密坐标索引：grid[分组, X - x0, Y - y0] = 行号
+
+    所有晶圆共用整批的坐标范围，四周各留 pad 格空白，
+    查找相邻芯片只需对坐标加偏移后直接取下标，不需要搜索
+
+    Args:
+        x: 每行的X坐标（缺失为NaN）
+        y: 每行的Y坐标（缺失为NaN）
+        codes: 每行的分组编码（-1表示不属于任何分组）
+        n_groups: 分组数
+        pad: 四周留白格数
+
+    Returns:
+        Tuple[np.ndarray, int, int]: (形状为 (n_groups, 宽, 高) 的行号数组，空位为-1; x0; y0)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = (codes >= 0) & ~np.isnan(x) & ~np.isnan(y)
+    row_dtype = np.int32 if len(x) < np.iinfo(np.int32).max else np.int64
+
+    if not valid.any():
+        return np.full((n_groups, 0, 0), -1, dtype=row_dtype), 0, 0
+
+    xi = x[valid].astype(np.int64)
+    yi = y[valid].astype(np.int64)
+    x0 = int(xi.min()) - pad
+    y0 = int(yi.min()) - pad
+    grid = np.full((n_groups, int(xi.max()) - x0 + pad + 1, int(yi.max()) - y0 + pad + 1), -1, dtype=row_dtype)
+
+    # 同一坐标有多行（复测）时保留最后一行
+    grid[codes[valid], xi - x0, yi - y0] = np.flatnonzero(valid)
+    return grid, x0, y0
+
+
+def group_quantiles_by_codes(values: np.ndarray, codes: np.ndarray, n_groups: int,
+                             quantiles: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    只做一次分组排序，计算每个分组的若干分位数（线性插值）
+
+    缺失值和编码为-1的行先剔除（复制是线性的，排序更小的数组更快）；
+    先按数值排序，再对整数分组编码做稳定排序（分组数不超过65535时编码转为uint16，numpy使用基数排序），
+    两次排序的下标不合成完整的排列，只在取分位点时按位置查找
+
+    Args:
+        values: 数值数组（NaN会被忽略）
+        codes: 每行的分组编码（-1表示不属于任何分组）
+        n_groups: 分组数
+        quantiles: 分位点列表，例如 [0.25, 0.5, 0.75]
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (各分组有效数量, 形状为 (len(quantiles), n_groups) 的分位数)
+    """
+    valid = ~np.isnan(values) & (codes >= 0)
+    if not valid.all():
+        values = values[valid]
+        codes = codes[valid]
+    keys = codes.astype(np.uint16) if n_groups < np.iinfo(np.uint16).max else codes
+
+    value_order = np.argsort(values)
+    group_order = np.argsort(keys[value_order], kind='stable')
+    counts = np.bincount(keys, minlength=n_groups)[:n_groups]
+    starts = np.cumsum(counts) - counts
+
+    result = np.full((len(quantiles), n_groups), np.nan)
+    has_data = counts > 0
+    for i, q in enumerate(quantiles):
+        pos = starts[has_data] + (counts[has_data] - 1) * q
+        lower = values[value_order[group_order[np.floor(pos).astype(np.int64)]]]
+        upper = values[value_order[group_order[np.ceil(pos).astype(np.int64)]]]
+        result[i, has_data] = lower + (upper - lower) * (pos - np.floor(pos))
+    return counts, result
+
+
+def group_moments(values: np.ndarray, codes: np.ndarray,
+                  n_groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    计算每个分组的数量、均值、样本标准差(ddof=1)和离差平方和M2（两遍法，数值稳定）
+
+    Args:
+        values: 数值数组，不能有NaN
+        codes: 每个值的分组编码（不能为-1）
+        n_groups: 分组数
+
+    Returns:
+        Tuple: (数量, 均值, 标准差, M2)，数量不足2的分组标准差为NaN
+    """
+    counts = np.bincount(codes, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=n_groups) / counts
+        m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=n_groups)
+        std = np.sqrt(m2 / (counts - 1))
+    std[counts < 2] = np.nan
+    return counts, mean, std, m2
+
+
+def group_extrema(values: np.ndarray, codes: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算每个分组的最小值和最大值（按分组稳定排序后用 reduceat 一次求出）
+
+    Args:
+        values: 数值数组，不能有NaN
+        codes: 每个值的分组编码（不能为-1）
+        n_groups: 分组数
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (最小值, 最大值)，空分组为NaN
+    """
+    counts = np.bincount(codes, minlength=n_groups)
+    order = np.argsort(codes, kind='stable')
+    sorted_values = values[order]
+    starts = (np.cumsum(counts) - counts)[counts > 0]
+    mins = np.full(n_groups, np.nan)
+    maxs = np.full(n_groups, np.nan)
+    mins[counts > 0] = np.minimum.reduceat(sorted_values, starts)
+    maxs[counts > 0] = np.maximum.reduceat(sorted_values, starts)
+    return mins, maxs
+
+
+def compute_robust_stats(df: pd.DataFrame, params: List[str], group_col: str = 'Wafer') -> pd.DataFrame:
+    """
+    一次性计算每个(分组, 参数)的稳健统计量
+
+    每个参数只做一次按(分组, 数值)的排序，再从排序结果中直接取出各分组的
+    四分位数和中位数；MAD和均值/标准差（含对数域 log1p(|x|) 的矩）
+    都是在同一份分组编码上的向量化计算，不存在按晶圆的Python循环
+
+    Args:
+        df: 数据表
+        params: 参数列表，不存在的列会被忽略
+        group_col: 分组列，默认按晶圆分组
+
+    Returns:
+        pd.DataFrame: 以(参数, 分组)为索引，列为 ROBUST_STAT_COLUMNS
+    """
+    codes, groups = group_codes(df, group_col)
+    return robust_stats_by_codes(df, params, codes, groups)
+
+
+def robust_stats_by_codes(df: pd.DataFrame, params: List[str], codes: np.ndarray, groups: pd.Index) -> pd.DataFrame:
+    """
+    按已计算好的分组编码计算稳健统计量，参见 compute_robust_stats
+
+    Args:
+        df: 数据表
+        params: 参数列表
+        codes: 每行的分组编码（-1表示不属于任何分组）
+        groups: 按编码排列的分组值
+
+    Returns:
+        pd.DataFrame: 以(参数, 分组)为索引，列为 ROBUST_STAT_COLUMNS
+    """
+    n_groups = len(groups)
+    frames = {}
+
+    for param in params:
+        if param not in df.columns:
+            continue
+
+        values = pd.to_numeric(df[param], errors='coerce').to_numpy(dtype=float)
+        valid = ~np.isnan(values) & (codes >= 0)
+        param_values = values[valid]
+        param_codes = codes[valid]
+
+        # 一次分组排序得到四分位数和中位数（缺失值和无分组的行被忽略）
+        _, (q1, median, q3) = group_quantiles_by_codes(values, codes, n_groups, [0.25, 0.5, 0.75])
+
+        # MAD: 与分组中位数的绝对偏差再取中位数
+        deviations = np.abs(values - broadcast_group_stat(median, codes))
+        _, (mad,) = group_quantiles_by_codes(deviations, codes, n_groups, [0.5])
+
+        count, mean, std, _ = group_moments(param_values, param_codes, n_groups)
+        _, log_mean, log_std, _ = group_moments(np.log1p(np.abs(param_values)), param_codes, n_groups)
+
+        frames[param] = pd.DataFrame({
+            'count': count.astype(np.int64),
+            'mean': mean,
+            'std': std,
+            'q1': q1,
+            'median': median,
+            'q3': q3,
+            'mad': mad,
+            'log_mean': log_mean,
+            'log_std': log_std
+        }, index=groups)
+
+    if not frames:
+        return pd.DataFrame(columns=ROBUST_STAT_COLUMNS)
+    return pd.concat(frames, names=['param'] + list(groups.names))
+
+
+def data_fingerprint(df: pd.DataFrame) -> str:
+    """
+    计算数据表的指纹：列名、类型和所有值（含索引）的哈希
+
+    Args:
+        df: 数据表
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps([[str(col), str(df[col].dtype)] for col in df.columns]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
 
 class BaseDataCleaner(ABC):
     """
@@ -22,18 +696,23 @@ class BaseDataCleaner(ABC):
     定义数据清洗的通用接口和基本功能
     """
     
-    def __init__(self, target_params: List[str] = None, output_dir: str = "./output"):
+    def __init__(self, target_params: List[str] = None, output_dir: str = "./output",
+                 cache_dir: Optional[str] = None, cache_max_mb: Optional[float] = CLEAN_CACHE_MAX_MB):
         """
         初始化数据清洗器
         
         Args:
             target_params (List[str]): 目标参数列表
             output_dir (str): 输出目录
+            cache_dir (str): 清洗结果缓存目录，为None时不使用缓存
+            cache_max_mb (float): 缓存目录容量上限（MB），为None时不限制
         """
         self.target_params = target_params or ["BVDSS1", "BVDSS2", "DELTABV", "IDSS1", 
                                               "VTH", "RDSON1", "VFSDS", "IGSS2", 
                                               "IGSSR2", "IDSS2"]
         self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.cache_max_mb = cache_max_mb
         self.raw_data = None
         self.clean_data = None
         self.limits = {}
@@ -113,9 +792,9 @@ class BaseDataCleaner(ABC):
                 if param not in self.clean_data.columns:
                     continue
                 
-                # 提取该参数的数据
-                param_data = self.clean_data[~self.clean_data[param].isna()].copy()
-                if param_data.empty:
+                # 提取该参数的有效数据掩码（不复制整个数据表）
+                valid_mask = self.clean_data[param].notna().to_numpy()
+                if not valid_mask.any():
                     print(f"跳过参数 {param}，无有效数据")
                     continue
                 
@@ -148,71 +827,66 @@ class BaseDataCleaner(ABC):
                 json_path = os.path.join(json_dir, f"{param}_data.json")
                 export_paths[param] = json_path
                 
-                # 准备JSON数据
-                json_records = []
-                
-                for _, row in param_data.iterrows():
-                    # 提取原始值
-                    value = row[param]
-                    
-                    # 使用单位转换模块进行转换
-                    if unit_adjuster_available and limit_upper is not None:
-                        value = adjust_unit(value, param, limit_upper)
-                    else:
-                        # 根据参数进行特殊处理，确保单位一致性 (内置的简单转换逻辑)
-                        # 处理RDSON1：RDSON1需要以毫欧姆(mohm)为单位
-                        if param == 'RDSON1' and limit_unit and limit_unit.lower() in ['mohm', 'mω', 'mω', 'mΩ']:
-                            # 判断值大小，小于1的值可能是欧姆值，需要转换为毫欧姆
-                            if value < 1:  # 可能是欧姆值
-                                original_value = value
-                                value = value * 1000  # 欧姆转毫欧姆
-                                print(f"JSON导出时转换RDSON1值：原值={original_value}欧姆 -> 新值={value}毫欧")
-                        
-                        # 处理电流单位：根据LimitU单位进行转换
-                        if param in ['IDSS1', 'IDSS2', 'IGSS2', 'IGSSR2']:
-                            if limit_unit and limit_unit.lower() in ['na', 'na']:  # 如果限制单位是纳安(nA)
-                                if value < 1e-6:  # 如果值很小，可能是安培(A)
-                                    original_value = value
-                                    value = value * 1e9  # 安培转纳安
-                                    print(f"JSON导出时转换{param}值：原值={original_value}A -> 新值={value}nA")
-                                elif value < 1e-3:  # 如果值小于1e-3，可能是微安(uA)
-                                    original_value = value
-                                    value = value * 1000  # 微安转纳安
-                                    print(f"JSON导出时转换{param}值：原值={original_value}uA -> 新值={value}nA")
-                            elif limit_unit and limit_unit.lower() in ['ua', 'μa', 'ua']:  # 如果限制单位是微安(uA)
-                                if value < 1e-3:  # 如果值很小，可能是安培(A)
+                # 以流式方式写入JSON数据，内存占用不随记录数增长
+                try:
+                    with JsonStreamWriter(json_path) as writer:
+                        for row in iter_records(self.clean_data, ['Lot', 'Wafer', 'No.U', param], mask=valid_mask):
+                            # 提取原始值
+                            value = row[param]
+                            
+                            # 使用单位转换模块进行转换
+                            if unit_adjuster_available and limit_upper is not None:
+                                value = adjust_unit(value, param, limit_upper)
+                            else:
+                                # 根据参数进行特殊处理，确保单位一致性 (内置的简单转换逻辑)
+                                # 处理RDSON1：RDSON1需要以毫欧姆(mohm)为单位
+                                if param == 'RDSON1' and limit_unit and limit_unit.lower() in ['mohm', 'mω', 'mω', 'mΩ']:
+                                    # 判断值大小，小于1的值可能是欧姆值，需要转换为毫欧姆
+                                    if value < 1:  # 可能是欧姆值
+                                        original_value = value
+                                        value = value * 1000  # 欧姆转毫欧姆
+                                        print(f"JSON导出时转换RDSON1值：原值={original_value}欧姆 -> 新值={value}毫欧")
+                                
+                                # 处理电流单位：根据LimitU单位进行转换
+                                if param in ['IDSS1', 'IDSS2', 'IGSS2', 'IGSSR2']:
+                                    if limit_unit and limit_unit.lower() in ['na', 'na']:  # 如果限制单位是纳安(nA)
+                                        if value < 1e-6:  # 如果值很小，可能是安培(A)
+                                            original_value = value
+                                            value = value * 1e9  # 安培转纳安
+                                            print(f"JSON导出时转换{param}值：原值={original_value}A -> 新值={value}nA")
+                                        elif value < 1e-3:  # 如果值小于1e-3，可能是微安(uA)
+                                            original_value = value
+                                            value = value * 1000  # 微安转纳安
+                                            print(f"JSON导出时转换{param}值：原值={original_value}uA -> 新值={value}nA")
+                                    elif limit_unit and limit_unit.lower() in ['ua', 'μa', 'ua']:  # 如果限制单位是微安(uA)
+                                        if value < 1e-3:  # 如果值很小，可能是安培(A)
+                                            original_value = value
+                                            value = value * 1e6  # 安培转微安
+                                            print(f"JSON导出时转换{param}值：原值={original_value}A -> 新值={value}uA")
+                                
+                                # 处理IDSS3：特殊处理微安单位
+                                if param == 'IDSS3' and limit_unit and limit_unit.lower() in ['ua', 'μa', 'ua'] and value < 1e-3:
                                     original_value = value
                                     value = value * 1e6  # 安培转微安
-                                    print(f"JSON导出时转换{param}值：原值={original_value}A -> 新值={value}uA")
-                        
-                        # 处理IDSS3：特殊处理微安单位
-                        if param == 'IDSS3' and limit_unit and limit_unit.lower() in ['ua', 'μa', 'ua'] and value < 1e-3:
-                            original_value = value
-                            value = value * 1e6  # 安培转微安
-                            print(f"JSON导出时转换IDSS3值：原值={original_value}A -> 新值={value}uA")
-                    
-                    # 创建记录，确保值匹配单位
-                    record = {
-                        'Lot': row.get('Lot', ''),
-                        'Wafer': row.get('Wafer', ''),
-                        'No.U': row.get('No.U', 0),
-                        param: value
-                    }
-                    
-                    # 添加限制值，不做转换，保持原始值
-                    if limit_upper is not None:
-                        record['LimitU'] = limit_upper
-                    if limit_lower is not None:
-                        record['LimitL'] = limit_lower
-                    if limit_unit:
-                        record['Unit'] = limit_unit
-                        
-                    json_records.append(record)
-                
-                # 导出JSON
-                try:
-                    with open(json_path, 'w', encoding='utf-8') as f:
-                        json.dump(json_records, f, indent=2)
+                                    print(f"JSON导出时转换IDSS3值：原值={original_value}A -> 新值={value}uA")
+                            
+                            # 创建记录，确保值匹配单位
+                            record = {
+                                'Lot': row.get('Lot', ''),
+                                'Wafer': row.get('Wafer', ''),
+                                'No.U': row.get('No.U', 0),
+                                param: value
+                            }
+                            
+                            # 添加限制值，不做转换，保持原始值
+                            if limit_upper is not None:
+                                record['LimitU'] = limit_upper
+                            if limit_lower is not None:
+                                record['LimitL'] = limit_lower
+                            if limit_unit:
+                                record['Unit'] = limit_unit
+                            
+                            writer.write(record)
                     print(f"已导出参数 {param} 的JSON数据: {json_path}")
                 except Exception as e:
                     print(f"导出参数 {param} 的JSON数据时出错: {str(e)}")
@@ -223,99 +897,453 @@ class BaseDataCleaner(ABC):
             json_path = os.path.join(json_dir, "all_data.json")
             export_paths['all'] = json_path
             
-            # 准备JSON数据
-            json_records = []
-            
-            for _, row in self.clean_data.iterrows():
-                record = {
-                    'Lot': row.get('Lot', ''),
-                    'Wafer': row.get('Wafer', ''),
-                    'No.U': row.get('No.U', 0)
-                }
-                
-                # 添加参数值
-                for param in self.target_params:
-                    if param in row and not pd.isna(row[param]):
-                        value = row[param]
-                        
-                        # 获取参数的上限值
-                        limit_upper = None
-                        if self.limits and param in self.limits and 'upper' in self.limits[param]:
-                            limit_upper = self.limits[param]['upper']
+            # 以流式方式写入JSON数据，内存占用不随记录数增长
+            try:
+                with JsonStreamWriter(json_path) as writer:
+                    for row in iter_records(self.clean_data, ['Lot', 'Wafer', 'No.U'] + self.target_params):
+                        record = {
+                            'Lot': row.get('Lot', ''),
+                            'Wafer': row.get('Wafer', ''),
+                            'No.U': row.get('No.U', 0)
+                        }
                         
-                        # 使用单位转换模块进行转换
-                        if unit_adjuster_available and limit_upper is not None:
-                            value = adjust_unit(value, param, limit_upper)
+                        # 添加参数值
+                        for param in self.target_params:
+                            if param in row and not pd.isna(row[param]):
+                                value = row[param]
+                                
+                                # 获取参数的上限值
+                                limit_upper = None
+                                if self.limits and param in self.limits and 'upper' in self.limits[param]:
+                                    limit_upper = self.limits[param]['upper']
+                                
+                                # 使用单位转换模块进行转换
+                                if unit_adjuster_available and limit_upper is not None:
+                                    value = adjust_unit(value, param, limit_upper)
+                                
+                                record[param] = value
                         
-                        record[param] = value
-                
-                json_records.append(record)
-            
-            # 导出JSON
-            try:
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(json_records, f, indent=2)
+                        writer.write(record)
                 print(f"已导出所有参数的JSON数据: {json_path}")
             except Exception as e:
                 print(f"导出所有参数的JSON数据时出错: {str(e)}")
             
             return export_paths
     
-    def get_limits(self) -> Dict[str, Dict[str, float]]:
+    def get_limits(self) -> Dict[str, Dict[str, float]]:
+        """
+        获取参数限制
+        
+        Returns:
+            Dict[str, Dict[str, float]]: 参数限制字典
+        """
+        return self.limits
+    
+    def set_limits(self, limits: Dict[str, Dict[str, float]]) -> None:
+        """
+        设置参数限制
+        
+        Args:
+            limits: 参数限制字典 {参数名: {'upper': 上限值, 'lower': 下限值}}
+        """
+        self.limits = limits
+    
+    def compact_memory(self, dtype_overrides: Optional[Dict[str, Any]] = None) -> Optional[pd.DataFrame]:
+        """
+        将清洗后的数据转换为内存优化的列类型（见 compact_frame），并输出转换前后的内存占用
+        
+        Args:
+            dtype_overrides: 参数 -> 类型 的覆盖设置，例如 {'RDSON1': 'float64'}
+            
+        Returns:
+            pd.DataFrame: 转换后的数据
+        """
+        if self.clean_data is None:
+            return None
+        
+        before = memory_usage_mb(self.clean_data)
+        self.clean_data = compact_frame(self.clean_data, self.target_params, dtype_overrides)
+        after = memory_usage_mb(self.clean_data)
+        print(f"内存优化: {before:.2f} MB -> {after:.2f} MB")
+        return self.clean_data
+    
+    def apply_cleaner_strategy(self, strategy: 'DataCleanerStrategy', workers: int = 1) -> pd.DataFrame:
+        """
+        应用清洗策略
+        
+        设置了缓存目录时，相同数据、策略和限制值的结果直接从缓存读取
+        
+        Args:
+            strategy: 清洗策略对象
+            workers: 并发计算各参数标记的线程数，1表示串行
+            
+        Returns:
+            pd.DataFrame: 应用策略后的数据
+        """
+        if self.raw_data is None:
+            print("错误: 原始数据为空，无法应用清洗策略")
+            return None
+        
+        cache_key = self.cache_key('strategy', strategy)
+        cached = self.load_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = self._run_strategy(strategy, workers)
+        self.store_cached(cache_key, result)
+        return result
+    
+    def _run_strategy(self, strategy: 'DataCleanerStrategy', workers: int = 1) -> pd.DataFrame:
+        return strategy.clean(self.raw_data, self.limits, workers=workers)
+    
+    def cache_key(self, kind: str, strategy: 'DataCleanerStrategy') -> Optional[str]:
+        """
+        计算清洗结果的缓存键
+        
+        缓存键由原始数据指纹、策略类及其参数、参数限制和目标参数共同决定
+        
+        Args:
+            kind: 结果类型，区分只应用策略的结果和完整清洗（含单位转换）的结果
+            strategy: 清洗策略对象
+            
+        Returns:
+            Optional[str]: 缓存键，未设置缓存目录或原始数据为空时返回None
+        """
+        if not self.cache_dir or self.raw_data is None:
+            return None
+        
+        key = {
+            'version': CLEAN_CACHE_VERSION,
+            'cleaner': type(self).__name__,
+            'kind': kind,
+            'data': data_fingerprint(self.raw_data),
+            'strategy': strategy.describe(),
+            'limits': self.limits,
+            'target_params': self.target_params
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def load_cached(self, cache_key: Optional[str]) -> Optional[pd.DataFrame]:
+        """
+        读取缓存的清洗结果
+        
+        不使用内存映射而是整体读入内存：返回的数据表会作为 df_clean 长期存在，之后 store_cached/evict_cache
+        还可能删除或替换同一个缓存目录，而Windows上无法删除或替换仍被映射的文件
+        
+        Args:
+            cache_key: 缓存键
+            
+        Returns:
+            Optional[pd.DataFrame]: 缓存的数据，未命中时返回None
+        """
+        if cache_key is None:
+            return None
+        
+        cache_path = os.path.join(self.cache_dir, cache_key)
+        if not os.path.isdir(cache_path):
+            return None
+        
+        try:
+            df = ColumnarStore(cache_path).read(mmap=False)
+        except Exception as e:
+            print(f"警告: 读取清洗结果缓存失败，将重新清洗: {str(e)}")
+            return None
+        
+        # 更新修改时间，容量超限时按修改时间淘汰最久未使用的条目
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        print(f"命中清洗结果缓存: {cache_key}")
+        return df
+    
+    def store_cached(self, cache_key: Optional[str], df: Optional[pd.DataFrame]) -> None:
+        """
+        将清洗结果写入缓存
+        
+        只缓存默认行索引（0..n-1）的数据表，因为列式存储不保存索引
+        
+        Args:
+            cache_key: 缓存键
+            df: 清洗结果
+        """
+        if cache_key is None or df is None:
+            return
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            return
+        
+        cache_path = os.path.join(self.cache_dir, cache_key)
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        try:
+            with ColumnarStore(tmp_path, mode='w') as store:
+                store.append(df)
+            if os.path.isdir(cache_path):
+                shutil.rmtree(cache_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            print(f"警告: 写入清洗结果缓存失败: {str(e)}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        
+        self.evict_cache(keep=cache_key)
+    
+    def evict_cache(self, keep: Optional[str] = None) -> int:
+        """
+        缓存目录超过容量上限时，按修改时间（每次命中时更新）从旧到新删除条目，直到不超过上限
+        
+        Args:
+            keep: 不删除的缓存键（刚写入的结果）
+            
+        Returns:
+            int: 删除的条目数
+        """
+        if not self.cache_dir or self.cache_max_mb is None or not os.path.isdir(self.cache_dir):
+            return 0
+        
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            # 跳过其他进程正在写入的临时目录
+            if not os.path.isdir(path) or '.tmp' in name:
+                continue
+            size = sum(os.path.getsize(os.path.join(root, file))
+                       for root, _, files in os.walk(path) for file in files)
+            entries.append((os.path.getmtime(path), name, size))
+        
+        limit = self.cache_max_mb * 1024 * 1024
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for _, name, size in sorted(entries):
+            if total <= limit:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
+            removed += 1
+        
+        if removed:
+            print(f"清洗结果缓存超过 {self.cache_max_mb:g} MB，已删除 {removed} 个最久未使用的条目")
+        return removed
+    
+    def clear_cache(self) -> None:
+        """
+        删除缓存目录中的所有清洗结果
+        """
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+
+class DataCleanerStrategy(ABC):
+    """
+    数据清洗策略接口
+    
+    定义数据清洗策略的接口。策略必须实现 apply，在工作表上原地添加标记，
+    clean 负责复制数据；多个策略可以通过 StrategyPipeline 共用同一张工作表。
+    只实现了 clean(data, limits) 的旧式策略用 LegacyStrategyAdapter 包装
+    """
+    
+    def clean(self, data: pd.DataFrame, limits: Dict[str, Dict[str, float]] = None, workers: int = 1) -> pd.DataFrame:
+        """
+        执行数据清洗
+        
+        Args:
+            data: 待清洗的数据
+            limits: 参数限制字典
+            workers: 并发计算各参数标记的线程数
+            
+        Returns:
+            pd.DataFrame: 清洗后的数据
+        """
+        # 复制数据，避免修改原始数据
+        df_clean = data.copy()
+        self.apply(df_clean, limits or {}, workers)
+        return df_clean
+    
+    @abstractmethod
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
+        """
+        在工作表上原地执行清洗，只转换参数列类型并写入标记列
+        
+        Args:
+            df_clean: 工作数据表（会被修改）
+            limits: 参数限制字典
+            workers: 并发计算各参数标记的线程数
+        """
+        pass
+    
+    def config(self) -> Dict[str, Any]:
+        """
+        策略参数：构造函数各参数对应属性的当前值
+        
+        Returns:
+            Dict[str, Any]: 参数名 -> 参数值
+        """
+        params = inspect.signature(type(self).__init__).parameters
+        return {name: getattr(self, name) for name in params if name != 'self' and hasattr(self, name)}
+    
+    def describe(self) -> Dict[str, Any]:
         """
-        获取参数限制
+        策略的完整描述（类名和参数），用于生成清洗结果的缓存键
         
         Returns:
-            Dict[str, Dict[str, float]]: 参数限制字典
+            Dict[str, Any]: 策略描述
         """
-        return self.limits
+        return {'class': f"{type(self).__module__}.{type(self).__qualname__}", 'config': self.config()}
     
-    def set_limits(self, limits: Dict[str, Dict[str, float]]) -> None:
+    def needs_global_stats(self) -> bool:
         """
-        设置参数限制
+        分块清洗时是否需要先遍历所有数据块收集全局统计量
+        
+        只依赖单片晶圆数据的策略在晶圆对齐的数据块上可以直接执行，不需要全局统计量
+        
+        Returns:
+            bool: 需要时分块清洗会先执行一遍 collect_stats
+        """
+        return type(self).collect_stats is not DataCleanerStrategy.collect_stats
+    
+    def collect_stats(self, df_chunk: pd.DataFrame, limits: Dict[str, Dict[str, float]]) -> Any:
+        """
+        分块清洗第一遍：计算一个数据块的可合并统计量
         
         Args:
-            limits: 参数限制字典 {参数名: {'upper': 上限值, 'lower': 下限值}}
+            df_chunk: 数据块（可以被修改）
+            limits: 参数限制字典
+            
+        Returns:
+            Any: 可以用 merge_stats 合并的统计量
         """
-        self.limits = limits
+        return None
     
-    def apply_cleaner_strategy(self, strategy: 'DataCleanerStrategy') -> pd.DataFrame:
+    def merge_stats(self, left: Any, right: Any) -> Any:
         """
-        应用清洗策略
+        合并两个数据块的统计量
         
         Args:
-            strategy: 清洗策略对象
+            left: 统计量
+            right: 统计量
             
         Returns:
-            pd.DataFrame: 应用策略后的数据
+            Any: 合并后的统计量
         """
-        if self.raw_data is None:
-            print("错误: 原始数据为空，无法应用清洗策略")
-            return None
+        return None
+    
+    def set_global_stats(self, stats: Any) -> None:
+        """
+        设置所有数据块合并后的统计量，之后的 apply 使用全局统计量代替当前数据表的统计量
         
-        return strategy.clean(self.raw_data, self.limits)
+        Args:
+            stats: 合并后的统计量，为None时恢复使用当前数据表的统计量
+        """
+        pass
 
 
-class DataCleanerStrategy(ABC):
+class StrategyPipeline(DataCleanerStrategy):
     """
-    数据清洗策略接口
+    清洗策略管道
     
-    定义数据清洗策略的接口
+    依次在同一张工作表上执行多个策略，各策略只贡献标记位，
+    整个管道只复制一次原始数据
     """
     
-    @abstractmethod
-    def clean(self, data: pd.DataFrame, limits: Dict[str, Dict[str, float]] = None) -> pd.DataFrame:
+    def __init__(self, strategies: List[DataCleanerStrategy] = None):
         """
-        执行数据清洗
+        初始化策略管道
         
         Args:
-            data: 待清洗的数据
-            limits: 参数限制字典
+            strategies: 按执行顺序排列的策略列表
+        """
+        self.strategies = list(strategies or [])
+    
+    def add(self, strategy: DataCleanerStrategy) -> 'StrategyPipeline':
+        """
+        追加策略
+        
+        Args:
+            strategy: 清洗策略对象
             
         Returns:
-            pd.DataFrame: 清洗后的数据
+            StrategyPipeline: 管道自身，便于链式调用
         """
-        pass
+        self.strategies.append(strategy)
+        return self
+    
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
+        """
+        依次执行管道中的所有策略
+        
+        Args:
+            df_clean: 工作数据表（会被修改）
+            limits: 参数限制字典
+            workers: 并发计算各参数标记的线程数
+        """
+        for strategy in self.strategies:
+            strategy.apply(df_clean, limits, workers)
+    
+    def config(self) -> Dict[str, Any]:
+        return {'strategies': [strategy.describe() for strategy in self.strategies]}
+    
+    def needs_global_stats(self) -> bool:
+        return any(strategy.needs_global_stats() for strategy in self.strategies)
+    
+    def collect_stats(self, df_chunk: pd.DataFrame, limits: Dict[str, Dict[str, float]]) -> List[Any]:
+        """
+        依次收集各策略的统计量
+        
+        后面的策略看到的数据类型与 apply 时一致：只要后面还有策略需要统计量，
+        就先在数据块上执行当前策略
+        """
+        stats = []
+        for i, strategy in enumerate(self.strategies):
+            stats.append(strategy.collect_stats(df_chunk, limits) if strategy.needs_global_stats() else None)
+            if any(later.needs_global_stats() for later in self.strategies[i + 1:]):
+                strategy.apply(df_chunk, limits)
+        return stats
+    
+    def merge_stats(self, left: List[Any], right: List[Any]) -> List[Any]:
+        return [strategy.merge_stats(a, b) if strategy.needs_global_stats() else None
+                for strategy, a, b in zip(self.strategies, left, right)]
+    
+    def set_global_stats(self, stats: Optional[List[Any]]) -> None:
+        stats = stats if stats is not None else [None] * len(self.strategies)
+        for strategy, strategy_stats in zip(self.strategies, stats):
+            if strategy.needs_global_stats():
+                strategy.set_global_stats(strategy_stats)
+
+
+class LegacyStrategyAdapter(DataCleanerStrategy):
+    """
+    旧式策略适配器
+    
+    把只实现了 clean(data, limits) 的策略对象包装为 DataCleanerStrategy：
+    单独使用时直接调用其 clean；在管道中执行时单独清洗一份副本，再合并其新增列和标记位
+    """
+    
+    def __init__(self, strategy: Any):
+        """
+        初始化适配器
+        
+        Args:
+            strategy: 实现了 clean(data, limits) 的旧式策略对象
+        """
+        self.strategy = strategy
+    
+    def clean(self, data: pd.DataFrame, limits: Dict[str, Dict[str, float]] = None, workers: int = 1) -> pd.DataFrame:
+        # 旧式策略不支持并发参数，结果（可能删除了行）原样返回
+        return self.strategy.clean(data, limits)
+    
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
+        result = self.strategy.clean(df_clean, limits)
+        for col in result.columns:
+            if is_flag_column(col) and col in df_clean.columns:
+                df_clean[col] = df_clean[col].to_numpy(dtype=FLAG_DTYPE) | result[col].to_numpy(dtype=FLAG_DTYPE)
+            elif col not in df_clean.columns:
+                df_clean[col] = result[col]
+    
+    def describe(self) -> Dict[str, Any]:
+        strategy_type = type(self.strategy)
+        return {'class': f"{strategy_type.__module__}.{strategy_type.__qualname__}",
+                'config': dict(vars(self.strategy))}
 
 
 class CPLogCleaner(BaseDataCleaner):
@@ -325,16 +1353,21 @@ class CPLogCleaner(BaseDataCleaner):
     专门用于清洗CP测试日志数据的实现
     """
     
-    def __init__(self, target_params: List[str] = None, output_dir: str = "./output"):
+    def __init__(self, target_params: List[str] = None, output_dir: str = "./output",
+                 cache_dir: Optional[str] = None, cache_max_mb: Optional[float] = CLEAN_CACHE_MAX_MB):
         """
         初始化CP测试日志数据清洗器
         
         Args:
             target_params: 目标参数列表
             output_dir: 输出目录
+            cache_dir: 清洗结果缓存目录，为None时不使用缓存
+            cache_max_mb: 缓存目录容量上限（MB），为None时不限制
         """
-        super().__init__(target_params, output_dir)
+        super().__init__(target_params, output_dir, cache_dir, cache_max_mb)
         self.log_files = []
+        self.bin_data = None
+        self.test_times = None
         
         # 检查并添加IDSS3参数（如果不存在）
         if target_params and "IDSS3" not in target_params:
@@ -367,32 +1400,11 @@ class CPLogCleaner(BaseDataCleaner):
                 print(f"错误: 未能从目录 {data_source} 中提取有效数据")
                 return False
             
-            # 检查是否包含必要的列
-            for param in self.target_params:
-                if param not in df.columns or df[param].count() == 0:
-                    print(f"警告: 参数 {param} 没有有效数据，将以空值填充")
-                    df[param] = np.nan
-            
-            # 确保包含必要的基础列
-            if 'Lot' not in df.columns:
-                print("警告: 数据中缺少Lot列，添加默认值'LOT01'")
-                df['Lot'] = 'LOT01'
-                
-            if 'Wafer' not in df.columns:
-                print("警告: 数据中缺少Wafer列，添加默认值'01'")
-                df['Wafer'] = '01'
-                
-            if 'No.U' not in df.columns:
-                print("警告: 数据中缺少No.U列，添加默认值(行索引+1)")
-                df['No.U'] = range(1, len(df) + 1)
-            
-            # 转换数据类型
-            for param in self.target_params:
-                if param in df.columns:
-                    df[param] = pd.to_numeric(df[param], errors='coerce')
-            
+            self._prepare_frame(df)
             self.raw_data = df
             self.limits = limits
+            self.bin_data = parser.bin_data
+            self.test_times = parser.test_times
             
             valid_count = df.count().min()
             print(f"成功加载 {len(self.raw_data)} 条数据记录，其中至少 {valid_count} 条包含完整数据")
@@ -402,10 +1414,45 @@ class CPLogCleaner(BaseDataCleaner):
             print("错误: 不支持的数据源类型，请提供有效的DataFrame或数据目录路径")
             return False
     
-    def clean(self) -> pd.DataFrame:
+    def _prepare_frame(self, df: pd.DataFrame) -> None:
+        """
+        补齐解析结果中缺少的列并转换参数类型（原地修改）
+        
+        Args:
+            df: 解析得到的数据表
+        """
+        # 检查是否包含必要的列
+        for param in self.target_params:
+            if param not in df.columns or df[param].count() == 0:
+                print(f"警告: 参数 {param} 没有有效数据，将以空值填充")
+                df[param] = np.nan
+        
+        # 确保包含必要的基础列
+        if 'Lot' not in df.columns:
+            print("警告: 数据中缺少Lot列，添加默认值'LOT01'")
+            df['Lot'] = 'LOT01'
+            
+        if 'Wafer' not in df.columns:
+            print("警告: 数据中缺少Wafer列，添加默认值'01'")
+            df['Wafer'] = '01'
+            
+        if 'No.U' not in df.columns:
+            print("警告: 数据中缺少No.U列，添加默认值(行索引+1)")
+            df['No.U'] = range(1, len(df) + 1)
+        
+        # 转换数据类型
+        for param in self.target_params:
+            if param in df.columns:
+                df[param] = pd.to_numeric(df[param], errors='coerce')
+    
+    def clean(self, strategy: Optional['DataCleanerStrategy'] = None, workers: int = 1) -> pd.DataFrame:
         """
         执行CP测试日志数据清洗
         
+        Args:
+            strategy: 清洗策略（可以是StrategyPipeline），默认使用标准清洗策略
+            workers: 并发计算各参数标记的线程数
+        
         Returns:
             pd.DataFrame: 清洗后的数据
         """
@@ -413,11 +1460,30 @@ class CPLogCleaner(BaseDataCleaner):
             print("错误: 原始数据为空，无法进行清洗")
             return None
         
-        # 应用默认的清洗策略
-        default_strategy = StandardCPDataCleanerStrategy()
-        self.clean_data = self.apply_cleaner_strategy(default_strategy)
+        # 相同数据和策略的清洗结果（含单位转换）直接从缓存读取
+        strategy = strategy or StandardCPDataCleanerStrategy()
+        cache_key = self.cache_key('clean', strategy)
+        cached = self.load_cached(cache_key)
+        if cached is not None:
+            self.clean_data = cached
+            return self.clean_data
+        
+        # 应用清洗策略
+        self.clean_data = self._run_strategy(strategy, workers)
         
         # 应用单位转换
+        self._adjust_units(self.clean_data)
+        
+        self.store_cached(cache_key, self.clean_data)
+        return self.clean_data
+    
+    def _adjust_units(self, df: pd.DataFrame) -> None:
+        """
+        按参数上限对数据表中的数值做单位转换（原地修改）
+        
+        Args:
+            df: 清洗后的数据表
+        """
         try:
             print("开始应用数据单位转换...")
             from unit_adjuster import adjust_unit, parse_limit_value
@@ -429,7 +1495,7 @@ class CPLogCleaner(BaseDataCleaner):
             ]
             
             for param in self.target_params:
-                if param not in supported_params or param not in self.clean_data.columns:
+                if param not in supported_params or param not in df.columns:
                     continue
                 
                 # 获取该参数的限制值
@@ -446,12 +1512,12 @@ class CPLogCleaner(BaseDataCleaner):
                 
                 # 对每个数值应用单位转换
                 converted_count = 0
-                for idx in self.clean_data.index:
-                    value = self.clean_data.at[idx, param]
+                for idx in df.index:
+                    value = df.at[idx, param]
                     if pd.notna(value):
                         adjusted_value = adjust_unit(value, param, limit_upper)
                         if adjusted_value != value:
-                            self.clean_data.at[idx, param] = adjusted_value
+                            df.at[idx, param] = adjusted_value
                             converted_count += 1
                 
                 if converted_count > 0:
@@ -463,8 +1529,124 @@ class CPLogCleaner(BaseDataCleaner):
             print(f"数据单位转换时出错: {str(e)}")
             import traceback
             traceback.print_exc()
+    
+    def clean_chunked(self, data_sources: Union[str, List[str]], store_path: str,
+                      strategy: Optional['DataCleanerStrategy'] = None,
+                      wafers_per_chunk: int = 5, workers: int = 1) -> Optional[ColumnarStore]:
+        """
+        分块清洗，用于无法一次载入内存的多批次数据
         
-        return self.clean_data
+        每个日志文件只解析一次，原始数据先按文件暂存到列式存储；之后按晶圆对齐分块，
+        一块包含若干片完整的晶圆，只依赖单片晶圆的策略可以直接逐块执行。
+        需要全局统计量的策略（如 RemoveOutliersStrategy 的均值/标准差）先遍历一遍
+        所有数据块收集可合并的统计量，第二遍再逐块清洗，结果与整体载入后清洗一致。
+        清洗后的数据块依次写入列式存储
+        
+        Args:
+            data_sources: 一个或多个数据目录
+            store_path: 清洗结果的列式存储目录
+            strategy: 清洗策略，默认使用标准清洗策略
+            wafers_per_chunk: 每个数据块包含的晶圆数
+            workers: 并发计算各参数标记的线程数
+            
+        Returns:
+            ColumnarStore: 清洗结果，失败时返回None
+        """
+        if isinstance(data_sources, str):
+            data_sources = [data_sources]
+        
+        staging_path = store_path.rstrip('/\\') + '_staging'
+        strategy = strategy or StandardCPDataCleanerStrategy()
+        
+        # 无论成功与否都删除暂存的原始数据，并清除设置在调用方策略对象上的全局统计量
+        try:
+            wafer_files = self._stage_wafer_files(data_sources, staging_path)
+            if not wafer_files:
+                print("错误: 未能从数据目录中提取有效数据")
+                return None
+            
+            staging = ColumnarStore(staging_path)
+            wafer_keys = list(wafer_files.keys())
+            
+            def iter_chunks() -> Iterator[pd.DataFrame]:
+                for start in range(0, len(wafer_keys), wafers_per_chunk):
+                    indices = [index for key in wafer_keys[start:start + wafers_per_chunk] for index in wafer_files[key]]
+                    df_chunk = staging.read_chunks(indices)
+                    self._prepare_frame(df_chunk)
+                    yield df_chunk
+            
+            # 第一遍：收集全局统计量
+            if strategy.needs_global_stats():
+                print("第一遍: 收集全局统计量...")
+                stats = None
+                for df_chunk in iter_chunks():
+                    chunk_stats = strategy.collect_stats(df_chunk, self.limits)
+                    stats = chunk_stats if stats is None else strategy.merge_stats(stats, chunk_stats)
+                strategy.set_global_stats(stats)
+            
+            # 第二遍：逐块清洗并写入列式存储
+            print(f"逐块清洗 {len(wafer_keys)} 片晶圆，每块 {wafers_per_chunk} 片...")
+            with ColumnarStore(store_path, mode='w') as store:
+                for df_chunk in iter_chunks():
+                    df_chunk = strategy.clean(df_chunk, self.limits, workers=workers)
+                    self._adjust_units(df_chunk)
+                    store.append(df_chunk)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            if strategy.needs_global_stats():
+                strategy.set_global_stats(None)
+        
+        print(f"清洗结果已写入列式存储: {store_path} ({store.n_rows} 条记录)")
+        return ColumnarStore(store_path)
+    
+    def _stage_wafer_files(self, data_sources: List[str], staging_path: str) -> Dict[Tuple[str, str], List[int]]:
+        """
+        解析所有日志文件，每个文件作为一块写入暂存的列式存储，同时合并参数限制
+        
+        Args:
+            data_sources: 数据目录列表
+            staging_path: 暂存目录
+            
+        Returns:
+            Dict[Tuple[str, str], List[int]]: (批次, 晶圆) -> 暂存块序号列表（同一晶圆的复测文件归入同一晶圆）
+        """
+        from log_parser import CPLogParser
+        
+        wafer_files = {}
+        self.limits = {}
+        
+        with ColumnarStore(staging_path, mode='w') as staging:
+            for data_source in data_sources:
+                if not os.path.isdir(data_source):
+                    print(f"警告: 数据目录不存在，跳过: {data_source}")
+                    continue
+                
+                parser = CPLogParser(data_source)
+                parser.target_params = self.target_params
+                source_limits = {}
+                
+                for file_path in parser.find_data_files():
+                    records, limits = parser._parse_file(file_path)
+                    parser.merge_limits(source_limits, limits)
+                    if not records:
+                        continue
+                    
+                    # 与 parse_all_files 一样补齐所有目标参数列
+                    df_file = pd.DataFrame(records)
+                    for param in parser.extended_params():
+                        if param not in df_file.columns:
+                            df_file[param] = np.nan
+                    
+                    key = (str(records[0]['Lot']), str(records[0]['Wafer']))
+                    wafer_files.setdefault(key, []).append(len(staging.chunks))
+                    staging.append(df_file)
+                
+                # 各数据目录的限制值合并，先出现的优先
+                parser.fill_default_limits(source_limits)
+                for param, limit_values in source_limits.items():
+                    self.limits.setdefault(param, limit_values)
+        
+        return wafer_files
 
 
 class StandardCPDataCleanerStrategy(DataCleanerStrategy):
@@ -474,20 +1656,15 @@ class StandardCPDataCleanerStrategy(DataCleanerStrategy):
     实现标准的CP数据清洗流程
     """
     
-    def clean(self, data: pd.DataFrame, limits: Dict[str, Dict[str, float]] = None) -> pd.DataFrame:
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
         """
         执行标准CP数据清洗
         
         Args:
-            data: 待清洗的数据
+            df_clean: 工作数据表（会被修改）
             limits: 参数限制字典
-            
-        Returns:
-            pd.DataFrame: 清洗后的数据
+            workers: 并发计算各参数标记的线程数
         """
-        # 复制数据，避免修改原始数据
-        df_clean = data.copy()
-        
         # 确保必要的列存在
         required_columns = ['Lot', 'Wafer', 'No.U']
         for col in required_columns:
@@ -499,37 +1676,43 @@ class StandardCPDataCleanerStrategy(DataCleanerStrategy):
                 elif col == 'No.U':
                     df_clean['No.U'] = range(1, len(df_clean) + 1)
         
-        # 处理参数数据
-        for param in df_clean.columns:
-            if param in ['Lot', 'Wafer', 'No.U']:
-                continue
-            
-            # 将参数列转换为数值类型
+        # 将参数列转换为数值类型
+        params = [param for param in df_clean.columns
+                  if param not in META_COLUMNS and not is_flag_column(param)]
+        for param in params:
             df_clean[param] = pd.to_numeric(df_clean[param], errors='coerce')
-            
+        
+        def evaluate(param: str) -> Optional[np.ndarray]:
             # 获取参数限制
             param_limits = limits.get(param, {})
             upper_limit = param_limits.get('upper')
             lower_limit = param_limits.get('lower')
+            if upper_limit is None and lower_limit is None:
+                return None
+            
+            values = df_clean[param].to_numpy(dtype=float)
+            bits = np.zeros(len(values), dtype=FLAG_DTYPE)
             
             # 标记异常值
             if upper_limit is not None:
-                mask_high = df_clean[param] > upper_limit * 1.5
-                df_clean.loc[mask_high, f"{param}_outlier_high"] = True
+                mask_high = values > upper_limit * 1.5
+                bits |= flag_bits(mask_high, CleanFlag.OUTLIER_HIGH)
                 
                 # 标记超出规格的值（但不是异常值）
-                mask_spec = (df_clean[param] > upper_limit) & (~mask_high)
-                df_clean.loc[mask_spec, f"{param}_spec_high"] = True
+                mask_spec = (values > upper_limit) & (~mask_high)
+                bits |= flag_bits(mask_spec, CleanFlag.SPEC_HIGH)
             
             if lower_limit is not None:
-                mask_low = df_clean[param] < lower_limit * 0.5
-                df_clean.loc[mask_low, f"{param}_outlier_low"] = True
+                mask_low = values < lower_limit * 0.5
+                bits |= flag_bits(mask_low, CleanFlag.OUTLIER_LOW)
                 
                 # 标记超出规格的值（但不是异常值）
-                mask_spec = (df_clean[param] < lower_limit) & (~mask_low)
-                df_clean.loc[mask_spec, f"{param}_spec_low"] = True
+                mask_spec = (values < lower_limit) & (~mask_low)
+                bits |= flag_bits(mask_spec, CleanFlag.SPEC_LOW)
+            
+            return bits
         
-        return df_clean
+        apply_param_flags(df_clean, params, evaluate, workers)
 
 
 class CPDataCleanerFactory:
@@ -540,7 +1723,9 @@ class CPDataCleanerFactory:
     """
     
     @staticmethod
-    def create_cleaner(cleaner_type: str, target_params: List[str] = None, output_dir: str = "./output") -> BaseDataCleaner:
+    def create_cleaner(cleaner_type: str, target_params: List[str] = None, output_dir: str = "./output",
+                       cache_dir: Optional[str] = None,
+                       cache_max_mb: Optional[float] = CLEAN_CACHE_MAX_MB) -> BaseDataCleaner:
         """
         创建数据清洗器
         
@@ -548,14 +1733,52 @@ class CPDataCleanerFactory:
             cleaner_type: 清洗器类型
             target_params: 目标参数列表
             output_dir: 输出目录
+            cache_dir: 清洗结果缓存目录，为None时不使用缓存
+            cache_max_mb: 缓存目录容量上限（MB），为None时不限制
             
         Returns:
             BaseDataCleaner: 数据清洗器对象
         """
         if cleaner_type.lower() == 'cp_log':
-            return CPLogCleaner(target_params, output_dir)
+            return CPLogCleaner(target_params, output_dir, cache_dir, cache_max_mb)
         else:
             raise ValueError(f"不支持的清洗器类型: {cleaner_type}")
+    
+    @staticmethod
+    def create_strategy(strategy_names: Union[str, List[str]], std_threshold: float = 3.0) -> 'DataCleanerStrategy':
+        """
+        创建清洗策略
+        
+        Args:
+            strategy_names: 策略名称（standard, smart, remove_outliers, dpat, nnr），
+                            传入多个名称时按顺序组合为StrategyPipeline
+            std_threshold: 移除异常值策略的标准差阈值
+            
+        Returns:
+            DataCleanerStrategy: 清洗策略对象
+        """
+        if isinstance(strategy_names, str):
+            strategy_names = [strategy_names]
+        
+        strategies = []
+        for name in strategy_names:
+            name = name.lower()
+            if name == 'standard':
+                strategies.append(StandardCPDataCleanerStrategy())
+            elif name == 'smart':
+                strategies.append(SmartParameterCleanerStrategy())
+            elif name == 'remove_outliers':
+                strategies.append(RemoveOutliersStrategy(std_threshold=std_threshold))
+            elif name == 'dpat':
+                strategies.append(DynamicPATStrategy())
+            elif name == 'nnr':
+                strategies.append(NearestNeighbourResidualStrategy())
+            else:
+                raise ValueError(f"不支持的清洗策略: {name}")
+        
+        if len(strategies) == 1:
+            return strategies[0]
+        return StrategyPipeline(strategies)
 
 
 # 自定义清洗策略示例：去除异常值的策略
@@ -574,39 +1797,77 @@ class RemoveOutliersStrategy(DataCleanerStrategy):
             std_threshold: 标准差阈值，用于确定异常值
         """
         self.std_threshold = std_threshold
+        self.global_moments = None
+    
+    @staticmethod
+    def _numeric_columns(df: pd.DataFrame) -> List[str]:
+        return [col for col in df.select_dtypes(include=['number']).columns
+                if col not in META_COLUMNS and not is_flag_column(col)]
+    
+    def collect_stats(self, df_chunk: pd.DataFrame, limits: Dict[str, Dict[str, float]]) -> Dict[str, Tuple[int, float, float]]:
+        """
+        计算数据块中每列的 (数量, 均值, 离差平方和)
+        """
+        stats = {}
+        for col in self._numeric_columns(df_chunk):
+            values = df_chunk[col].to_numpy(dtype=float)
+            values = values[~np.isnan(values)]
+            mean = values.mean() if len(values) else 0.0
+            stats[col] = (len(values), mean, float(((values - mean) ** 2).sum()))
+        return stats
+    
+    def merge_stats(self, left: Dict[str, Tuple[int, float, float]],
+                    right: Dict[str, Tuple[int, float, float]]) -> Dict[str, Tuple[int, float, float]]:
+        """
+        按并行算法（Chan等）合并两组 (数量, 均值, 离差平方和)
+        """
+        merged = dict(left)
+        for col, (n_b, mean_b, m2_b) in right.items():
+            if col not in merged:
+                merged[col] = (n_b, mean_b, m2_b)
+                continue
+            n_a, mean_a, m2_a = merged[col]
+            n = n_a + n_b
+            if n == 0:
+                continue
+            delta = mean_b - mean_a
+            merged[col] = (n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n)
+        return merged
     
-    def clean(self, data: pd.DataFrame, limits: Dict[str, Dict[str, float]] = None) -> pd.DataFrame:
+    def set_global_stats(self, stats: Dict[str, Tuple[int, float, float]]) -> None:
+        self.global_moments = stats
+    
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
         """
         执行异常值清洗
         
+        设置了全局统计量（分块清洗）时使用全局的均值和标准差，否则使用当前数据表的
+        
         Args:
-            data: 待清洗的数据
+            df_clean: 工作数据表（会被修改）
             limits: 参数限制字典
-            
-        Returns:
-            pd.DataFrame: 清洗后的数据
+            workers: 并发计算各参数标记的线程数
         """
-        # 复制数据，避免修改原始数据
-        df_clean = data.copy()
-        
         # 获取数值型列
-        numeric_cols = df_clean.select_dtypes(include=['number']).columns
+        numeric_cols = self._numeric_columns(df_clean)
         
-        for col in numeric_cols:
-            if col in ['Lot', 'Wafer', 'No.U'] or col.endswith(('_outlier_high', '_outlier_low', '_spec_high', '_spec_low')):
-                continue
+        def evaluate(col: str) -> np.ndarray:
+            if self.global_moments is not None and col in self.global_moments:
+                n, mean, m2 = self.global_moments[col]
+                std = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+            else:
+                mean, std = df_clean[col].mean(), df_clean[col].std()
             
             # 利用z分数检测异常值
-            z_scores = np.abs((df_clean[col] - df_clean[col].mean()) / df_clean[col].std())
+            z_scores = np.abs((df_clean[col] - mean) / std)
             outliers = z_scores > self.std_threshold
             
-            # 标记异常值
-            df_clean.loc[outliers, f"{col}_z_outlier"] = True
-            
             # 如果需要从数据中移除异常值，可以取消下面的注释
             # df_clean = df_clean[~outliers]
+            return flag_bits(outliers, CleanFlag.Z_OUTLIER)
         
-        return df_clean
+        # 标记异常值
+        apply_param_flags(df_clean, numeric_cols, evaluate, workers)
 
 
 # 智能参数清洗策略：根据参数特性自动选择清洗方法
@@ -614,23 +1875,18 @@ class SmartParameterCleanerStrategy(DataCleanerStrategy):
     """
     智能参数清洗策略
     
-    根据参数特性自动选择最合适的清洗方法
+    根据参数特性自动选择最合适的清洗方法，阈值按晶圆分别计算
     """
     
-    def clean(self, data: pd.DataFrame, limits: Dict[str, Dict[str, float]] = None) -> pd.DataFrame:
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
         """
         执行智能参数清洗
         
         Args:
-            data: 待清洗的数据
+            df_clean: 工作数据表（会被修改）
             limits: 参数限制字典
-            
-        Returns:
-            pd.DataFrame: 清洗后的数据
+            workers: 并发计算各参数标记的线程数
         """
-        # 复制数据，避免修改原始数据
-        df_clean = data.copy()
-        
         # 参数特性字典
         param_features = {
             'BVDSS1': {'method': 'spec_limit', 'skew_sensitive': True},
@@ -645,53 +1901,265 @@ class SmartParameterCleanerStrategy(DataCleanerStrategy):
             'IDSS2': {'method': 'log_transform', 'skew_sensitive': True}
         }
         
-        for param in df_clean.columns:
-            if param in ['Lot', 'Wafer', 'No.U'] or not param in param_features:
-                continue
-                
-            # 将参数列转换为数值类型
+        params = [param for param in df_clean.columns if param in param_features and param not in META_COLUMNS]
+        
+        # 将参数列转换为数值类型
+        for param in params:
             df_clean[param] = pd.to_numeric(df_clean[param], errors='coerce')
+        
+        # 晶圆分组编码只计算一次，各参数的分组统计量在各自的计算任务中完成
+        codes, groups = wafer_codes(df_clean)
+        
+        def evaluate(param: str) -> Optional[np.ndarray]:
+            values = df_clean[param].to_numpy(dtype=float)
+            group_stats = robust_stats_by_codes(df_clean, [param], codes, groups).loc[param]
+            
+            def row_stat(column: str) -> np.ndarray:
+                return broadcast_group_stat(group_stats[column].to_numpy(), codes)
             
             # 获取参数特性
             features = param_features.get(param, {'method': 'statistical', 'skew_sensitive': False})
+            bits = None
             
             # 根据参数特性选择清洗方法
             if features['method'] == 'spec_limit' and limits and param in limits:
                 # 基于规格限制的清洗
                 upper_limit = limits[param].get('upper')
                 lower_limit = limits[param].get('lower')
+                iqr = row_stat('q3') - row_stat('q1')
+                bits = np.zeros(len(values), dtype=FLAG_DTYPE)
                 
                 if upper_limit is not None:
                     # 使用3倍IQR或1.5倍规格上限作为异常值阈值
-                    q3 = df_clean[param].quantile(0.75)
-                    iqr = df_clean[param].quantile(0.75) - df_clean[param].quantile(0.25)
-                    threshold = min(q3 + 3 * iqr, upper_limit * 1.5)
+                    threshold = np.fmin(row_stat('q3') + 3 * iqr, upper_limit * 1.5)
                     
-                    mask = df_clean[param] > threshold
-                    df_clean.loc[mask, f"{param}_smart_outlier_high"] = True
+                    mask = values > threshold
+                    bits |= flag_bits(mask, CleanFlag.SMART_OUTLIER_HIGH)
                 
                 if lower_limit is not None:
                     # 使用3倍IQR或0.5倍规格下限作为异常值阈值
-                    q1 = df_clean[param].quantile(0.25)
-                    iqr = df_clean[param].quantile(0.75) - df_clean[param].quantile(0.25)
-                    threshold = max(q1 - 3 * iqr, lower_limit * 0.5)
+                    threshold = np.fmax(row_stat('q1') - 3 * iqr, lower_limit * 0.5)
                     
-                    mask = df_clean[param] < threshold
-                    df_clean.loc[mask, f"{param}_smart_outlier_low"] = True
+                    mask = values < threshold
+                    bits |= flag_bits(mask, CleanFlag.SMART_OUTLIER_LOW)
             
             elif features['method'] == 'log_transform':
                 # 对于偏斜分布，尝试对数变换后检测异常值
-                log_values = np.log1p(df_clean[param].abs())
-                z_scores = np.abs((log_values - log_values.mean()) / log_values.std())
+                log_values = np.log1p(np.abs(values))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    z_scores = np.abs((log_values - row_stat('log_mean')) / row_stat('log_std'))
                 
                 mask = z_scores > 3.0
-                df_clean.loc[mask, f"{param}_smart_log_outlier"] = True
+                bits = flag_bits(mask, CleanFlag.SMART_LOG_OUTLIER)
             
             elif features['method'] == 'statistical':
                 # 统计方法检测异常值
-                z_scores = np.abs((df_clean[param] - df_clean[param].mean()) / df_clean[param].std())
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    z_scores = np.abs((values - row_stat('mean')) / row_stat('std'))
                 
                 mask = z_scores > 3.0
-                df_clean.loc[mask, f"{param}_smart_stat_outlier"] = True
+                bits = flag_bits(mask, CleanFlag.SMART_STAT_OUTLIER)
+            
+            return bits
+        
+        apply_param_flags(df_clean, params, evaluate, workers)
+
+
+# 动态PAT清洗策略：按晶圆计算稳健的零件平均测试限
+class DynamicPATStrategy(DataCleanerStrategy):
+    """
+    动态PAT（Dynamic Part Average Testing）清洗策略
+    
+    参照AEC-Q001，每片晶圆、每个参数的PAT限为 中位数 ± k·稳健sigma，
+    稳健sigma = (Q3 - Q1) / 1.35；有规格限时PAT限不超出规格限。
+    稳健sigma为0的晶圆不设PAT限，只按规格限标记（pat_limits 中 spec_fallback 为 True）。
+    每个参数只做一次分组排序即得到所有晶圆的限值，再按晶圆编码广播比较，
+    没有按晶圆的Python循环
+    """
+    
+    # IQR换算为正态分布标准差的系数
+    IQR_TO_SIGMA = 1.35
+    
+    def __init__(self, k: float = 6.0):
+        """
+        初始化动态PAT清洗策略
+        
+        Args:
+            k: 稳健sigma的倍数
+        """
+        self.k = k
+        self.pat_limits = None
+    
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
+        """
+        执行动态PAT清洗，计算出的限值保存在 pat_limits 中
+        
+        Args:
+            df_clean: 工作数据表（会被修改）
+            limits: 参数限制字典
+            workers: 并发计算各参数标记的线程数
+        """
+        params = [param for param in df_clean.columns
+                  if param not in META_COLUMNS and not is_flag_column(param)]
+        
+        # 将参数列转换为数值类型
+        for param in params:
+            df_clean[param] = pd.to_numeric(df_clean[param], errors='coerce')
+        
+        codes, groups = wafer_codes(df_clean)
+        
+        pat_limits = {}
+        
+        def evaluate(param: str) -> np.ndarray:
+            values = df_clean[param].to_numpy(dtype=float)
+            counts, (q1, median, q3) = group_quantiles_by_codes(values, codes, len(groups), [0.25, 0.5, 0.75])
+            robust_sigma = (q3 - q1) / self.IQR_TO_SIGMA
+            
+            # sigma为0（数据全部相同或处于量程下限）时不设PAT限，避免把所有非众数的芯片都标记出来
+            robust_sigma[robust_sigma <= 0] = np.nan
+            upper = median + self.k * robust_sigma
+            lower = median - self.k * robust_sigma
+            
+            # fmin/fmax 忽略NaN：没有PAT限的晶圆退回规格限，而不是连规格限也一并丢掉
+            param_limits = limits.get(param, {})
+            if param_limits.get('upper') is not None:
+                upper = np.fmin(upper, param_limits['upper'])
+            if param_limits.get('lower') is not None:
+                lower = np.fmax(lower, param_limits['lower'])
+            
+            pat_limits[param] = pd.DataFrame({
+                'count': counts,
+                'median': median,
+                'robust_sigma': robust_sigma,
+                'lower': lower,
+                'upper': upper,
+                # True 表示该晶圆sigma为0，上下限取自规格限（无规格限时为NaN，不做标记）
+                'spec_fallback': np.isnan(robust_sigma)
+            }, index=groups)
+            
+            with np.errstate(invalid='ignore'):
+                bits = flag_bits(values > broadcast_group_stat(upper, codes), CleanFlag.DPAT_HIGH)
+                bits |= flag_bits(values < broadcast_group_stat(lower, codes), CleanFlag.DPAT_LOW)
+            return bits
+        
+        apply_param_flags(df_clean, params, evaluate, workers)
+        
+        if pat_limits:
+            self.pat_limits = pd.concat({param: pat_limits[param] for param in params},
+                                        names=['param'] + list(groups.names))
+
+
+# 空间清洗策略：与相邻芯片中位数的残差（Nearest Neighbour Residual）
+class NearestNeighbourResidualStrategy(DataCleanerStrategy):
+    """
+    最近邻残差（NNR）清洗策略
+    
+    每颗芯片的估计值取同一晶圆上 (2·radius+1)² 窗口内相邻芯片的中位数，
+    残差 = 测量值 - 估计值；再按晶圆计算残差的中位数和稳健sigma (IQR/1.35)，
+    残差偏离超过 k·sigma 的芯片标记为 NNR_OUTLIER。
+    相邻芯片通过稠密坐标索引 build_grid_index 按偏移直接取得，计算量与芯片数成线性关系
+    """
+    
+    def __init__(self, radius: int = 1, k: float = 6.0, min_neighbors: int = 3):
+        """
+        初始化最近邻残差清洗策略
+        
+        Args:
+            radius: 邻域半径（格），1表示周围8颗芯片
+            k: 残差稳健sigma的倍数
+            min_neighbors: 计算估计值所需的最少有效相邻芯片数
+        """
+        self.radius = radius
+        self.k = k
+        self.min_neighbors = min_neighbors
+        self.residual_limits = None
+    
+    def neighbour_rows(self, df: pd.DataFrame, codes: np.ndarray, n_groups: int) -> np.ndarray:
+        """
+        计算每行的相邻芯片行号
+        
+        Args:
+            df: 含X/Y列的数据表
+            codes: 每行的晶圆编码
+            n_groups: 晶圆数
+            
+        Returns:
+            np.ndarray: 形状为 (行数, 邻域大小) 的行号数组，没有芯片的位置为-1
+        """
+        r = self.radius
+        x = pd.to_numeric(df['X'], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(df['Y'], errors='coerce').to_numpy(dtype=float)
+        grid, x0, y0 = build_grid_index(x, y, codes, n_groups, pad=r)
+        
+        valid = (codes >= 0) & ~np.isnan(x) & ~np.isnan(y)
+        rows = np.flatnonzero(valid)
+        gx = x[valid].astype(np.int64) - x0
+        gy = y[valid].astype(np.int64) - y0
+        wafer = codes[valid]
+        
+        offsets = [(dx, dy) for dx in range(-r, r + 1) for dy in range(-r, r + 1) if dx or dy]
+        neighbours = np.full((len(df), len(offsets)), -1, dtype=grid.dtype)
+        for j, (dx, dy) in enumerate(offsets):
+            neighbours[rows, j] = grid[wafer, gx + dx, gy + dy]
+        return neighbours
+    
+    def apply(self, df_clean: pd.DataFrame, limits: Dict[str, Dict[str, float]], workers: int = 1) -> None:
+        """
+        执行最近邻残差清洗，残差限值保存在 residual_limits 中
+        
+        Args:
+            df_clean: 工作数据表（会被修改）
+            limits: 参数限制字典
+            workers: 并发计算各参数标记的线程数
+        """
+        if 'X' not in df_clean.columns or 'Y' not in df_clean.columns:
+            print("警告: 数据中缺少X/Y坐标列，跳过最近邻残差清洗")
+            return
+        
+        params = [param for param in df_clean.columns
+                  if param not in META_COLUMNS and not is_flag_column(param)]
+        
+        # 将参数列转换为数值类型
+        for param in params:
+            df_clean[param] = pd.to_numeric(df_clean[param], errors='coerce')
+        
+        codes, groups = wafer_codes(df_clean)
+        
+        # 相邻芯片行号只计算一次，所有参数共用
+        neighbours = self.neighbour_rows(df_clean, codes, len(groups))
+        residual_limits = {}
+        
+        def evaluate(param: str) -> np.ndarray:
+            values = df_clean[param].to_numpy(dtype=float)
+            
+            # 末尾追加NaN，使行号-1取到缺失值
+            neighbour_values = np.append(values, np.nan)[neighbours]
+            neighbour_values.sort(axis=1)
+            n_valid = (~np.isnan(neighbour_values)).sum(axis=1)
+            
+            # 每行有效相邻值已排在前 n_valid 位，按位置取中位数
+            lower = np.take_along_axis(neighbour_values, np.maximum(n_valid - 1, 0)[:, None] // 2, axis=1)[:, 0]
+            upper = np.take_along_axis(neighbour_values, (n_valid // 2)[:, None], axis=1)[:, 0]
+            estimate = np.where(n_valid >= self.min_neighbors, (lower + upper) / 2, np.nan)
+            residuals = values - estimate
+            
+            counts, (q1, median, q3) = group_quantiles_by_codes(residuals, codes, len(groups), [0.25, 0.5, 0.75])
+            robust_sigma = (q3 - q1) / DynamicPATStrategy.IQR_TO_SIGMA
+            robust_sigma[robust_sigma <= 0] = np.nan
+            
+            residual_limits[param] = pd.DataFrame({
+                'count': counts,
+                'median': median,
+                'robust_sigma': robust_sigma
+            }, index=groups)
+            
+            with np.errstate(invalid='ignore'):
+                deviation = np.abs(residuals - broadcast_group_stat(median, codes))
+                mask = deviation > self.k * broadcast_group_stat(robust_sigma, codes)
+            return flag_bits(mask, CleanFlag.NNR_OUTLIER)
+        
+        apply_param_flags(df_clean, params, evaluate, workers)
         
-        return df_clean 
\ No newline at end of file
+        if residual_limits:
+            self.residual_limits = pd.concat({param: residual_limits[param] for param in params},
+                                             names=['param'] + list(groups.names))
\ No newline at end of file
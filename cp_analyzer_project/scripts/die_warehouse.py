@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+芯片级数据仓库模块
+
+将各批次清洗后的芯片数据追加到嵌入式SQL数据库中，按 (产品, 批次) 分区，
+之后可以直接用SQL跨批次查询，不需要重新解析原始日志。
+安装了 duckdb 时使用DuckDB（列式存储），否则使用Python自带的SQLite
+"""
+
+import os
+import sqlite3
+import pandas as pd
+from datetime import datetime
+from typing import List, Optional, Any
+
+from log_parser import base_lot_id
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# 芯片表和分区目录表
+DIE_TABLE = 'dies'
+PARTITION_TABLE = 'partitions'
+
+# 分区列（SQL列名不区分大小写，批次号列不能叫 lot，否则与原始数据的 Lot 列冲突）
+PARTITION_COLUMNS = ['product', 'lot_id']
+
+
+def _quote(name: str) -> str:
+    """SQL标识符加引号（列名中可能有 . 或 -，例如 No.U、BV2-BV1）"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class DieWarehouse:
+    """
+    按 (产品, 批次) 分区的芯片级数据仓库
+
+    同一 (产品, 批次) 重复写入时先删除旧分区再写入，重跑批次不会产生重复数据；
+    新批次中出现的新参数列会自动添加到表中。删除旧分区、写入芯片数据和更新分区目录在同一个事务中完成，
+    写入中途出错时回滚，不会留下缺失或重复的分区
+
+    用法:
+        with DieWarehouse("./output/warehouse.db") as warehouse:
+            warehouse.append(df_clean, product="NCEHSM650PBA", batch=batch_name)
+            df = warehouse.query("SELECT lot_id, Wafer, X, Y, IGSS2 FROM dies WHERE IGSS2 > 50")
+    """
+
+    def __init__(self, path: str, backend: str = 'auto'):
+        """
+        打开（必要时创建）数据仓库
+
+        Args:
+            path: 数据库文件路径
+            backend: 'duckdb'、'sqlite' 或 'auto'（安装了duckdb时使用DuckDB）
+        """
+        if backend == 'auto':
+            backend = 'duckdb' if duckdb is not None else 'sqlite'
+        if backend == 'duckdb' and duckdb is None:
+            raise ImportError("未安装duckdb，请使用 pip install duckdb 安装，或改用sqlite后端")
+        if backend not in ('duckdb', 'sqlite'):
+            raise ValueError(f"不支持的数据仓库后端: {backend}")
+
+        self.path = path
+        self.backend = backend
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        if backend == 'duckdb':
+            self.conn = duckdb.connect(path)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+
+        self._execute(f"CREATE TABLE IF NOT EXISTS {PARTITION_TABLE} ("
+                      f"product VARCHAR NOT NULL, lot_id VARCHAR NOT NULL, batch VARCHAR, "
+                      f"rows BIGINT, ingested_at VARCHAR, PRIMARY KEY (product, lot_id))")
+        self._execute(f"CREATE TABLE IF NOT EXISTS {DIE_TABLE} ("
+                      f"product VARCHAR NOT NULL, lot_id VARCHAR NOT NULL, batch VARCHAR)")
+        if backend == 'sqlite':
+            # DuckDB按列存储并自动维护min/max索引，SQLite需要显式的分区索引
+            self._execute(f"CREATE INDEX IF NOT EXISTS idx_dies_partition ON {DIE_TABLE} (product, lot_id)")
+        self._commit()
+
+    def __enter__(self) -> 'DieWarehouse':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def append(self, df: pd.DataFrame, product: str, batch: Optional[str] = None) -> int:
+        """
+        写入一个批次的芯片数据，数据中的每个批次号（去掉测试站点和时间后缀）各为一个分区
+
+        Args:
+            df: 清洗后的芯片数据
+            product: 产品名
+            batch: 批次目录名
+
+        Returns:
+            int: 写入的行数
+        """
+        if df is None or df.empty:
+            return 0
+
+        data = df.drop(columns=[col for col in PARTITION_COLUMNS + ['batch'] if col in df.columns])
+        raw_lots = data['Lot'].astype(str) if 'Lot' in data.columns else pd.Series(batch or 'LOT01', index=data.index)
+        lot_map = {lot: base_lot_id(lot) for lot in pd.unique(raw_lots)}
+        data.insert(0, 'batch', batch)
+        data.insert(0, 'lot_id', raw_lots.map(lot_map))
+        data.insert(0, 'product', product)
+
+        ingested_at = datetime.now().isoformat(timespec='seconds')
+
+        # DuckDB默认每条语句自动提交，SQLite模块对DDL也不会自动开启事务，这里显式开启事务
+        self._execute('BEGIN TRANSACTION')
+        try:
+            self._ensure_columns(data)
+
+            for lot in data['lot_id'].unique():
+                self._execute(f"DELETE FROM {DIE_TABLE} WHERE product = ? AND lot_id = ?", [product, lot])
+                self._execute(f"DELETE FROM {PARTITION_TABLE} WHERE product = ? AND lot_id = ?", [product, lot])
+
+            self._insert(data)
+
+            for lot, rows in data.groupby('lot_id', sort=False).size().items():
+                self._execute(f"INSERT INTO {PARTITION_TABLE} VALUES (?, ?, ?, ?, ?)",
+                              [product, lot, batch, int(rows), ingested_at])
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return len(data)
+
+    def query(self, sql: str, params: Optional[List[Any]] = None) -> pd.DataFrame:
+        """
+        执行SQL查询
+
+        Args:
+            sql: SQL语句，芯片表名为 dies，分区目录表名为 partitions
+            params: 查询参数
+
+        Returns:
+            pd.DataFrame: 查询结果
+        """
+        if self.backend == 'duckdb':
+            return self.conn.execute(sql, params or []).fetchdf()
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def partitions(self) -> pd.DataFrame:
+        """
+        列出已写入的分区
+
+        Returns:
+            pd.DataFrame: 每个 (产品, 批次) 一行
+        """
+        return self.query(f"SELECT * FROM {PARTITION_TABLE} ORDER BY product, lot_id")
+
+    def columns(self) -> List[str]:
+        """芯片表的所有列名"""
+        if self.backend == 'duckdb':
+            rows = self.conn.execute(f"DESCRIBE {DIE_TABLE}").fetchall()
+        else:
+            rows = [(row[1],) for row in self.conn.execute(f"PRAGMA table_info({DIE_TABLE})").fetchall()]
+        return [row[0] for row in rows]
+
+    def _ensure_columns(self, data: pd.DataFrame) -> None:
+        existing = {name.lower() for name in self.columns()}
+        for name in data.columns:
+            if name.lower() in existing:
+                continue
+            dtype = data[name].dtype
+            if pd.api.types.is_float_dtype(dtype):
+                sql_type = 'DOUBLE'
+            elif pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+                sql_type = 'BIGINT'
+            else:
+                sql_type = 'VARCHAR'
+            self._execute(f"ALTER TABLE {DIE_TABLE} ADD COLUMN {_quote(name)} {sql_type}")
+
+    def _insert(self, data: pd.DataFrame) -> None:
+        if self.backend == 'duckdb':
+            self.conn.register('_append_frame', data)
+            try:
+                self.conn.execute(f"INSERT INTO {DIE_TABLE} BY NAME SELECT * FROM _append_frame")
+            finally:
+                self.conn.unregister('_append_frame')
+        else:
+            # 不使用 DataFrame.to_sql：它在SQLite上会自行提交，破坏 append 的事务
+            columns = ', '.join(_quote(name) for name in data.columns)
+            sql = f"INSERT INTO {DIE_TABLE} ({columns}) VALUES ({', '.join(['?'] * len(data.columns))})"
+            for start in range(0, len(data), 10000):
+                chunk = data.iloc[start:start + 10000]
+                rows = chunk.astype(object).where(chunk.notna(), None)
+                self.conn.executemany(sql, rows.itertuples(index=False, name=None))
+
+    def _execute(self, sql: str, params: Optional[List[Any]] = None) -> None:
+        self.conn.execute(sql, params or [])
+
+    def _commit(self) -> None:
+        if self.backend == 'sqlite':
+            self.conn.commit()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+相关系数校验示例
+
+用含缺失值的随机数据核对 CPDataAnalyzer.correlation_matrices() 与
+pandas 的 DataFrame.corr(method='pearson' / 'spearman')（缺失值按参数对剔除）是否一致，
+不一致时以非零状态码退出
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# 添加项目路径，以便导入项目模块
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(project_root, 'scripts'))
+
+from data_analyzer import CPDataAnalyzer
+
+# 相关矩阵按float32计算，允许的最大绝对误差
+TOLERANCE = 1e-5
+
+
+def make_data(n_dies=20000, n_wafers=5, seed=0):
+    """
+    生成随机的芯片数据：参数之间相关，部分参数有不同比例的缺失值
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=n_dies)
+    params = ['P1', 'P2', 'P3', 'P4']
+    df = pd.DataFrame({
+        'Wafer': [f"{i % n_wafers + 1:02d}" for i in range(n_dies)],
+        'P1': base + rng.normal(size=n_dies) * 0.5,
+        'P2': np.exp(base + rng.normal(size=n_dies)),
+        'P3': base + rng.normal(size=n_dies) * 2.0,
+        'P4': -base + rng.normal(size=n_dies) * 0.3,
+    })
+    df[params] = df[params].astype(np.float32)
+    df.loc[rng.random(n_dies) < 0.4, 'P2'] = np.nan
+    df.loc[rng.random(n_dies) < 0.1, 'P3'] = np.nan
+    return df, params
+
+
+def main():
+    df, params = make_data()
+    analyzer = CPDataAnalyzer(None, params, {})
+    analyzer.df_clean = df
+    result = analyzer.correlation_matrices(params)
+
+    worst = 0.0
+    for method in ('pearson', 'spearman'):
+        expected = {'overall': df[params].corr(method=method)}
+        expected.update({wafer: group[params].corr(method=method) for wafer, group in df.groupby('Wafer')})
+        actual = {'overall': result[method]['overall']}
+        actual.update(result[method]['by_wafer'])
+
+        diff = max(np.nanmax(np.abs(actual[scope].to_numpy() - matrix.to_numpy()))
+                   for scope, matrix in expected.items())
+        print(f"{method}: 最大误差 {diff:.2e}")
+        worst = max(worst, diff)
+
+    if worst > TOLERANCE:
+        print(f"错误: 相关系数与pandas的结果不一致（最大误差 {worst:.2e}）")
+        sys.exit(1)
+    print("相关系数与pandas的结果一致")
+
+
+if __name__ == "__main__":
+    main()
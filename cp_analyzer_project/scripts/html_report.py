@@ -258,6 +258,7 @@ document.addEventListener('DOMContentLoaded', function() {
     <script src="static/js/script.js"></script>
 </head>
 <body>
+    {% macro fmt(value, spec) %}{{ spec|format(value) if value == value else "-" }}{% endmacro %}
     <div class="container">
         <h1>晶圆厂CP测试数据分析报告</h1>
         
@@ -275,6 +276,10 @@ document.addEventListener('DOMContentLoaded', function() {
         <div class="chart-container">
             {{ chart_html|safe }}
         </div>
+        {% if drilldown %}
+        <p class="drilldown">图中显示分层抽样的 {{ drilldown.shown }} / {{ drilldown.total }} 个芯片，
+            <a href="{{ drilldown.file }}">下载全部芯片数据 (CSV)</a></p>
+        {% endif %}
         
         <div class="stats-container">
             <h3>统计信息</h3>
@@ -287,26 +292,38 @@ document.addEventListener('DOMContentLoaded', function() {
                     <th>最小值</th>
                     <th>最大值</th>
                     <th>数据点数</th>
+                    <th>Cp</th>
+                    <th>Cpk</th>
+                    <th>失效数</th>
+                    <th>良率</th>
                 </tr>
-                {% for lot, stat in stats.by_lot.items() %}
+                {% for stat in wafer_stats %}
                 <tr>
-                    <td>{{ lot }}</td>
+                    <td>{{ stat.Wafer }}</td>
                     <td class="blue-text">{{ "%.4f"|format(stat.mean) }}</td>
-                    <td class="brown-text">{{ "%.4f"|format(stat.std) }}</td>
+                    <td class="brown-text">{{ "%.4f"|format(stat.std if stat.count > 1 else 0.0) }}</td>
                     <td>{{ "%.4f"|format(stat.median) }}</td>
                     <td>{{ "%.4f"|format(stat.min) }}</td>
                     <td>{{ "%.4f"|format(stat.max) }}</td>
                     <td>{{ stat.count }}</td>
+                    <td>{{ fmt(stat.cp, "%.2f") }}</td>
+                    <td>{{ fmt(stat.cpk, "%.2f") }}</td>
+                    <td>{{ stat.fail_count }}</td>
+                    <td>{{ "%.2f%%"|format(stat['yield'] * 100) }}</td>
                 </tr>
                 {% endfor %}
                 <tr>
                     <td><strong>总体</strong></td>
-                    <td class="blue-text"><strong>{{ "%.4f"|format(stats.overall.mean) }}</strong></td>
-                    <td class="brown-text"><strong>{{ "%.4f"|format(stats.overall.std) }}</strong></td>
-                    <td><strong>{{ "%.4f"|format(stats.overall.median) }}</strong></td>
-                    <td><strong>{{ "%.4f"|format(stats.overall.min) }}</strong></td>
-                    <td><strong>{{ "%.4f"|format(stats.overall.max) }}</strong></td>
-                    <td><strong>{{ stats.overall.count }}</strong></td>
+                    <td class="blue-text"><strong>{{ "%.4f"|format(overall_stats.mean) }}</strong></td>
+                    <td class="brown-text"><strong>{{ "%.4f"|format(overall_stats.std) }}</strong></td>
+                    <td><strong>{{ "%.4f"|format(overall_stats.median) }}</strong></td>
+                    <td><strong>{{ "%.4f"|format(overall_stats.min) }}</strong></td>
+                    <td><strong>{{ "%.4f"|format(overall_stats.max) }}</strong></td>
+                    <td><strong>{{ overall_stats.count }}</strong></td>
+                    <td><strong>{{ fmt(overall_stats.cp, "%.2f") }}</strong></td>
+                    <td><strong>{{ fmt(overall_stats.cpk, "%.2f") }}</strong></td>
+                    <td><strong>{{ overall_stats.fail_count }}</strong></td>
+                    <td><strong>{{ "%.2f%%"|format(overall_stats['yield'] * 100) }}</strong></td>
                 </tr>
             </table>
         </div>
@@ -372,12 +389,17 @@ document.addEventListener('DOMContentLoaded', function() {
             print(f"错误: 转换参数 {param} 的图表为HTML时出错: {str(e)}")
             return None
         
-        # 获取统计信息
+        # 获取统计信息和过程能力（所有参数的统计表只计算一次）
         try:
-            stats = self.analyzer.calculate_statistics(param)
-            if stats is None:
+            # 派生参数和单位换算后的参数使用图表的换算视图，统计表与图表一致
+            analyzer = self.chart_generator.data_view(param) or self.analyzer
+            table = analyzer.capability_table()
+            rows = table[table['param'] == param] if table is not None else None
+            if rows is None or rows.empty:
                 print(f"错误: 无法获取参数 {param} 的统计信息")
                 return None
+            wafer_stats = rows[rows['scope'] == 'wafer'].to_dict('records')
+            overall_stats = rows[rows['scope'] == 'overall'].iloc[0].to_dict()
         except Exception as e:
             print(f"错误: 计算参数 {param} 的统计信息时出错: {str(e)}")
             return None
@@ -407,7 +429,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 param=param,
                 params=params,
                 chart_html=chart_html,
-                stats=stats,
+                drilldown=self.chart_generator.drilldown_files.get(param),
+                wafer_stats=wafer_stats,
+                overall_stats=overall_stats,
                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             )
         except Exception as e:
@@ -429,6 +453,118 @@ document.addEventListener('DOMContentLoaded', function() {
         
         return report_path
     
+    def _write_chart_page(self, title, heading, charts, filename):
+        """
+        将一组图表写入一个简单的HTML报告页面
+        
+        Args:
+            title (str): 页面标题
+            heading (str): 图表区的二级标题
+            charts (list): pio.to_html(..., full_html=False) 生成的图表HTML片段
+            filename (str): 输出目录中的文件名
+            
+        Returns:
+            str: HTML报告文件路径
+        """
+        report_content = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }}</title>
+    <link rel="stylesheet" href="static/css/style.css">
+    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+</head>
+<body>
+    <div class="container">
+        <h1>晶圆厂CP测试数据分析报告</h1>
+        
+        <h2>{{ heading }}</h2>
+        
+        {% for chart_html in charts %}
+        <div class="chart-container">
+            {{ chart_html|safe }}
+        </div>
+        {% endfor %}
+        
+        <div class="footer">
+            <p>生成时间：{{ timestamp }}</p>
+            <p>晶圆厂CP测试数据分析工具</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+        
+        env = jinja2.Environment(loader=jinja2.BaseLoader())
+        template = env.from_string(report_content)
+        html_content = template.render(
+            title=title,
+            heading=heading,
+            charts=charts,
+            timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        )
+        
+        report_path = os.path.join(self.output_dir, filename)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        
+        return report_path
+    
+    def generate_correlation_report(self):
+        """
+        生成参数相关性报告（Pearson和Spearman相关系数热力图）
+        
+        Returns:
+            str: HTML报告文件路径
+        """
+        charts = []
+        for method in ('pearson', 'spearman'):
+            try:
+                fig = self.chart_generator.generate_correlation_heatmap(method)
+            except Exception as e:
+                print(f"错误: 生成 {method} 相关系数热力图时出错: {str(e)}")
+                fig = None
+            if fig is not None:
+                charts.append(pio.to_html(fig, include_plotlyjs=False, full_html=False))
+        
+        if not charts:
+            print("错误: 没有生成任何相关系数热力图")
+            return None
+        
+        report_path = self._write_chart_page("晶圆厂CP测试数据分析报告 - 参数相关性", "参数相关性",
+                                             charts, "correlation_report.html")
+        print(f"相关性报告已生成: {report_path}")
+        
+        return report_path
+    
+    def generate_wafer_map_report(self):
+        """
+        生成叠加晶圆图报告（各坐标位置的均值、中位数和失效率热力图）
+        
+        Returns:
+            str: HTML报告文件路径
+        """
+        charts = []
+        for stat in ('mean', 'median', 'fail_rate'):
+            try:
+                fig = self.chart_generator.generate_stacked_wafer_map(stat)
+            except Exception as e:
+                print(f"错误: 生成 {stat} 叠加晶圆图时出错: {str(e)}")
+                fig = None
+            if fig is not None:
+                charts.append(pio.to_html(fig, include_plotlyjs=False, full_html=False))
+        
+        if not charts:
+            print("错误: 没有生成任何叠加晶圆图")
+            return None
+        
+        report_path = self._write_chart_page("晶圆厂CP测试数据分析报告 - 叠加晶圆图", "叠加晶圆图",
+                                             charts, "wafer_map_report.html")
+        print(f"叠加晶圆图报告已生成: {report_path}")
+        
+        return report_path
+    
     def generate_index(self, report_files):
         """
         生成索引页面
@@ -578,6 +714,11 @@ document.addEventListener('DOMContentLoaded', function() {
             color: #777;
         }
         
+        .yield-mismatch {
+            color: #cc0000;
+            font-weight: bold;
+        }
+        
         .batch-link {
             display: block;
             text-align: center;
@@ -622,6 +763,37 @@ document.addEventListener('DOMContentLoaded', function() {
                         <div class="stat-label">参数数</div>
                     </div>
                 </div>
+                {% set info = batch_info.get(batch_dir, {}) %}
+                {% if info.get('parametric_yield') is not none %}
+                <div class="batch-stats">
+                    <div class="stat-item">
+                        <div class="stat-value">{{ "%.2f%%"|format(info.parametric_yield * 100) }}</div>
+                        <div class="stat-label">参数良率</div>
+                    </div>
+                    <div class="stat-item">
+                        <div class="stat-value">{{ "%.2f"|format(info.min_cpk) if info.get('min_cpk') is not none else '-' }}</div>
+                        <div class="stat-label">最低Cpk{% if info.get('min_cpk_param') %} ({{ info.min_cpk_param }}){% endif %}</div>
+                    </div>
+                </div>
+                {% endif %}
+                {% if info.get('yield_check') %}
+                {% set check = info.yield_check %}
+                <div class="batch-info">
+                    分箱良率核对: {{ check.checked }} 片晶圆，
+                    {% if check.mismatches %}
+                    <span class="yield-mismatch">{{ check.mismatches|length }} 片不一致或缺失</span>
+                    {% for m in check.mismatches %}
+                    <br>晶圆 {{ m.wafer }}:
+                    {% if m.status == 'missing_log' %}缺少日志（汇总表良品 {{ m.summary_good }}）
+                    {% elif m.status == 'missing_summary' %}汇总表中没有（计算良品 {{ m.good_die }}）
+                    {% else %}良品 {{ m.good_die }} / 汇总表 {{ m.summary_good }}，良率 {{ "%.2f"|format(m['yield']) }}% / {{ "%.2f"|format(m.summary_yield) }}%
+                    {% endif %}
+                    {% endfor %}
+                    {% else %}
+                    全部一致
+                    {% endif %}
+                </div>
+                {% endif %}
                 <a href="{{ batch_dir }}/index.html" class="batch-link">查看详情</a>
             </div>
             {% endfor %}
@@ -674,6 +846,16 @@ document.addEventListener('DOMContentLoaded', function() {
         if not report_files:
             print("错误: 没有生成任何报告")
             return None
+        
+        # 生成参数相关性报告
+        correlation_path = self.generate_correlation_report()
+        if correlation_path:
+            report_files.append(correlation_path)
+        
+        # 生成叠加晶圆图报告
+        wafer_map_path = self.generate_wafer_map_report()
+        if wafer_map_path:
+            report_files.append(wafer_map_path)
             
         # 生成索引页面
         index_path = self.generate_index(report_files)
@@ -3,6 +3,73 @@ import os
 import pandas as pd
 import glob
 import traceback
+from datetime import datetime
+
+# 日志中的批次号形如 "C141321.02-CPTSTE12-250213-185303@CP"，依次去掉站点后缀、日期时间和测试机编号
+_LOT_SITE_SUFFIX = re.compile(r'@.*$')
+_LOT_DATETIME_SUFFIX = re.compile(r'(-\d{6})+$')
+_LOT_TESTER_SUFFIX = re.compile(r'-[A-Za-z]+\d+$')
+# 批次号中的测试日期和时间 (YYMMDD-HHMMSS)
+_LOT_TEST_TIME = re.compile(r'-(\d{6})-(\d{6})(?:@|$)')
+
+
+def base_lot_id(lot_number):
+    """
+    从日志中的批次号提取生产批次号，例如 "C141321.02-CPTSTE12-250213-185303@CP" -> "C141321.02"
+    
+    Args:
+        lot_number (str): 日志中的批次号
+        
+    Returns:
+        str: 生产批次号，无法识别时返回原值
+    """
+    if lot_number is None:
+        return None
+    lot = _LOT_SITE_SUFFIX.sub('', str(lot_number).strip())
+    lot = _LOT_DATETIME_SUFFIX.sub('', lot)
+    lot = _LOT_TESTER_SUFFIX.sub('', lot)
+    return lot or str(lot_number)
+
+def lot_test_time(lot_number):
+    """
+    从日志中的批次号提取测试时间，例如 "C141321.02-CPTSTE12-250213-185303@CP" -> "2025-02-13T18:53:03"
+    
+    Args:
+        lot_number (str): 日志中的批次号
+        
+    Returns:
+        str: ISO格式的测试时间，批次号中没有测试时间时返回None
+    """
+    if lot_number is None:
+        return None
+    match = _LOT_TEST_TIME.search(str(lot_number).strip())
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1) + match.group(2), '%y%m%d%H%M%S').isoformat()
+    except ValueError:
+        return None
+
+def header_test_time(date_str, time_str):
+    """
+    将日志文件头的 Date/Time 行合成测试时间，例如 ("2025/02/13", "18:57:51") -> "2025-02-13T18:57:51"
+    
+    Args:
+        date_str (str): Date行的值
+        time_str (str): Time行的值，可以为None
+        
+    Returns:
+        str: ISO格式的测试时间，无法解析时返回None
+    """
+    if not date_str:
+        return None
+    text = f"{date_str.strip()} {(time_str or '00:00:00').strip()}"
+    for fmt in ('%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.strptime(text, fmt).isoformat()
+        except ValueError:
+            continue
+    return None
 
 # 调整类定义顺序，将函数放入类内部
 class CPLogParser:
@@ -16,6 +83,10 @@ class CPLogParser:
         self.data_dir = data_dir
         self.target_params = ["BVDSS1", "BVDSS2", "DELTABV", "IDSS1", "VTH", 
                             "RDSON1", "VFSDS", "IGSS2", "IGSSR2", "IDSS2"]
+        # 所有芯片（含没有有效参数值而未进入数据表的芯片）的分箱号，列为 Lot, Wafer, Bin
+        self.bin_data = None
+        # 每个文件头中的测试时间（ISO格式，文件头没有Date行时为None），列为 Lot, Wafer, TestTime
+        self.test_times = None
 
     def _parse_limit_value(self, limit_str, param_name=None):
         """
@@ -163,12 +234,14 @@ class CPLogParser:
             print(f"解析限制值错误: {limit_str} - {str(e)}")
             return None, None
 
-    def _parse_file(self, file_path):
+    def _parse_file(self, file_path, bin_rows=None, time_rows=None):
         """
         解析单个CP测试文件
         
         Args:
             file_path (str): 文件路径
+            bin_rows (list, optional): 传入时在读取数据行的同时追加每颗芯片的 (批次号, 晶圆号, 分箱号)
+            time_rows (list, optional): 传入时追加文件头中的 (批次号, 晶圆号, 测试时间)
             
         Returns:
             tuple: (数据字典列表, 参数限制字典)
@@ -193,10 +266,17 @@ class CPLogParser:
             # 提取文件头信息
             lot_number = None
             wafer_number = None
+            test_date = None
+            test_clock = None
             
-            # 寻找批次号和晶圆号
+            # 寻找批次号、晶圆号和测试日期时间
             for i, line in enumerate(lines[:20]):  # 扩大搜索范围到前20行
-                if 'Lot number' in line or 'LOT' in line.upper():
+                header = line.strip().split('\t')
+                if len(header) > 1 and header[0].strip() == 'Date':
+                    test_date = header[1]
+                elif len(header) > 1 and header[0].strip() == 'Time':
+                    test_clock = header[1]
+                elif 'Lot number' in line or 'LOT' in line.upper():
                     parts = line.strip().split('\t')
                     if len(parts) > 1:
                         lot_number = parts[1].strip()
@@ -323,6 +403,11 @@ class CPLogParser:
             is_c141321_batch = "C141321" in lot_number
             is_c127251_batch = "C127251" in lot_number
             
+            wafer_label = f"{wafer_number:02d}" if isinstance(wafer_number, int) else wafer_number
+            bin_idx = param_names.index('Bin') if 'Bin' in param_names else None
+            if time_rows is not None:
+                time_rows.append((lot_number, wafer_label, header_test_time(test_date, test_clock)))
+            
             for i in range(data_start_idx, len(lines)):
                 line = lines[i].strip()
                 if not line:
@@ -341,12 +426,30 @@ class CPLogParser:
                     
                 record = {
                     'Lot': lot_number,
-                    'Wafer': f"{wafer_number:02d}" if isinstance(wafer_number, int) else wafer_number,
+                    'Wafer': wafer_label,
                     'No.U': int(values[0]) if values[0].isdigit() else record_count + 1
                 }
                 
                 record_count += 1
                 
+                # 分箱号：保留在数据表中，并记录所有芯片的分箱号用于良率核对
+                if bin_idx is not None:
+                    try:
+                        record['Bin'] = int(values[bin_idx])
+                    except (ValueError, IndexError):
+                        pass
+                    if bin_rows is not None:
+                        bin_rows.append((lot_number, wafer_label, record.get('Bin')))
+                
+                # 保留芯片坐标，供空间类清洗策略使用
+                for coord in ('X', 'Y'):
+                    if coord in param_names:
+                        coord_idx = param_names.index(coord)
+                        try:
+                            record[coord] = int(values[coord_idx])
+                        except (ValueError, IndexError):
+                            pass
+                
                 # 添加目标参数的值
                 valid_params = 0
                 target_params = self.target_params + ["IDSS3"]  # 增加对IDSS3的支持
@@ -410,18 +513,112 @@ class CPLogParser:
             traceback.print_exc()
             return [], {}
             
-    def parse_all_files(self):
+    def extended_params(self):
         """
-        解析所有CP测试文件
+        目标参数列表加上IDSS3
         
         Returns:
-            tuple: (DataFrame, limits_dict)
+            list: 参数列表
         """
         # 确保IDSS3参数在需要时被处理
         if "IDSS3" not in self.target_params:
-            extended_params = self.target_params + ["IDSS3"]
-        else:
-            extended_params = self.target_params
+            return self.target_params + ["IDSS3"]
+        return self.target_params
+    
+    def merge_limits(self, all_limits, limits):
+        """
+        合并参数限制，优先使用非空的限制值
+        
+        Args:
+            all_limits (dict): 已合并的限制字典（会被修改）
+            limits (dict): 新的限制字典
+        """
+        for param, limit_values in limits.items():
+            if param not in all_limits:
+                all_limits[param] = limit_values
+            else:
+                if limit_values.get('upper') is not None and all_limits[param].get('upper') is None:
+                    all_limits[param]['upper'] = limit_values['upper']
+                if limit_values.get('lower') is not None and all_limits[param].get('lower') is None:
+                    all_limits[param]['lower'] = limit_values['lower']
+                if limit_values.get('unit') is not None and all_limits[param].get('unit') is None:
+                    all_limits[param]['unit'] = limit_values['unit']
+    
+    def fill_default_limits(self, all_limits):
+        """
+        为缺少限制值的目标参数设置默认限制值
+        
+        Args:
+            all_limits (dict): 已合并的限制字典（会被修改）
+        """
+        extended_params = self.extended_params()
+        
+        for param in extended_params:
+            if param not in all_limits:
+                # 根据参数名称设置默认限制值
+                if param == 'BVDSS1' or param == 'BVDSS2':
+                    all_limits[param] = {'upper': 900.0, 'lower': 660.0, 'unit': 'v'}
+                elif param == 'DELTABV':
+                    all_limits[param] = {'upper': 50.0, 'lower': -10.0, 'unit': 'v'}
+                elif param == 'IDSS1' or param == 'IDSS2':
+                    all_limits[param] = {'upper': 250.0e-9, 'lower': 0.0, 'unit': 'a'}
+                elif param == 'IDSS3':
+                    all_limits[param] = {'upper': 250.0e-6, 'lower': 0.0, 'unit': 'ua'}  # 以微安为单位
+                elif param == 'VTH':
+                    all_limits[param] = {'upper': 4.0, 'lower': 3.0, 'unit': 'v'}
+                elif param == 'RDSON1':
+                    all_limits[param] = {'upper': 365.0e-3, 'lower': 100.0e-3, 'unit': 'ohm'}
+                elif param == 'VFSDS':
+                    all_limits[param] = {'upper': 1.0, 'lower': 0.0, 'unit': 'v'}
+                elif param == 'IGSS2' or param == 'IGSSR2':
+                    all_limits[param] = {'upper': 300.0e-9, 'lower': 0.0, 'unit': 'a'}
+                else:
+                    # 默认限制值
+                    all_limits[param] = {'upper': None, 'lower': None, 'unit': None}
+            else:
+                # 如果存在限制值但有缺失，设置默认值
+                if all_limits[param].get('upper') is None:
+                    if param == 'BVDSS1' or param == 'BVDSS2':
+                        all_limits[param]['upper'] = 900.0
+                    elif param == 'DELTABV':
+                        all_limits[param]['upper'] = 50.0
+                    elif param == 'IDSS1' or param == 'IDSS2':
+                        all_limits[param]['upper'] = 250.0e-9
+                    elif param == 'IDSS3':
+                        all_limits[param]['upper'] = 250.0e-6  # 以微安为单位
+                    elif param == 'VTH':
+                        all_limits[param]['upper'] = 4.0
+                    elif param == 'RDSON1':
+                        all_limits[param]['upper'] = 365.0e-3
+                    elif param == 'VFSDS':
+                        all_limits[param]['upper'] = 1.0
+                    elif param == 'IGSS2' or param == 'IGSSR2':
+                        all_limits[param]['upper'] = 300.0e-9
+                        
+                if all_limits[param].get('lower') is None:
+                    if param == 'BVDSS1' or param == 'BVDSS2':
+                        all_limits[param]['lower'] = 660.0
+                    elif param == 'DELTABV':
+                        all_limits[param]['lower'] = -10.0
+                    elif param == 'IDSS1' or param == 'IDSS2' or param == 'IDSS3':
+                        all_limits[param]['lower'] = 0.0
+                    elif param == 'VTH':
+                        all_limits[param]['lower'] = 3.0
+                    elif param == 'RDSON1':
+                        all_limits[param]['lower'] = 100.0e-3
+                    elif param == 'VFSDS':
+                        all_limits[param]['lower'] = 0.0
+                    elif param == 'IGSS2' or param == 'IGSSR2':
+                        all_limits[param]['lower'] = 0.0
+    
+    def find_data_files(self):
+        """
+        查找数据目录中所有可能的CP测试文件
+        
+        Returns:
+            list: 文件路径列表，未找到时为空列表
+        """
+        extended_params = self.extended_params()
             
         # 获取所有可能的CP测试文件
         file_patterns = [
@@ -489,6 +686,19 @@ class CPLogParser:
                         print(f"  [文件] {item} ({os.path.getsize(item_path)} 字节)")
             except Exception as e:
                 print(f"查看目录内容时出错: {str(e)}")
+        
+        return file_paths
+    
+    def parse_all_files(self):
+        """
+        解析所有CP测试文件
+        
+        Returns:
+            tuple: (DataFrame, limits_dict)
+        """
+        extended_params = self.extended_params()
+        file_paths = self.find_data_files()
+        if not file_paths:
             return None, None
         
         print(f"找到 {len(file_paths)} 个可能的数据文件")
@@ -501,79 +711,12 @@ class CPLogParser:
             print(f"解析文件: {os.path.basename(file_path)}")
             try:
                 _, limits = self._parse_file(file_path)
-                
-                # 合并参数限制，优先使用非空的限制值
-                for param, limit_values in limits.items():
-                    if param not in all_limits:
-                        all_limits[param] = limit_values
-                    else:
-                        if limit_values.get('upper') is not None and all_limits[param].get('upper') is None:
-                            all_limits[param]['upper'] = limit_values['upper']
-                        if limit_values.get('lower') is not None and all_limits[param].get('lower') is None:
-                            all_limits[param]['lower'] = limit_values['lower']
-                        if limit_values.get('unit') is not None and all_limits[param].get('unit') is None:
-                            all_limits[param]['unit'] = limit_values['unit']
+                self.merge_limits(all_limits, limits)
             except Exception as e:
                 print(f"解析文件 {os.path.basename(file_path)} 的限制值信息时出错: {str(e)}")
         
         # 如果还是没有找到目标参数的限制值，则手动设置
-        for param in extended_params:
-            if param not in all_limits:
-                # 根据参数名称设置默认限制值
-                if param == 'BVDSS1' or param == 'BVDSS2':
-                    all_limits[param] = {'upper': 900.0, 'lower': 660.0, 'unit': 'v'}
-                elif param == 'DELTABV':
-                    all_limits[param] = {'upper': 50.0, 'lower': -10.0, 'unit': 'v'}
-                elif param == 'IDSS1' or param == 'IDSS2':
-                    all_limits[param] = {'upper': 250.0e-9, 'lower': 0.0, 'unit': 'a'}
-                elif param == 'IDSS3':
-                    all_limits[param] = {'upper': 250.0e-6, 'lower': 0.0, 'unit': 'ua'}  # 以微安为单位
-                elif param == 'VTH':
-                    all_limits[param] = {'upper': 4.0, 'lower': 3.0, 'unit': 'v'}
-                elif param == 'RDSON1':
-                    all_limits[param] = {'upper': 365.0e-3, 'lower': 100.0e-3, 'unit': 'ohm'}
-                elif param == 'VFSDS':
-                    all_limits[param] = {'upper': 1.0, 'lower': 0.0, 'unit': 'v'}
-                elif param == 'IGSS2' or param == 'IGSSR2':
-                    all_limits[param] = {'upper': 300.0e-9, 'lower': 0.0, 'unit': 'a'}
-                else:
-                    # 默认限制值
-                    all_limits[param] = {'upper': None, 'lower': None, 'unit': None}
-            else:
-                # 如果存在限制值但有缺失，设置默认值
-                if all_limits[param].get('upper') is None:
-                    if param == 'BVDSS1' or param == 'BVDSS2':
-                        all_limits[param]['upper'] = 900.0
-                    elif param == 'DELTABV':
-                        all_limits[param]['upper'] = 50.0
-                    elif param == 'IDSS1' or param == 'IDSS2':
-                        all_limits[param]['upper'] = 250.0e-9
-                    elif param == 'IDSS3':
-                        all_limits[param]['upper'] = 250.0e-6  # 以微安为单位
-                    elif param == 'VTH':
-                        all_limits[param]['upper'] = 4.0
-                    elif param == 'RDSON1':
-                        all_limits[param]['upper'] = 365.0e-3
-                    elif param == 'VFSDS':
-                        all_limits[param]['upper'] = 1.0
-                    elif param == 'IGSS2' or param == 'IGSSR2':
-                        all_limits[param]['upper'] = 300.0e-9
-                        
-                if all_limits[param].get('lower') is None:
-                    if param == 'BVDSS1' or param == 'BVDSS2':
-                        all_limits[param]['lower'] = 660.0
-                    elif param == 'DELTABV':
-                        all_limits[param]['lower'] = -10.0
-                    elif param == 'IDSS1' or param == 'IDSS2' or param == 'IDSS3':
-                        all_limits[param]['lower'] = 0.0
-                    elif param == 'VTH':
-                        all_limits[param]['lower'] = 3.0
-                    elif param == 'RDSON1':
-                        all_limits[param]['lower'] = 100.0e-3
-                    elif param == 'VFSDS':
-                        all_limits[param]['lower'] = 0.0
-                    elif param == 'IGSS2' or param == 'IGSSR2':
-                        all_limits[param]['lower'] = 0.0
+        self.fill_default_limits(all_limits)
         
         # 打印所有参数的限制值
         print("参数限制值信息:")
@@ -581,11 +724,13 @@ class CPLogParser:
             unit_info = f", 单位={limits.get('unit')}" if limits.get('unit') else ""
             print(f"  {param}: 上限={limits.get('upper')}, 下限={limits.get('lower')}{unit_info}")
             
-        # 然后解析数据记录
+        # 然后解析数据记录，同时收集所有芯片的分箱号
         success_count = 0
+        bin_rows = []
+        time_rows = []
         for file_path in file_paths:
             try:
-                records, _ = self._parse_file(file_path)
+                records, _ = self._parse_file(file_path, bin_rows, time_rows)
                 if records:
                     success_count += 1
                     all_records.extend(records)
@@ -597,6 +742,8 @@ class CPLogParser:
             return None, None
         
         print(f"成功从 {success_count}/{len(file_paths)} 个文件中提取了 {len(all_records)} 条记录")
+        self.bin_data = pd.DataFrame(bin_rows, columns=['Lot', 'Wafer', 'Bin'])
+        self.test_times = pd.DataFrame(time_rows, columns=['Lot', 'Wafer', 'TestTime'])
             
         # 转换为DataFrame
         df = pd.DataFrame(all_records)
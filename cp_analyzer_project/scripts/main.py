@@ -11,10 +11,14 @@ import os
 import sys
 import argparse
 from log_parser import CPLogParser
-from data_cleaner import CPDataCleanerFactory, SmartParameterCleanerStrategy, RemoveOutliersStrategy
-from data_analyzer import CPDataAnalyzer
+from data_cleaner import CPDataCleanerFactory, CLEAN_CACHE_MAX_MB
+from data_analyzer import CPDataAnalyzer, BOX_MAX_POINTS, SCATTER_MAX_POINTS
 from chart_generator import CPChartGenerator
 from html_report import CPHTMLReport
+from online_stats import QuantileSketchSet, SKETCH_FILE
+from trend_store import TrendStore, product_from_batch
+from die_warehouse import DieWarehouse
+from yield_check import load_summary, bin_yield, reconcile_yield, summarize_reconciliation, STATUS_MISSING_SUMMARY
 import pandas as pd
 from datetime import datetime
 
@@ -44,13 +48,65 @@ def parse_args():
     parser.add_argument('--export-json', action='store_true', default=True,
                         help='是否导出JSON格式数据 (默认: True)')
                         
-    parser.add_argument('--cleaner-strategy', type=str, default='standard',
-                        choices=['standard', 'smart', 'remove_outliers'],
-                        help='数据清洗策略 (默认: standard)')
+    parser.add_argument('--cleaner-strategy', type=str, nargs='+', default=['standard'],
+                        choices=['standard', 'smart', 'remove_outliers', 'dpat', 'nnr'],
+                        help='数据清洗策略，指定多个时按顺序组合执行 (默认: standard)')
+    
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并发计算各参数清洗标记的线程数 (默认: 1)')
+    
+    parser.add_argument('--chunked', action='store_true', default=False,
+                        help='分块清洗所有批次并写入列式存储，不生成报告 (默认: False)')
+    
+    parser.add_argument('--wafers-per-chunk', type=int, default=5,
+                        help='分块清洗时每块包含的晶圆数 (默认: 5)')
+    
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='清洗结果缓存目录 (默认: <输出目录>/.clean_cache)')
+    
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='不使用清洗结果缓存 (默认: False)')
+    
+    parser.add_argument('--cache-max-mb', type=float, default=CLEAN_CACHE_MAX_MB,
+                        help=f'清洗结果缓存目录的容量上限(MB)，超出时删除最久未使用的条目 (默认: {CLEAN_CACHE_MAX_MB})')
+    
+    parser.add_argument('--trend-db', type=str, default=None,
+                        help='每晶圆统计量趋势库(SQLite)路径 (默认: <输出目录>/trend.db)')
+    
+    parser.add_argument('--no-trend', action='store_true', default=False,
+                        help='不写入统计量趋势库 (默认: False)')
+    
+    parser.add_argument('--product', type=str, default=None,
+                        help='写入趋势库和数据仓库的产品名 (默认: 从批次目录名中提取)')
+    
+    parser.add_argument('--compact', action='store_true', default=False,
+                        help='内存优化模式：参数列使用float32，Lot/Wafer使用分类类型 (默认: False)')
+    
+    parser.add_argument('--float64-params', type=str, nargs='+', default=[],
+                        help='内存优化模式下仍保留float64精度的参数')
+    
+    parser.add_argument('--box-mode', type=str, default='points', choices=['points', 'summary', 'webgl'],
+                        help='箱型图模式：points 嵌入全部数据点（芯片数超过10万时自动改用webgl），'
+                             'summary 服务端计算统计量并只嵌入异常点，webgl 服务端计算统计量并用WebGL显示抽样的芯片数据点 (默认: points)')
+    
+    parser.add_argument('--max-box-points', type=int, default=BOX_MAX_POINTS,
+                        help=f'summary模式下每个参数最多嵌入的异常点数，超过时按晶圆片分层抽样 (默认: {BOX_MAX_POINTS})')
+    
+    parser.add_argument('--max-scatter-points', type=int, default=SCATTER_MAX_POINTS,
+                        help=f'webgl模式下每个参数最多嵌入的芯片数据点数，超过时按晶圆片分层抽样 (默认: {SCATTER_MAX_POINTS})')
+    
+    parser.add_argument('--summary-dir', type=str, default=None,
+                        help='测试厂汇总表(CSV)目录，用于核对分箱良率 (默认: <数据目录>/summary 或其上级目录下的summary)')
+    
+    parser.add_argument('--warehouse', type=str, default=None,
+                        help='芯片级数据仓库路径，指定后将清洗后的数据按(产品, 批次)分区写入 (默认: 不写入)')
+    
+    parser.add_argument('--warehouse-backend', type=str, default='auto', choices=['auto', 'duckdb', 'sqlite'],
+                        help='数据仓库后端 (默认: auto，安装了duckdb时使用DuckDB，否则使用SQLite)')
     
     return parser.parse_args()
 
-def process_batch(batch_dir, output_dir, args):
+def process_batch(batch_dir, output_dir, args, batch_summary=None, yield_summary=None):
     """
     处理单个批次的数据
     
@@ -58,6 +114,8 @@ def process_batch(batch_dir, output_dir, args):
         batch_dir (str): 批次数据目录
         output_dir (str): 输出目录
         args (Namespace): 命令行参数
+        batch_summary (dict, optional): 批次信息字典，处理成功时写入参数良率、最低Cpk和分箱良率核对结果
+        yield_summary (DataFrame, optional): 测试厂汇总表（load_summary 的结果）
         
     Returns:
         bool: 处理是否成功
@@ -79,28 +137,28 @@ def process_batch(batch_dir, output_dir, args):
     
     # 步骤1: 创建数据清洗器并加载数据
     print("\n步骤1: 加载CP测试数据...")
-    cleaner = CPDataCleanerFactory.create_cleaner('cp_log', args.params, batch_output_dir)
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(output_dir, '.clean_cache'))
+    cleaner = CPDataCleanerFactory.create_cleaner('cp_log', args.params, batch_output_dir, cache_dir,
+                                                  args.cache_max_mb)
     
     if not cleaner.load_data(batch_dir):
         print(f"错误: 未能成功加载批次 {batch_name} 的CP测试数据")
         return False
+    
+    # 用解析时收集的分箱号核对各晶圆良率
+    if yield_summary is not None and cleaner.bin_data is not None:
+        try:
+            check_yield(cleaner.bin_data, yield_summary, batch_output_dir, batch_summary)
+        except Exception as e:
+            print(f"警告: 核对批次 {batch_name} 的分箱良率时出错: {str(e)}")
         
     # 步骤2: 选择清洗策略并执行数据清洗
     print("\n步骤2: 数据清洗...")
     
-    if args.cleaner_strategy == 'smart':
-        print("使用智能参数清洗策略")
-        strategy = SmartParameterCleanerStrategy()
-        df_clean = cleaner.apply_cleaner_strategy(strategy)
-        cleaner.clean_data = df_clean
-    elif args.cleaner_strategy == 'remove_outliers':
-        print("使用移除异常值清洗策略")
-        strategy = RemoveOutliersStrategy(std_threshold=3.0)
-        df_clean = cleaner.apply_cleaner_strategy(strategy)
-        cleaner.clean_data = df_clean
-    else:
-        print("使用标准清洗策略")
-        df_clean = cleaner.clean()
+    # 单个策略和组合策略都经过同一个 clean（含单位转换），结果单位一致，缓存键也一致
+    print(f"使用清洗策略: {' -> '.join(args.cleaner_strategy)}")
+    strategy = CPDataCleanerFactory.create_strategy(args.cleaner_strategy, std_threshold=3.0)
+    df_clean = cleaner.clean(strategy, workers=args.workers)
     
     if df_clean is None:
         print(f"错误: 批次 {batch_name} 数据清洗失败")
@@ -108,6 +166,27 @@ def process_batch(batch_dir, output_dir, args):
         
     print(f"清洗后的数据记录数: {len(df_clean)}")
     
+    # 批次索引页面显示的记录数、批次号和晶圆数直接取自清洗结果，不需要重新读取导出的JSON
+    if batch_summary is not None:
+        batch_summary['record_count'] = len(df_clean)
+        if 'Lot' in df_clean.columns and len(df_clean):
+            batch_summary['lot_number'] = str(df_clean['Lot'].iloc[0])
+        if 'Wafer' in df_clean.columns:
+            batch_summary['wafer_count'] = int(df_clean['Wafer'].nunique())
+    
+    # 内存优化模式：参数列转为float32，Lot/Wafer转为分类类型，编号和坐标转为窄整数
+    if args.compact:
+        dtype_overrides = {param: 'float64' for param in args.float64_params}
+        df_clean = cleaner.compact_memory(dtype_overrides)
+    
+    # 保存各(晶圆, 参数)的分位数草图，跨批次的分位数可由各批次的草图合并得到
+    try:
+        sketch_path = QuantileSketchSet(cleaner.target_params).update(df_clean).save(
+            os.path.join(batch_output_dir, SKETCH_FILE))
+        print(f"分位数草图已保存到: {sketch_path}")
+    except Exception as e:
+        print(f"警告: 保存分位数草图时出错: {str(e)}")
+    
     # 步骤3: 导出JSON数据（如果需要）
     if args.export_json:
         print("\n步骤3: 导出JSON数据...")
@@ -123,10 +202,40 @@ def process_batch(batch_dir, output_dir, args):
     analyzer = CPDataAnalyzer(None, args.params, cleaner.get_limits())
     analyzer.df_clean = df_clean
     
+    if batch_summary is not None:
+        try:
+            batch_summary.update(summarize_capability(analyzer))
+        except Exception as e:
+            print(f"警告: 计算批次 {batch_name} 的过程能力时出错: {str(e)}")
+    
+    # 将各晶圆的统计量写入趋势库
+    if not args.no_trend:
+        trend_db = args.trend_db or os.path.join(output_dir, 'trend.db')
+        try:
+            with TrendStore(trend_db) as store:
+                rows = store.write_statistics(analyzer, product=args.product or product_from_batch(batch_name),
+                                              batch=batch_name, test_times=cleaner.test_times)
+            print(f"已写入 {rows} 条统计记录到趋势库: {trend_db}")
+        except Exception as e:
+            print(f"警告: 写入统计量趋势库时出错: {str(e)}")
+    
+    # 将芯片级数据写入数据仓库
+    if args.warehouse:
+        try:
+            with DieWarehouse(args.warehouse, backend=args.warehouse_backend) as warehouse:
+                rows = warehouse.append(df_clean, product=args.product or product_from_batch(batch_name),
+                                        batch=batch_name)
+            print(f"已写入 {rows} 条芯片记录到数据仓库: {args.warehouse}")
+        except Exception as e:
+            print(f"警告: 写入数据仓库时出错: {str(e)}")
+    
     # 步骤5: 生成图表
     print("\n步骤5: 生成图表...")
     chart_generator = CPChartGenerator(analyzer)
     chart_generator.output_dir = batch_output_dir
+    chart_generator.box_mode = args.box_mode
+    chart_generator.max_box_points = args.max_box_points
+    chart_generator.max_scatter_points = args.max_scatter_points
     
     # 步骤6: 生成HTML报告
     print("\n步骤6: 生成HTML报告...")
@@ -145,6 +254,58 @@ def process_batch(batch_dir, output_dir, args):
     
     return True
 
+def check_yield(bin_data, yield_summary, batch_output_dir, batch_summary=None):
+    """
+    按分箱号计算各晶圆良率并与汇总表核对，结果保存为 yield_check.csv
+    
+    Args:
+        bin_data (DataFrame): 解析时收集的每颗芯片分箱号
+        yield_summary (DataFrame): 测试厂汇总表
+        batch_output_dir (str): 批次输出目录
+        batch_summary (dict, optional): 批次信息字典，写入核对结果摘要
+        
+    Returns:
+        DataFrame: 核对结果，汇总表中没有该批次时返回None
+    """
+    result = reconcile_yield(bin_yield(bin_data), yield_summary)
+    if result.empty or (result['status'] == STATUS_MISSING_SUMMARY).all():
+        print("汇总表中没有该批次的记录，跳过分箱良率核对")
+        return None
+    
+    result.to_csv(os.path.join(batch_output_dir, 'yield_check.csv'), index=False, encoding='utf-8-sig')
+    summary = summarize_reconciliation(result)
+    print(f"分箱良率核对: {summary['checked']} 片晶圆，{len(summary['mismatches'])} 片不一致或缺失")
+    
+    if batch_summary is not None:
+        batch_summary['yield_check'] = summary
+    return result
+
+def summarize_capability(analyzer):
+    """
+    汇总批次的参数良率和最低Cpk，用于批次索引页面
+    
+    Args:
+        analyzer (CPDataAnalyzer): 已设置df_clean的数据分析器
+        
+    Returns:
+        dict: {'parametric_yield': 良率, 'min_cpk': 最低Cpk, 'min_cpk_param': 对应参数}
+    """
+    summary = {}
+    
+    yield_table = analyzer.parametric_yield()
+    if yield_table is not None and not yield_table.empty:
+        summary['parametric_yield'] = float(yield_table['yield'].iloc[0])
+    
+    capability = analyzer.capability_table()
+    if capability is not None:
+        overall = capability[(capability['scope'] == 'overall') & capability['cpk'].notna()]
+        if not overall.empty:
+            worst = overall.loc[overall['cpk'].idxmin()]
+            summary['min_cpk'] = float(worst['cpk'])
+            summary['min_cpk_param'] = worst['param']
+    
+    return summary
+
 def main():
     """
     主函数
@@ -165,12 +326,24 @@ def main():
     print(f"数据目录: {data_dir}")
     print(f"输出目录: {output_dir}")
     print(f"目标参数: {args.params}")
-    print(f"清洗策略: {args.cleaner_strategy}")
-    
-    # 获取所有批次目录
+    print(f"清洗策略: {', '.join(args.cleaner_strategy)}")
+    
+    # 读取测试厂汇总表，用于核对各批次的分箱良率
+    summary_dir = args.summary_dir
+    if summary_dir is None:
+        for candidate in (os.path.join(data_dir, 'summary'), os.path.join(os.path.dirname(data_dir), 'summary')):
+            if os.path.isdir(candidate):
+                summary_dir = candidate
+                break
+    yield_summary = load_summary(summary_dir)
+    if yield_summary is not None:
+        print(f"已读取汇总表: {summary_dir}，共 {len(yield_summary)} 片晶圆")
+    
+    # 获取所有批次目录（汇总表目录除外）
     try:
         batch_dirs = [d for d in os.listdir(data_dir) 
-                    if os.path.isdir(os.path.join(data_dir, d))]
+                    if os.path.isdir(os.path.join(data_dir, d))
+                    and not (summary_dir and os.path.samefile(os.path.join(data_dir, d), summary_dir))]
     except Exception as e:
         print(f"错误: 读取数据目录 {data_dir} 时出错: {str(e)}")
         print("尝试使用备用方法...")
@@ -194,6 +367,15 @@ def main():
     for batch_dir in batch_dirs:
         print(f"- {batch_dir}")
     
+    # 分块清洗模式：所有批次一起清洗，结果写入列式存储
+    if args.chunked:
+        cleaner = CPDataCleanerFactory.create_cleaner('cp_log', args.params, output_dir)
+        strategy = CPDataCleanerFactory.create_strategy(args.cleaner_strategy, std_threshold=3.0)
+        store_path = os.path.join(output_dir, 'clean_store')
+        store = cleaner.clean_chunked([os.path.join(data_dir, d) for d in batch_dirs], store_path,
+                                      strategy, wafers_per_chunk=args.wafers_per_chunk, workers=args.workers)
+        return 0 if store is not None else 1
+    
     # 处理每个批次
     success_count = 0
     batch_info = {}  # 收集批次信息
@@ -207,48 +389,21 @@ def main():
         # 收集批次基本信息
         batch_info[batch_dir] = {
             'process_time': process_time,
-            'lot_number': '未知',  # 将在处理过程中更新
+            'lot_number': '未知',  # 由 process_batch 根据清洗结果更新
             'wafer_count': 0,
             'record_count': 0,
             'param_count': len(args.params)
         }
         
-        if process_batch(batch_path, output_dir, args):
+        if process_batch(batch_path, output_dir, args, batch_info[batch_dir], yield_summary):
             success_count += 1
-            
-            # 更新批次信息
-            try:
-                # 尝试从JSON文件中读取批次信息
-                json_dir = os.path.join(output_dir, batch_dir, 'json')
-                if os.path.exists(json_dir):
-                    json_files = [f for f in os.listdir(json_dir) if f.endswith('.json')]
-                    if json_files:
-                        # 读取第一个JSON文件获取批次号和晶圆数量
-                        import json
-                        with open(os.path.join(json_dir, json_files[0]), 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            if data and isinstance(data, list) and len(data) > 0:
-                                # 获取记录数
-                                batch_info[batch_dir]['record_count'] = len(data)
-                                
-                                # 获取批次号
-                                if 'Lot' in data[0]:
-                                    batch_info[batch_dir]['lot_number'] = data[0]['Lot']
-                                
-                                # 获取晶圆数量 (独特的晶圆编号数量)
-                                if 'Wafer' in data[0]:
-                                    wafers = set(record['Wafer'] for record in data if 'Wafer' in record)
-                                    batch_info[batch_dir]['wafer_count'] = len(wafers)
-            except Exception as e:
-                print(f"警告: 收集批次 {batch_dir} 信息时出错: {str(e)}")
     
     # 生成批次索引页面
     try:
         # 创建一个空的图表生成器用于生成索引页面
         empty_analyzer = CPDataAnalyzer(None, args.params, {})
         # 设置必要的属性，避免NoneType错误
-        empty_analyzer.df_clean = pd.DataFrame()
-        empty_analyzer.df_clean['dummy'] = []  # 添加一个空列
+        empty_analyzer.df_clean = pd.DataFrame({'dummy': []})  # 只有一个空列
         empty_analyzer.target_params = args.params
         
         empty_chart_generator = CPChartGenerator(empty_analyzer)
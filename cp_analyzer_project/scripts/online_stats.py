@@ -0,0 +1,645 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+在线统计模块
+
+按 (批次, 晶圆, 参数) 维护可增量更新、可合并的统计累加器（数量、均值、方差、最值）
+和分位数草图（KLL），芯片数据分批到达时只需处理新到的一批，不需要在整张表上重新计算；
+各批次保存的草图合并后即可得到跨批次的中位数和分位数，不需要重新读取原始数据
+"""
+
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple, Any, Iterable
+
+from data_cleaner import wafer_codes, group_moments, group_extrema
+
+
+class RunningStats:
+    """
+    单个序列的在线统计量：数量、均值、二阶中心矩之和(M2)、最小值、最大值
+
+    单个值按Welford算法更新，一批值先算出批内统计量，再按Chan等人的并行公式合并，
+    数值稳定且与顺序无关（在浮点误差范围内）
+    """
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def from_moments(cls, count: int, mean: float, m2: float, min_value: float, max_value: float) -> 'RunningStats':
+        """
+        由已计算好的统计量创建累加器
+
+        Args:
+            count: 数量
+            mean: 均值
+            m2: 与均值之差的平方和
+            min_value: 最小值
+            max_value: 最大值
+
+        Returns:
+            RunningStats: 累加器
+        """
+        stats = cls()
+        if count > 0:
+            stats.count = int(count)
+            stats.mean = float(mean)
+            stats.m2 = float(m2)
+            stats.min = float(min_value)
+            stats.max = float(max_value)
+        return stats
+
+    def push(self, value: float) -> None:
+        """
+        加入单个值（Welford算法），NaN会被忽略
+
+        Args:
+            value: 数值
+        """
+        if np.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def update(self, batch: Iterable[float]) -> 'RunningStats':
+        """
+        加入一批值，NaN会被忽略
+
+        Args:
+            batch: 数值序列
+
+        Returns:
+            RunningStats: 自身，便于链式调用
+        """
+        values = np.asarray(batch, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        mean = values.mean()
+        batch_stats = RunningStats.from_moments(len(values), mean, float(((values - mean) ** 2).sum()),
+                                                values.min(), values.max())
+        return self.merge(batch_stats)
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        """
+        合并另一个累加器（原地修改自身）
+
+        Args:
+            other: 另一个累加器
+
+        Returns:
+            RunningStats: 自身
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self) -> 'RunningStats':
+        """复制累加器"""
+        return RunningStats.from_moments(self.count, self.mean, self.m2, self.min, self.max)
+
+    @property
+    def variance(self) -> float:
+        """样本方差(ddof=1)，数量不足2时为NaN"""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self) -> float:
+        """样本标准差(ddof=1)，数量不足2时为NaN"""
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        导出为 calculate_statistics 格式的统计量（不含中位数和分位数）
+
+        Returns:
+            Dict[str, Any]: mean/std/min/max/count/range
+        """
+        return {
+            'mean': float(self.mean),
+            'std': self.std,
+            'min': float(self.min),
+            'max': float(self.max),
+            'count': int(self.count),
+            'range': float(self.max - self.min)
+        }
+
+    def __repr__(self) -> str:
+        return f"RunningStats(count={self.count}, mean={self.mean:.6g}, std={self.std:.6g})"
+
+
+class StatsAccumulator:
+    """
+    按 (批次, 晶圆, 参数) 维护 RunningStats 的集合
+
+    用法:
+        acc = StatsAccumulator(["BVDSS1", "VTH"])
+        for df_batch in batches:
+            acc.update(df_batch)
+        stats = acc.statistics("BVDSS1", limits)
+    """
+
+    def __init__(self, params: List[str]):
+        """
+        初始化累加器集合
+
+        Args:
+            params: 参数列表
+        """
+        self.params = list(params)
+        self.stats: Dict[Tuple[str, str, str], RunningStats] = {}
+
+    def update(self, batch: pd.DataFrame) -> 'StatsAccumulator':
+        """
+        加入一批芯片数据
+
+        每个参数只做一次按晶圆的分组计算，批内统计量再逐个合并到对应的累加器中
+
+        Args:
+            batch: 数据表，包含Lot/Wafer列（缺少时按默认值处理）和参数列
+
+        Returns:
+            StatsAccumulator: 自身
+        """
+        if batch is None or len(batch) == 0:
+            return self
+
+        codes, groups = wafer_codes(batch)
+        n_groups = len(groups)
+
+        for param in self.params:
+            if param not in batch.columns:
+                continue
+            values = pd.to_numeric(batch[param], errors='coerce').to_numpy(dtype=float)
+            valid = ~np.isnan(values) & (codes >= 0)
+            if not valid.any():
+                continue
+
+            for group, moments in zip(groups, _group_running_moments(values[valid], codes[valid], n_groups)):
+                if moments[0] == 0:
+                    continue
+                key = (str(group[0]), str(group[1]), param)
+                self.stats.setdefault(key, RunningStats()).merge(RunningStats.from_moments(*moments))
+        return self
+
+    def merge(self, other: 'StatsAccumulator') -> 'StatsAccumulator':
+        """
+        合并另一个累加器集合（原地修改自身）
+
+        Args:
+            other: 另一个累加器集合
+
+        Returns:
+            StatsAccumulator: 自身
+        """
+        for param in other.params:
+            if param not in self.params:
+                self.params.append(param)
+        for key, stats in other.stats.items():
+            if key in self.stats:
+                self.stats[key].merge(stats)
+            else:
+                self.stats[key] = stats.copy()
+        return self
+
+    def combined(self, param: str, lot: Optional[str] = None, wafer: Optional[str] = None) -> RunningStats:
+        """
+        合并满足条件的所有累加器
+
+        Args:
+            param: 参数名称
+            lot: 批次号，为None时不限
+            wafer: 晶圆号，为None时不限
+
+        Returns:
+            RunningStats: 合并后的统计量
+        """
+        result = RunningStats()
+        for (key_lot, key_wafer, key_param), stats in self.stats.items():
+            if key_param == param and lot in (None, key_lot) and wafer in (None, key_wafer):
+                result.merge(stats)
+        return result
+
+    def statistics(self, param: str, limits: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """
+        导出 CPDataAnalyzer.calculate_statistics 格式的统计信息
+
+        与 calculate_statistics 一致，by_lot 按晶圆号汇总（不同批次的同号晶圆合并）。
+        累加器不保存数据本身，因此结果中没有中位数和分位数
+
+        Args:
+            param: 参数名称
+            limits: 参数限制字典
+
+        Returns:
+            Optional[Dict[str, Any]]: 统计信息字典，没有数据时返回None
+        """
+        overall = self.combined(param)
+        if overall.count == 0:
+            return None
+
+        stats = {'overall': overall.to_dict()}
+        limit = (limits or {}).get(param, {})
+        stats['overall']['upper_limit'] = limit.get('upper')
+        stats['overall']['lower_limit'] = limit.get('lower')
+
+        by_wafer = {}
+        for (_, wafer, key_param), wafer_stats in self.stats.items():
+            if key_param == param:
+                by_wafer.setdefault(wafer, RunningStats()).merge(wafer_stats)
+
+        stats['by_lot'] = {}
+        for wafer in sorted(by_wafer):
+            lot_stats = by_wafer[wafer].to_dict()
+            if lot_stats['count'] <= 1:
+                lot_stats['std'] = 0.0
+            stats['by_lot'][wafer] = lot_stats
+        return stats
+
+
+def _group_running_moments(values: np.ndarray, codes: np.ndarray,
+                           n_groups: int) -> List[Tuple[int, float, float, float, float]]:
+    """
+    计算每个分组的 (数量, 均值, M2, 最小值, 最大值)，即 RunningStats.from_moments 的参数，values中不能有NaN
+    """
+    counts, means, _, m2 = group_moments(values, codes, n_groups)
+    mins, maxs = group_extrema(values, codes, n_groups)
+    return list(zip(counts.tolist(), means.tolist(), m2.tolist(), mins.tolist(), maxs.tolist()))
+
+
+# KLL草图的默认精度参数及相邻层容量比
+KLL_DEFAULT_K = 200
+KLL_CAPACITY_RATIO = 2.0 / 3.0
+
+# 各批次输出目录中保存分位数草图的文件名
+SKETCH_FILE = 'sketches.json'
+SKETCH_FILE_VERSION = 1
+
+
+class KLLSketch:
+    """
+    KLL分位数草图（Karnin, Lang, Liberty 2016）
+
+    第h层的每个元素代表 2^h 个原始值；某层超出容量时排序后随机保留奇数位或偶数位元素，
+    晋升到上一层。草图保存的元素数不超过约 k/(1-2/3) = 3k 个，与数据量无关，且可以任意合并。
+
+    误差界：quantile(q) 返回值的真实秩与 q·n 的偏差（归一化秩误差）
+    在 k=200 时约为 1.65%（99%置信度，与Apache DataSketches的KLL实现一致），
+    误差大致与 1/k 成正比；数据量不超过最底层容量时结果是精确的。最小值和最大值始终精确
+    """
+
+    def __init__(self, k: int = KLL_DEFAULT_K, seed: Optional[int] = None):
+        """
+        初始化草图
+
+        Args:
+            k: 精度参数，越大误差越小、占用越多
+            seed: 压缩时随机选择的种子，固定后结果可复现
+        """
+        self.k = int(k)
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - 1 - level
+        return max(int(np.ceil(self.k * KLL_CAPACITY_RATIO ** depth)), 2)
+
+    def update(self, batch: Iterable[float]) -> 'KLLSketch':
+        """
+        加入一批值，NaN会被忽略
+
+        Args:
+            batch: 数值序列
+
+        Returns:
+            KLLSketch: 自身
+        """
+        values = np.asarray(batch, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """
+        合并另一个草图（原地修改自身）
+
+        Args:
+            other: 另一个草图
+
+        Returns:
+            KLLSketch: 自身
+        """
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # 元素数为奇数时留下一个，保证总权重不变
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                pairs = items[:len(items) - len(keep)]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def _weighted_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_h), 2 ** h, dtype=np.int64)
+                                  for h, items_h in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs: Iterable[float]) -> np.ndarray:
+        """
+        估计若干分位数
+
+        Args:
+            qs: 分位点列表，取值0~1
+
+        Returns:
+            np.ndarray: 分位数估计值，草图为空时为NaN
+        """
+        qs = np.asarray(list(qs), dtype=float)
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        items, cum_weights = self._weighted_items()
+        ranks = np.searchsorted(cum_weights, qs * cum_weights[-1], side='left')
+        result = items[np.minimum(ranks, len(items) - 1)]
+        result[qs <= 0] = self.min
+        result[qs >= 1] = self.max
+        return result
+
+    def quantile(self, q: float) -> float:
+        """
+        估计单个分位数
+
+        Args:
+            q: 分位点，取值0~1
+
+        Returns:
+            float: 分位数估计值
+        """
+        return float(self.quantiles([q])[0])
+
+    def rank(self, value: float) -> float:
+        """
+        估计不大于value的值所占比例（归一化秩）
+
+        Args:
+            value: 数值
+
+        Returns:
+            float: 0~1之间的比例
+        """
+        if self.n == 0:
+            return np.nan
+        items, cum_weights = self._weighted_items()
+        position = np.searchsorted(items, value, side='right')
+        return float(cum_weights[position - 1] / cum_weights[-1]) if position > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为可JSON序列化的字典"""
+        return {
+            'k': self.k,
+            'n': self.n,
+            'min': self.min if self.n else None,
+            'max': self.max if self.n else None,
+            'levels': [items.tolist() for items in self.levels]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'KLLSketch':
+        """由 to_dict 的结果恢复草图"""
+        sketch = cls(data['k'], seed=data['n'])
+        sketch.n = int(data['n'])
+        if sketch.n:
+            sketch.min = float(data['min'])
+            sketch.max = float(data['max'])
+        sketch.levels = [np.asarray(items, dtype=float) for items in data['levels']] or [np.empty(0)]
+        return sketch
+
+
+class QuantileSketchSet:
+    """
+    按 (批次, 晶圆, 参数) 维护 KLLSketch 的集合，可保存到批次输出目录并跨批次合并
+
+    用法:
+        sketches = QuantileSketchSet(["BVDSS1", "VTH"]).update(df_clean)
+        sketches.save(os.path.join(batch_output_dir, SKETCH_FILE))
+
+        merged = load_batch_sketches("./output")
+        merged.quantiles("BVDSS1", [0.1, 0.5, 0.9])
+    """
+
+    def __init__(self, params: List[str], k: int = KLL_DEFAULT_K):
+        """
+        初始化草图集合
+
+        Args:
+            params: 参数列表
+            k: 各草图的精度参数
+        """
+        self.params = list(params)
+        self.k = k
+        self.sketches: Dict[Tuple[str, str, str], KLLSketch] = {}
+
+    def update(self, batch: pd.DataFrame) -> 'QuantileSketchSet':
+        """
+        加入一批芯片数据，每个参数只做一次按晶圆的稳定排序，再按晶圆切片更新草图
+
+        Args:
+            batch: 数据表，包含Lot/Wafer列（缺少时按默认值处理）和参数列
+
+        Returns:
+            QuantileSketchSet: 自身
+        """
+        if batch is None or len(batch) == 0:
+            return self
+
+        codes, groups = wafer_codes(batch)
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        bounds = np.searchsorted(sorted_codes, np.arange(len(groups) + 1))
+
+        for param in self.params:
+            if param not in batch.columns:
+                continue
+            values = pd.to_numeric(batch[param], errors='coerce').to_numpy(dtype=float)[order]
+            for i, group in enumerate(groups):
+                wafer_values = values[bounds[i]:bounds[i + 1]]
+                if np.isnan(wafer_values).all():
+                    continue
+                key = (str(group[0]), str(group[1]), param)
+                if key not in self.sketches:
+                    self.sketches[key] = KLLSketch(self.k, seed=len(self.sketches))
+                self.sketches[key].update(wafer_values)
+        return self
+
+    def merge(self, other: 'QuantileSketchSet') -> 'QuantileSketchSet':
+        """
+        合并另一个草图集合（原地修改自身）
+
+        Args:
+            other: 另一个草图集合
+
+        Returns:
+            QuantileSketchSet: 自身
+        """
+        for param in other.params:
+            if param not in self.params:
+                self.params.append(param)
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = KLLSketch.from_dict(sketch.to_dict())
+        return self
+
+    def combined(self, param: str, lot: Optional[str] = None, wafer: Optional[str] = None) -> KLLSketch:
+        """
+        合并满足条件的所有草图
+
+        Args:
+            param: 参数名称
+            lot: 批次号，为None时不限
+            wafer: 晶圆号，为None时不限
+
+        Returns:
+            KLLSketch: 合并后的草图
+        """
+        result = KLLSketch(self.k, seed=0)
+        for (key_lot, key_wafer, key_param), sketch in self.sketches.items():
+            if key_param == param and lot in (None, key_lot) and wafer in (None, key_wafer):
+                result.merge(sketch)
+        return result
+
+    def quantiles(self, param: str, qs: Iterable[float] = (0.1, 0.5, 0.9),
+                  lot: Optional[str] = None, wafer: Optional[str] = None) -> Dict[str, float]:
+        """
+        估计参数的分位数
+
+        Args:
+            param: 参数名称
+            qs: 分位点列表
+            lot: 批次号，为None时跨所有批次
+            wafer: 晶圆号，为None时跨所有晶圆
+
+        Returns:
+            Dict[str, float]: {'q10': ..., 'q50': ..., 'q90': ...}
+        """
+        qs = list(qs)
+        values = self.combined(param, lot, wafer).quantiles(qs)
+        return {f'q{int(round(q * 100))}': float(v) for q, v in zip(qs, values)}
+
+    def save(self, path: str) -> str:
+        """
+        保存草图集合为JSON文件
+
+        Args:
+            path: 文件路径
+
+        Returns:
+            str: 文件路径
+        """
+        data = {
+            'version': SKETCH_FILE_VERSION,
+            'k': self.k,
+            'params': self.params,
+            'sketches': [{'lot': lot, 'wafer': wafer, 'param': param, 'sketch': sketch.to_dict()}
+                         for (lot, wafer, param), sketch in self.sketches.items()]
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'QuantileSketchSet':
+        """
+        从JSON文件读取草图集合
+
+        Args:
+            path: 文件路径
+
+        Returns:
+            QuantileSketchSet: 草图集合
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        sketches = cls(data['params'], data['k'])
+        for item in data['sketches']:
+            sketches.sketches[(item['lot'], item['wafer'], item['param'])] = KLLSketch.from_dict(item['sketch'])
+        return sketches
+
+
+def load_batch_sketches(output_dir: str) -> Optional[QuantileSketchSet]:
+    """
+    读取输出目录下各批次保存的分位数草图并合并
+
+    Args:
+        output_dir: 输出目录（其下每个批次一个子目录）
+
+    Returns:
+        Optional[QuantileSketchSet]: 合并后的草图集合，没有找到草图文件时返回None
+    """
+    merged = None
+    for path in sorted(glob.glob(os.path.join(output_dir, '*', SKETCH_FILE))):
+        try:
+            sketches = QuantileSketchSet.load(path)
+        except Exception as e:
+            print(f"警告: 读取分位数草图 {path} 失败: {str(e)}")
+            continue
+        merged = sketches if merged is None else merged.merge(sketches)
+    return merged
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+芯片级数据仓库查询工具
+
+对 main.py 写入的数据仓库执行SQL查询，例如:
+    python query_warehouse.py "SELECT lot_id, Wafer, X, Y, IGSS2 FROM dies WHERE product = 'NCEHSM650PBA' AND IGSS2 > 50"
+    python query_warehouse.py --partitions
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+
+from die_warehouse import DieWarehouse
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='芯片级数据仓库查询工具')
+
+    parser.add_argument('sql', type=str, nargs='?', default=None,
+                        help='SQL查询语句，芯片表名为 dies，分区目录表名为 partitions')
+
+    parser.add_argument('--db', type=str, default='./output/warehouse.db',
+                        help='数据仓库路径 (默认: ./output/warehouse.db)')
+
+    parser.add_argument('--backend', type=str, default='auto', choices=['auto', 'duckdb', 'sqlite'],
+                        help='数据仓库后端 (默认: auto，安装了duckdb时使用DuckDB)')
+
+    parser.add_argument('--partitions', action='store_true', default=False,
+                        help='列出已写入的 (产品, 批次) 分区')
+
+    parser.add_argument('--columns', action='store_true', default=False,
+                        help='列出芯片表的所有列')
+
+    parser.add_argument('--output', type=str, default=None,
+                        help='将查询结果保存为CSV文件')
+
+    parser.add_argument('--max-rows', type=int, default=50,
+                        help='终端中最多显示的行数 (默认: 50)')
+
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"错误: 数据仓库 {args.db} 不存在")
+        return 1
+
+    if args.sql is None and not args.partitions and not args.columns:
+        print("错误: 请提供SQL查询语句，或使用 --partitions / --columns")
+        return 1
+
+    with DieWarehouse(args.db, backend=args.backend) as warehouse:
+        if args.columns:
+            print("\n".join(warehouse.columns()))
+            return 0
+
+        try:
+            result = warehouse.partitions() if args.partitions else warehouse.query(args.sql)
+        except Exception as e:
+            print(f"错误: 查询失败: {str(e)}")
+            return 1
+
+    if args.output:
+        result.to_csv(args.output, index=False, encoding='utf-8-sig')
+        print(f"查询结果已保存到: {args.output}")
+
+    with pd.option_context('display.max_columns', None, 'display.width', None):
+        print(result.head(args.max_rows).to_string(index=False))
+    print(f"\n共 {len(result)} 行")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
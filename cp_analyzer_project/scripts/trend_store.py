@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+统计趋势存储模块
+
+将每次运行得到的 (产品, 批次, 晶圆, 参数) 汇总统计量、测试时间和入库时间保存到本地SQLite数据库，
+跨批次的趋势查询直接读取汇总行，不需要重新解析原始日志
+"""
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+
+from log_parser import base_lot_id, lot_test_time
+from data_analyzer import CPDataAnalyzer
+
+# 汇总表中保存的统计量列（对应 CPDataAnalyzer.capability_table 的同名列）
+TREND_STAT_COLUMNS = ['count', 'mean', 'std', 'median', 'min', 'max', 'q10', 'q25', 'q75', 'q90',
+                      'usl', 'lsl', 'cp', 'cpk', 'fail_count', 'yield']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS wafer_stats (
+    product TEXT NOT NULL,
+    lot TEXT NOT NULL,
+    wafer TEXT NOT NULL,
+    param TEXT NOT NULL,
+    batch TEXT,
+    tested_at TEXT NOT NULL,
+    ingested_at TEXT NOT NULL,
+    count INTEGER,
+    mean REAL,
+    std REAL,
+    median REAL,
+    min REAL,
+    max REAL,
+    q10 REAL,
+    q25 REAL,
+    q75 REAL,
+    q90 REAL,
+    usl REAL,
+    lsl REAL,
+    cp REAL,
+    cpk REAL,
+    fail_count INTEGER,
+    yield REAL,
+    PRIMARY KEY (product, lot, wafer, param)
+);
+CREATE INDEX IF NOT EXISTS idx_wafer_stats_product_param_tested ON wafer_stats (product, param, tested_at);
+CREATE INDEX IF NOT EXISTS idx_wafer_stats_param_tested ON wafer_stats (param, tested_at);
+CREATE INDEX IF NOT EXISTS idx_wafer_stats_lot ON wafer_stats (lot, param);
+"""
+
+
+def product_from_batch(batch_name: str) -> str:
+    """
+    从批次目录名提取产品名，例如 "NCEHSM650PBA_C127251.00@CP" -> "NCEHSM650PBA"
+
+    Args:
+        batch_name: 批次目录名
+
+    Returns:
+        str: 产品名，目录名中没有下划线时返回目录名本身
+    """
+    return batch_name.split('_', 1)[0] if '_' in batch_name else batch_name
+
+
+class TrendStore:
+    """
+    基于SQLite的每晶圆统计量趋势库
+
+    同一 (产品, 批次, 晶圆, 参数) 重复写入时覆盖旧的汇总行，重跑同一批次不会产生重复数据。
+    时间筛选和排序使用 tested_at（晶圆的测试时间，取自日志文件头或批次号），
+    ingested_at 只记录写入趋势库的时间，补录历史批次不会打乱趋势顺序
+
+    用法:
+        with TrendStore("./output/trend.db") as store:
+            store.write_statistics(analyzer, product="NCEHSM650PBA", test_times=cleaner.test_times)
+            df = store.lot_trend("NCEHSM650PBA", "BVDSS1", start="2025-01-01")
+    """
+
+    def __init__(self, path: str):
+        """
+        打开（必要时创建）趋势库
+
+        Args:
+            path: 数据库文件路径
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> 'TrendStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def write_statistics(self, analyzer: CPDataAnalyzer, product: str, batch: Optional[str] = None,
+                         ingested_at: Optional[str] = None, test_times: Optional[pd.DataFrame] = None) -> int:
+        """
+        写入一个批次各晶圆的统计量
+
+        统计量按 (批次号, 晶圆) 分组：capability_table 的晶圆行只按晶圆号分组，同一目录中有多个批次时
+        不同批次的同号晶圆会合在一起，这里对每个批次号（去掉测试站点和时间后缀）分别计算
+
+        Args:
+            analyzer: 已设置 df_clean 的 CPDataAnalyzer
+            product: 产品名
+            batch: 批次目录名，数据中没有 Lot 列时作为批次号
+            ingested_at: 入库时间（ISO格式），默认为当前时间
+            test_times: CPLogParser.test_times（列为 Lot, Wafer, TestTime），文件头中的测试时间优先于批次号中的时间
+
+        Returns:
+            int: 写入的行数
+        """
+        df_clean = analyzer.df_clean
+        if df_clean is None or df_clean.empty:
+            return 0
+
+        ingested_at = ingested_at or datetime.now().isoformat(timespec='seconds')
+
+        # 文件头中的测试时间，按 (原始批次号, 晶圆号) 查找
+        header_times = {}
+        if test_times is not None and not test_times.empty:
+            for lot, wafer, tested_at in zip(test_times['Lot'], test_times['Wafer'], test_times['TestTime']):
+                if tested_at:
+                    header_times.setdefault((str(lot), str(wafer)), tested_at)
+
+        if 'Lot' in df_clean.columns:
+            raw_lots = df_clean['Lot'].astype(str)
+            lot_ids = raw_lots.map({lot: base_lot_id(lot) for lot in pd.unique(raw_lots)})
+        else:
+            raw_lots = pd.Series(batch or 'LOT01', index=df_clean.index)
+            lot_ids = raw_lots
+
+        # 每个 (批次号, 晶圆) 的测试时间：优先取文件头，其次从批次号中的日期时间解析，重测时取最早的一次
+        tested = {}
+        pairs = pd.DataFrame({'lot': lot_ids.to_numpy(), 'raw': raw_lots.to_numpy(),
+                              'wafer': df_clean['Wafer'].astype(str).to_numpy()}).drop_duplicates()
+        for lot, raw, wafer in pairs.itertuples(index=False):
+            tested_at = header_times.get((raw, wafer)) or lot_test_time(raw)
+            if tested_at and (tested.get((lot, wafer)) is None or tested_at < tested[(lot, wafer)]):
+                tested[(lot, wafer)] = tested_at
+
+        # 只有一个批次号时直接使用分析器缓存的统计表，否则每个批次号分别计算
+        groups = lot_ids.groupby(lot_ids.to_numpy(), sort=False).indices
+        if len(groups) == 1:
+            tables = [(next(iter(groups)), analyzer.capability_table())]
+        else:
+            tables = []
+            for lot, rows in groups.items():
+                view = CPDataAnalyzer(None, analyzer.target_params, analyzer.limits)
+                view.df_clean = df_clean.iloc[rows].reset_index(drop=True)
+                tables.append((lot, view.capability_table()))
+
+        records = []
+        untimed = set()
+        names = None
+        for lot, table in tables:
+            if table is None or table.empty:
+                continue
+            wafer_rows = table[table['scope'] == 'wafer']
+            columns = [col for col in TREND_STAT_COLUMNS if col in wafer_rows.columns]
+            names = names or ['product', 'lot', 'wafer', 'param', 'batch', 'tested_at', 'ingested_at'] + columns
+            values = wafer_rows[columns].astype(float).to_numpy()
+            values = np.where(np.isnan(values), None, values).tolist()
+
+            for wafer, param, stats in zip(wafer_rows['Wafer'], wafer_rows['param'], values):
+                tested_at = tested.get((lot, str(wafer)))
+                if tested_at is None:
+                    untimed.add((lot, str(wafer)))
+                    tested_at = ingested_at
+                records.append([product, lot, str(wafer), param, batch, tested_at, ingested_at] + stats)
+
+        if not records:
+            return 0
+        if untimed:
+            print(f"警告: {len(untimed)} 片晶圆的文件头和批次号中都没有测试时间，tested_at 使用入库时间")
+
+        sql = (f"INSERT OR REPLACE INTO wafer_stats ({', '.join(names)}) "
+               f"VALUES ({', '.join(['?'] * len(names))})")
+        with self.conn:
+            self.conn.executemany(sql, records)
+        return len(records)
+
+    def query(self, product: Optional[str] = None, param: Optional[str] = None,
+              start: Optional[str] = None, end: Optional[str] = None,
+              lot: Optional[str] = None) -> pd.DataFrame:
+        """
+        查询每晶圆的汇总行
+
+        Args:
+            product: 产品名
+            param: 参数名称
+            start: 起始测试时间（含），ISO格式字符串，例如 "2025-01-01"
+            end: 结束测试时间（不含）
+            lot: 批次号
+
+        Returns:
+            pd.DataFrame: 按测试时间、批次、晶圆排序的汇总行
+        """
+        where, args = self._conditions(product, param, start, end, lot)
+        sql = f"SELECT * FROM wafer_stats {where} ORDER BY tested_at, lot, wafer"
+        return pd.read_sql_query(sql, self.conn, params=args)
+
+    def lot_trend(self, product: Optional[str] = None, param: Optional[str] = None,
+                  start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        """
+        按批次汇总的趋势：数量加权的均值、合并标准差、最值、失效数和良率
+
+        Args:
+            product: 产品名
+            param: 参数名称
+            start: 起始测试时间（含）
+            end: 结束测试时间（不含）
+
+        Returns:
+            pd.DataFrame: 每个 (产品, 参数, 批次) 一行，按批次最早的测试时间排序
+        """
+        where, args = self._conditions(product, param, start, end, None)
+        # 合并标准差：sqrt((Σ(n-1)s² + Σn·m² - N·M²) / (N-1))
+        sql = f"""
+            SELECT product, param, lot,
+                   MIN(tested_at) AS tested_at,
+                   MAX(ingested_at) AS ingested_at,
+                   COUNT(*) AS wafer_count,
+                   SUM(count) AS count,
+                   SUM(count * mean) / SUM(count) AS mean,
+                   SUM((count - 1) * COALESCE(std * std, 0)) AS within_ss,
+                   SUM(count * mean * mean) AS sum_sq_mean,
+                   MIN(min) AS min,
+                   MAX(max) AS max,
+                   SUM(fail_count) AS fail_count,
+                   MIN(cpk) AS min_cpk
+            FROM wafer_stats {where}
+            GROUP BY product, param, lot
+            ORDER BY tested_at, lot
+        """
+        trend = pd.read_sql_query(sql, self.conn, params=args)
+        if trend.empty:
+            return trend
+
+        total_ss = trend['within_ss'] + trend['sum_sq_mean'] - trend['count'] * trend['mean'] ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            trend['std'] = np.sqrt(np.maximum(total_ss, 0) / (trend['count'] - 1))
+            trend['yield'] = 1.0 - trend['fail_count'] / trend['count']
+        return trend.drop(columns=['within_ss', 'sum_sq_mean'])
+
+    def _conditions(self, product, param, start, end, lot):
+        clauses = []
+        args = []
+        for column, op, value in (('product', '=', product), ('param', '=', param),
+                                  ('tested_at', '>=', start), ('tested_at', '<', end),
+                                  ('lot', '=', lot)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                args.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return where, args
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+分箱良率核对模块
+
+按解析日志时收集的每颗芯片分箱号计算各晶圆的良品数和良率，
+与测试厂汇总表（summary CSV）按 (批次号, 晶圆号) 对照，标记不一致的晶圆
+"""
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+from log_parser import base_lot_id
+from data_analyzer import GOOD_BINS
+
+# 汇总表列名 -> 核对表列名
+SUMMARY_COLUMNS = {
+    'FAB7_LOTID': 'lot',
+    'WAFER_ID': 'Wafer',
+    'GOOD_DIE': 'summary_good',
+    'GROSS_DIE': 'summary_gross',
+    'YIELD(%)': 'summary_yield'
+}
+
+# 良率（百分比）允许的差值，汇总表中的良率保留两位小数
+YIELD_TOLERANCE = 0.01
+
+# 核对结果
+STATUS_MATCH = 'match'
+STATUS_MISMATCH = 'mismatch'
+STATUS_MISSING_SUMMARY = 'missing_summary'
+STATUS_MISSING_LOG = 'missing_log'
+
+
+def _wafer_label(wafer) -> str:
+    # 与解析器一致：整数晶圆号补齐为两位
+    text = str(wafer).strip()
+    return f"{int(text):02d}" if text.isdigit() else text
+
+
+def bin_yield(bin_data: pd.DataFrame, good_bins: Optional[List[int]] = None) -> pd.DataFrame:
+    """
+    按分箱号计算各晶圆的良品数和良率（一次分组计数）
+
+    Args:
+        bin_data: 每颗芯片一行，列为 Lot, Wafer, Bin（CPLogParser.bin_data）
+        good_bins: 合格的分箱号，默认为 GOOD_BINS
+
+    Returns:
+        pd.DataFrame: 列为 lot（生产批次号）, Wafer, gross_die, good_die, yield（百分比）
+    """
+    columns = ['lot', 'Wafer', 'gross_die', 'good_die', 'yield']
+    if bin_data is None or bin_data.empty:
+        return pd.DataFrame(columns=columns)
+
+    good_bins = GOOD_BINS if good_bins is None else good_bins
+    lots = bin_data['Lot'].astype(str)
+    lot_map = {lot: base_lot_id(lot) for lot in pd.unique(lots)}
+    good = pd.to_numeric(bin_data['Bin'], errors='coerce').isin(good_bins)
+
+    counts = pd.crosstab([lots.map(lot_map).rename('lot'), bin_data['Wafer'].astype(str).rename('Wafer')],
+                         good.rename('good'))
+    result = pd.DataFrame({
+        'gross_die': counts.sum(axis=1),
+        'good_die': counts[True] if True in counts.columns else 0
+    }).reset_index()
+    result['yield'] = result['good_die'] / result['gross_die'] * 100
+    return result[columns]
+
+
+def load_summary(summary_dir: str) -> Optional[pd.DataFrame]:
+    """
+    读取目录下所有汇总表CSV
+
+    Args:
+        summary_dir: 汇总表目录
+
+    Returns:
+        pd.DataFrame: 列为 lot, Wafer, summary_good, summary_gross, summary_yield；没有汇总表时返回None
+    """
+    if not summary_dir or not os.path.isdir(summary_dir):
+        return None
+
+    frames = []
+    for path in sorted(glob.glob(os.path.join(summary_dir, '*.csv'))):
+        try:
+            frame = pd.read_csv(path, dtype={'FAB7_LOTID': str, 'WAFER_ID': str})
+        except Exception as e:
+            print(f"警告: 读取汇总表 {path} 时出错: {str(e)}")
+            continue
+        missing = [col for col in SUMMARY_COLUMNS if col not in frame.columns]
+        if missing:
+            print(f"警告: 汇总表 {os.path.basename(path)} 缺少列 {', '.join(missing)}，已跳过")
+            continue
+        frames.append(frame[list(SUMMARY_COLUMNS)].rename(columns=SUMMARY_COLUMNS))
+
+    if not frames:
+        return None
+
+    summary = pd.concat(frames, ignore_index=True)
+    summary['lot'] = summary['lot'].str.strip()
+    summary['Wafer'] = summary['Wafer'].map(_wafer_label)
+    # 同一晶圆出现多次（复测）时以最后一行为准
+    return summary.drop_duplicates(['lot', 'Wafer'], keep='last').reset_index(drop=True)
+
+
+def reconcile_yield(computed: pd.DataFrame, summary: pd.DataFrame,
+                    tolerance: float = YIELD_TOLERANCE) -> pd.DataFrame:
+    """
+    按 (批次号, 晶圆号) 对照计算的良率和汇总表
+
+    只核对出现在日志中的批次；汇总表中这些批次的晶圆没有日志时标记为 missing_log
+
+    Args:
+        computed: bin_yield 的结果
+        summary: load_summary 的结果
+        tolerance: 良率（百分比）允许的差值
+
+    Returns:
+        pd.DataFrame: 两表的列加上 status（match / mismatch / missing_summary / missing_log），
+            按批次号、晶圆号排序
+    """
+    summary = summary[summary['lot'].isin(computed['lot'])]
+    merged = computed.merge(summary, on=['lot', 'Wafer'], how='outer', indicator=True)
+    for col in ('gross_die', 'good_die', 'summary_good', 'summary_gross'):
+        merged[col] = merged[col].astype('Int64')
+
+    differs = ((merged['good_die'] != merged['summary_good']) |
+               (merged['gross_die'] != merged['summary_gross']) |
+               ((merged['yield'] - merged['summary_yield']).abs() > tolerance + 1e-9))
+
+    merged['status'] = np.select(
+        [(merged['_merge'] == 'left_only').to_numpy(), (merged['_merge'] == 'right_only').to_numpy(),
+         differs.fillna(False).to_numpy(dtype=bool)],
+        [STATUS_MISSING_SUMMARY, STATUS_MISSING_LOG, STATUS_MISMATCH],
+        default=STATUS_MATCH
+    )
+    return merged.drop(columns=['_merge']).sort_values(['lot', 'Wafer']).reset_index(drop=True)
+
+
+def summarize_reconciliation(result: pd.DataFrame) -> dict:
+    """
+    核对结果的摘要，用于批次索引页
+
+    Args:
+        result: reconcile_yield 的结果
+
+    Returns:
+        dict: {'checked': 两表都有的晶圆数, 'mismatches': 不一致或缺失的晶圆列表}
+    """
+    issues = result[result['status'] != STATUS_MATCH]
+    mismatches = []
+    for row in issues.to_dict('records'):
+        mismatches.append({
+            'lot': row['lot'],
+            'wafer': row['Wafer'],
+            'status': row['status'],
+            'good_die': None if pd.isna(row['good_die']) else int(row['good_die']),
+            'summary_good': None if pd.isna(row['summary_good']) else int(row['summary_good']),
+            'yield': None if pd.isna(row['yield']) else float(row['yield']),
+            'summary_yield': None if pd.isna(row['summary_yield']) else float(row['summary_yield'])
+        })
+    checked = int(result['status'].isin([STATUS_MATCH, STATUS_MISMATCH]).sum())
+    return {'checked': checked, 'mismatches': mismatches}